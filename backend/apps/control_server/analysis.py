@@ -0,0 +1,256 @@
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+
+known_ips = {
+    "senders": [
+        r"127\.0\.0\.1",  # example
+    ],
+    "receivers": [
+        r"127\.0\.0\.1",  # example
+    ]
+}
+
+# ids of AccessLogs to exclude from evaluations (e.g. test logs)
+log_blacklist = []
+
+# Q filters to exclude client-side requests
+# Create Q objects for each regular expression in the lists
+_q_ip_sender_filter = [Q(ip_address__regex=regex) for regex in known_ips["senders"]]
+_q_ip_receiver_filter = [Q(ip_address__regex=regex) for regex in known_ips["receivers"]]
+
+# Combine the Q objects with OR for each list
+_q_combined_sender_filter = Q()
+for q_object in _q_ip_sender_filter:
+    _q_combined_sender_filter |= q_object
+
+_q_combined_receiver_filter = Q()
+for q_object in _q_ip_receiver_filter:
+    _q_combined_receiver_filter |= q_object
+
+# Combine the Q objects with AND for the final query
+# usage: logs.exclude(known_ip_q_filter)  # to exclude all client-side requests
+known_ip_q_filter = _q_combined_sender_filter | _q_combined_receiver_filter
+
+
+def matches_any_pattern(patterns, string):
+    return any(re.search(pattern, string) for pattern in patterns)
+
+
+# one search over all known IP patterns, same result as matches_any_pattern(senders + receivers, ip)
+_known_ip_pattern = re.compile("|".join(
+    "(?:{})".format(pattern) for pattern in known_ips["senders"] + known_ips["receivers"]
+))
+
+# resource flags, each pattern is matched (re.match) once per unique resource
+RESOURCE_PATTERNS = (
+    ("js", re.compile(r".*\.js$")),
+    # this is the one.gif file which embed.js injects
+    ("injected_gif", re.compile(r".*\.gif$")),
+    ("fingerprint", re.compile(r".*browser_info$|.*fingerprint$")),
+    ("css", re.compile(r".*\.css$")),
+    ("css_background", re.compile(r".*background\.png$")),
+    # --- image resources ---
+    ("shortcut_icon", re.compile(r".favicon\.ico$|.apple-touch-icon(?:-precomposed)?\.png$|.meta_tags\.png$")),
+    # <meta property="twitter:image">
+    ("meta_twitter_image", re.compile(r".*meta_tags\.png$|.*twitter\.png$")),
+    # <meta property="og:image">
+    ("meta_og_image", re.compile(r".*opengraph\.png$")),
+    # --- pdf ---
+    ("pdf", re.compile(r".*\.pdf$")),
+    ("logo_png", re.compile(r".*logo\.png$")),
+    # --- general stats ---
+    ("any_png", re.compile(r".*\.png$")),
+)
+
+# accesses to the same resource from one IP count as repeated if they are further apart than this
+REPEATED_ACCESS_THRESHOLD = timedelta(seconds=1)
+
+
+def filters_hash() -> str:
+    """
+    Changes whenever known_ips or log_blacklist change, stored evaluations are then recomputed.
+    """
+    content = json.dumps({"known_ips": known_ips, "log_blacklist": log_blacklist}, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def is_known_ip(ip_address) -> bool:
+    return _known_ip_pattern.search(ip_address) is not None
+
+
+class ExperimentAnalyzer(object):
+    """
+    Evaluates the AccessLogs of an Experiment in a single pass.
+
+    Memory grows with the number of unique resources and IP addresses, not with the number of logs
+    (except for the per-request `ssr_seconds_since_experiment`, which is part of the evaluation).
+    The state can be merged with the state of another batch of logs and serialized to JSON,
+    so evaluations can be updated incrementally with newly arrived logs.
+    """
+
+    # increment whenever the state or the evaluation changes, stored states of older versions are recomputed
+    VERSION = 1
+
+    def __init__(self, reference_timestamp):
+        """
+        :param reference_timestamp: the experiment's timestamp that `ssr_seconds_since_experiment` is relative to
+        """
+        self.reference_timestamp = reference_timestamp
+
+        self.num_logs = 0
+        self.num_ssrs = 0
+        self.high_water_mark = 0  # highest AccessLog id seen
+        self.ips = {}  # ip -> is a known (client-side) IP
+        self.resources = {}  # resource -> [count, first ip, multiple ips, min timestamp, max timestamp]
+        self.ssr_seconds_since_experiment = []
+
+    # *** Collecting ***
+    def add(self, absolute_url, ip_address, timestamp, log_id=0):
+        self.num_logs += 1
+        self.high_water_mark = max(self.high_water_mark, log_id)
+
+        known = self.ips.get(ip_address)
+        if known is None:
+            known = self.ips[ip_address] = is_known_ip(ip_address)
+        if not known:
+            self.num_ssrs += 1
+            self.ssr_seconds_since_experiment.append((timestamp - self.reference_timestamp).total_seconds())
+
+        resource = absolute_url.rstrip("/") if len(absolute_url) > 1 else absolute_url
+        if not resource:
+            return
+
+        stats = self.resources.get(resource)
+        if stats is None:
+            self.resources[resource] = [1, ip_address, False, timestamp, timestamp]
+        else:
+            stats[0] += 1
+            stats[2] = stats[2] or ip_address != stats[1]
+            stats[3] = min(stats[3], timestamp)
+            stats[4] = max(stats[4], timestamp)
+
+    def add_logs(self, logs):
+        """
+        :param logs: QuerySet of AccessLogs, read with a server-side cursor
+        """
+        for log in logs.only("id", "absolute_url", "ip_address", "timestamp").iterator():
+            self.add(log.absolute_url, log.ip_address, log.timestamp, log.id)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the logs collected by another analyzer with the same reference timestamp.
+        """
+        self.num_logs += other.num_logs
+        self.num_ssrs += other.num_ssrs
+        self.high_water_mark = max(self.high_water_mark, other.high_water_mark)
+        self.ips.update(other.ips)
+        self.ssr_seconds_since_experiment.extend(other.ssr_seconds_since_experiment)
+
+        for resource, (count, first_ip, multiple_ips, min_time, max_time) in other.resources.items():
+            stats = self.resources.get(resource)
+            if stats is None:
+                self.resources[resource] = [count, first_ip, multiple_ips, min_time, max_time]
+            else:
+                stats[0] += count
+                stats[2] = stats[2] or multiple_ips or first_ip != stats[1]
+                stats[3] = min(stats[3], min_time)
+                stats[4] = max(stats[4], max_time)
+        return self
+
+    # *** Serialization ***
+    def to_state(self) -> dict:
+        return {
+            "version": ExperimentAnalyzer.VERSION,
+            "num_logs": self.num_logs,
+            "num_ssrs": self.num_ssrs,
+            "high_water_mark": self.high_water_mark,
+            "ips": self.ips,
+            "resources": {
+                resource: [count, first_ip, multiple_ips, min_time.isoformat(), max_time.isoformat()]
+                for resource, (count, first_ip, multiple_ips, min_time, max_time) in self.resources.items()
+            },
+            "ssr_seconds_since_experiment": self.ssr_seconds_since_experiment,
+        }
+
+    @staticmethod
+    def from_state(state, reference_timestamp):
+        """
+        :return: ExperimentAnalyzer, or None if the state was written by another version
+        """
+        if not state or state.get("version") != ExperimentAnalyzer.VERSION:
+            return None
+
+        analyzer = ExperimentAnalyzer(reference_timestamp)
+        analyzer.num_logs = state["num_logs"]
+        analyzer.num_ssrs = state["num_ssrs"]
+        analyzer.high_water_mark = state["high_water_mark"]
+        analyzer.ips = dict(state["ips"])
+        analyzer.resources = {
+            resource: [count, first_ip, multiple_ips, datetime.fromisoformat(min_time), datetime.fromisoformat(max_time)]
+            for resource, (count, first_ip, multiple_ips, min_time, max_time) in state["resources"].items()
+        }
+        analyzer.ssr_seconds_since_experiment = list(state["ssr_seconds_since_experiment"])
+        return analyzer
+
+    # *** Evaluation ***
+    def resource_flags(self) -> set:
+        """
+        Names of the RESOURCE_PATTERNS that any loaded resource matches.
+        """
+        flags = set()
+        for resource in self.resources.keys():
+            for flag, pattern in RESOURCE_PATTERNS:
+                if flag not in flags and pattern.match(resource):
+                    flags.add(flag)
+            if len(flags) == len(RESOURCE_PATTERNS):
+                break
+        return flags
+
+    def repeated_access(self) -> bool:
+        """
+        A resource was loaded multiple times, either by different IPs or with more than a second in between.
+        """
+        for count, _, multiple_ips, min_time, max_time in self.resources.values():
+            if count > 1 and (multiple_ips or max_time - min_time > REPEATED_ACCESS_THRESHOLD):
+                return True
+        return False
+
+    def evaluation(self, geoip_resolver, root_log_count):
+        """
+        :param geoip_resolver: resolves locations and ASNs of the IPs
+        :param root_log_count: number of AccessLogs of the experiment's root honeypage, pages beyond mean it was crawled
+        :return: the experiment independent fields of Experiment.analyze()["evaluation"]
+        """
+        flags = self.resource_flags()
+
+        ips = list(set(self.ips.keys()))
+
+        # resolve each IP address once, the resolver caches results across experiments
+        ip_infos = [
+            {"ip": ip, "location": geoip_resolver.location_str(ip), "asn": geoip_resolver.asn_str(ip)} for ip in ips
+        ]
+
+        locations = list(set(ip_info["location"] for ip_info in ip_infos if not self.ips[ip_info["ip"]]))
+        asns = list(set(ip_info["asn"] for ip_info in ip_infos))
+
+        return {
+            "honeypage_accessed": self.num_logs > 0,
+            "crawled": self.num_logs > root_log_count,  # there are logs not belonging to the root
+            "repeated_access": self.repeated_access(),
+            "loaded_js": "js" in flags,
+            "executed_js": "injected_gif" in flags or "fingerprint" in flags,
+
+            "num_ssrs": self.num_ssrs,
+            "num_unique_resources_loaded": len(self.resources),
+
+            "ips": ips,
+            "asns": asns,
+            "ip_infos": ip_infos,
+            "locations": locations,
+            "ssr_seconds_since_experiment": sorted(self.ssr_seconds_since_experiment),
+        }
@@ -0,0 +1,167 @@
+import json
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+# seconds to wait before reconnecting to Redis, doubled up to the maximum after each failure
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+
+class Broadcast(object):
+    """
+    Process-to-process notifications over Redis pub/sub, using the Redis of the default cache.
+
+    Each process runs one daemon listener thread (started on the first `subscribe()`, restarted after fork)
+    that calls the subscribed callbacks with the decoded JSON message.
+    Callbacks are also called with `None` whenever the listener (re)connected, because messages may have been
+    missed in the meantime; subscribers should then treat all their state as stale.
+    Redis being unavailable is never an error for the caller: `publish()` returns False
+    and `is_listening()` tells subscribers to fall back to their own expiry.
+    """
+
+    def __init__(self, prefix="honeymessages"):
+        self.prefix = prefix
+
+        self._callbacks = {}  # channel -> [callback, ...]
+        self._thread = None
+        self._pid = None
+        self._pubsub = None
+        self._listening = False
+        self._publish_failing = False
+        self._lock = threading.Lock()
+
+    def channel_name(self, channel):
+        return "{}:{}".format(self.prefix, channel)
+
+    def publish(self, channel, message) -> bool:
+        """
+        Publishes a JSON serializable message to all processes subscribed to the channel.
+        :return: True if Redis accepted the message
+        """
+        payload = json.dumps({"sender": self._sender(), "message": message}, default=str)
+        try:
+            self._connection().publish(self.channel_name(channel), payload)
+            self._publish_failing = False
+            return True
+        except Exception as e:
+            if not self._publish_failing:
+                # once per outage, not for every message
+                print("Broadcast on {} failed: {}".format(channel, e))
+            self._publish_failing = True
+            return False
+
+    def subscribe(self, channel, callback):
+        """
+        Calls `callback(message)` for every message published on the channel by another process.
+        """
+        with self._lock:
+            self._callbacks.setdefault(self.channel_name(channel), []).append(callback)
+            if self._pubsub is not None:
+                try:
+                    # the listener is already running, extend its subscription
+                    self._pubsub.subscribe(self.channel_name(channel))
+                except Exception:
+                    pass
+        self._ensure_started()
+
+    def is_listening(self) -> bool:
+        if self._callbacks:
+            # e.g. subscribed before the worker was forked
+            self._ensure_started()
+        return self._listening
+
+    @staticmethod
+    def _sender():
+        # pids repeat across containers
+        return "{}:{}".format(socket.gethostname(), os.getpid())
+
+    @staticmethod
+    def _connection():
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._lock:
+            # threads do not survive fork(), so each (gunicorn) worker starts its own listener
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._listening = False
+                self._pubsub = None
+                self._thread = threading.Thread(target=self._run, name="broadcast-listener", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _run(self):
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                pubsub = self._connection().pubsub(ignore_subscribe_messages=True)
+                channels = set(self._callbacks.keys())
+                pubsub.subscribe(*channels)
+                with self._lock:
+                    self._pubsub = pubsub
+                    # channels subscribed while connecting
+                    new_channels = set(self._callbacks.keys()) - channels
+                    if new_channels:
+                        pubsub.subscribe(*new_channels)
+                self._listening = True
+                delay = RECONNECT_DELAY
+                self._notify_all(None)
+
+                for item in pubsub.listen():
+                    self._dispatch(item)
+            except Exception as e:
+                if self._listening:
+                    print("Broadcast listener lost Redis: {}".format(e))
+            finally:
+                self._listening = False
+                self._close()
+
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _dispatch(self, item):
+        if item.get("type") != "message":
+            return
+
+        channel = item["channel"].decode() if isinstance(item["channel"], bytes) else item["channel"]
+        try:
+            payload = json.loads(item["data"])
+        except (TypeError, ValueError):
+            return
+        if payload.get("sender") == self._sender():
+            # the publishing process handled the change itself
+            return
+
+        for callback in list(self._callbacks.get(channel, [])):
+            self._call(callback, payload.get("message"))
+
+    def _notify_all(self, message):
+        for callbacks in list(self._callbacks.values()):
+            for callback in list(callbacks):
+                self._call(callback, message)
+
+    @staticmethod
+    def _call(callback, message):
+        try:
+            callback(message)
+        except Exception as e:
+            print("Broadcast callback {} failed: {}".format(callback, e))
+
+    def _close(self):
+        with self._lock:
+            pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+
+broadcast = Broadcast(settings.BROADCAST_CHANNEL_PREFIX)
@@ -0,0 +1,137 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.reverse import reverse
+
+FIELDS_PARAM = "fields"
+OMIT_PARAM = "omit"
+
+
+def _names(request, param):
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    return set(name.strip() for name in value.split(",") if name.strip())
+
+
+class SparseFieldsetSerializerMixin(object):
+    """
+    Serializes only the fields named in `?fields=` (comma separated) and none of those in `?omit=`.
+
+    Unrequested fields are removed before serialization, so the properties behind them are never evaluated.
+    Only applies to the serializer created by the view for reading (nested serializers are not trimmed).
+    Fields a subclass adds in to_representation() should be added only if `is_requested(name)`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._requested = None
+        self._omitted = set()
+
+        request = kwargs.get("context", {}).get("request")
+        if request is None or request.method not in SAFE_METHODS:
+            return
+
+        self._requested = _names(request, FIELDS_PARAM)
+        self._omitted = _names(request, OMIT_PARAM) or set()
+        for name in list(self.fields.keys()):
+            if not self.is_requested(name):
+                self.fields.pop(name)
+
+    def is_requested(self, name) -> bool:
+        if name in self._omitted:
+            return False
+        return self._requested is None or name in self._requested
+
+
+def sparse_queryset(queryset, serializer, deferrable_fields):
+    """
+    Defers the deferrable (large) model fields that none of the serializer's fields reads.
+    Deferrable one-to-one relations (e.g. the AccessLog payload) are joined if a field reads them, and not
+    loaded otherwise.
+    :param serializer: serializer instance, already trimmed to the requested fields
+    """
+    sources = set()
+    for field in serializer.fields.values():
+        if field.source == "*":
+            # the field reads the whole instance, e.g. a custom to_representation
+            if field.field_name != "url":
+                return queryset
+        else:
+            sources.add(field.source.split(".")[0])
+
+    relations = set(name for name in deferrable_fields if queryset.model._meta.get_field(name).is_relation)
+    deferred = [name for name in deferrable_fields if name not in sources and name not in relations]
+    joined = [name for name in deferrable_fields if name in sources and name in relations]
+    if joined:
+        queryset = queryset.select_related(*joined)
+    return queryset.defer(*deferred) if deferred else queryset
+
+
+class SparseFieldsetViewSetMixin(object):
+    """
+    Loads `deferrable_fields` (large TextFields or one-to-one relations holding them) only if the serializer will
+    output them, e.g. AccessLog headers aren't read from the database for `?fields=id,ip_address,timestamp`.
+    """
+    deferrable_fields = ()
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not self.deferrable_fields or self.request.method not in SAFE_METHODS:
+            return queryset
+        return sparse_queryset(queryset, self.get_serializer(), self.deferrable_fields)
+
+
+EMBED_PARAM = "embed"
+EMBED_LIMIT_PARAM = "embed_limit"
+
+
+class RelationSummaryField(serializers.Field):
+    """
+    Summarizes a to-many relation as `{"count": ..., "url": ...}`, the url being the paginated sub-endpoint,
+    instead of linking every related object (a popular experiment has hundreds of thousands of logs).
+
+    With `?embed=<field name>` (comma separated) the first `?embed_limit=` (default 100, at most 1000) related
+    objects are linked as well, in "results".
+    """
+    default_embed_limit = 100
+    max_embed_limit = 1000
+
+    def __init__(self, view_name, list_view_name, **kwargs):
+        """
+        :param view_name: detail view of the related objects
+        :param list_view_name: view listing the related objects of an instance (pk argument)
+        """
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+        self.view_name = view_name
+        self.list_view_name = list_view_name
+
+    def get_attribute(self, instance):
+        # the relation is read in to_representation, which needs the instance for the url
+        return instance
+
+    def to_representation(self, instance):
+        request = self.context.get("request")
+        related = getattr(instance, self.source)
+        if hasattr(related, "all"):
+            # a related manager
+            related = related.all()
+
+        summary = {
+            "count": related.count(),
+            "url": reverse(self.list_view_name, args=(instance.pk,), request=request),
+        }
+        if request is not None and self.field_name in (_names(request, EMBED_PARAM) or ()):
+            summary["results"] = [
+                reverse(self.view_name, args=(pk,), request=request)
+                for pk in related.values_list("pk", flat=True)[:self._embed_limit(request)]
+            ]
+        return summary
+
+    def _embed_limit(self, request):
+        try:
+            limit = int(request.query_params.get(EMBED_LIMIT_PARAM, self.default_embed_limit))
+        except ValueError:
+            limit = self.default_embed_limit
+        return max(0, min(limit, self.max_embed_limit))
@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.gis.geoip2.resources import City
+from geoip2.database import Reader as GeoIP2Reader
+from maxminddb import MODE_MMAP
+
+CITY_DATABASE = "GeoLite2-City.mmdb"
+ASN_DATABASE = "GeoLite2-ASN.mmdb"
+
+# raw geoip2 responses, None if the database is missing or has no entry for the address
+GeoIPResult = namedtuple("GeoIPResult", ["city", "asn"])
+
+
+class GeoIPResolver(object):
+    """
+    Shared GeoIP2 resolver for request logging and experiment analysis.
+
+    The City and ASN databases are opened lazily in MMAP mode, so forked workers share the pages.
+    Results are kept in a bounded LRU per IP address; crawlers reuse a small set of addresses,
+    so most lookups are dictionary hits. See `cache_info()` for hit and miss counters.
+    """
+
+    def __init__(self, path, cache_size=65536):
+        self.path = path
+        self._readers = {}
+        self._lock = threading.Lock()
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _reader(self, file_name):
+        if file_name not in self._readers:
+            with self._lock:
+                if file_name not in self._readers:
+                    file_path = os.path.join(self.path, file_name)
+                    try:
+                        self._readers[file_name] = GeoIP2Reader(file_path, mode=MODE_MMAP)
+                    except Exception as e:
+                        print("GeoIP database {} can't be opened: {}".format(file_path, e))
+                        self._readers[file_name] = None
+
+        return self._readers[file_name]
+
+    def _lookup(self, ip_address) -> GeoIPResult:
+        return GeoIPResult(
+            city=self._query(CITY_DATABASE, "city", ip_address),
+            asn=self._query(ASN_DATABASE, "asn", ip_address),
+        )
+
+    def _query(self, file_name, method, ip_address):
+        reader = self._reader(file_name)
+        if reader is None:
+            return None
+
+        try:
+            return getattr(reader, method)(ip_address)
+        except Exception:
+            # AddressNotFoundError or not a valid IP address
+            return None
+
+    def cache_info(self):
+        return self.lookup.cache_info()
+
+    def cache_clear(self):
+        self.lookup.cache_clear()
+
+    def city(self, ip_address):
+        """
+        City information in the format of django.contrib.gis.geoip2.GeoIP2.city().
+        :return: dict or None
+        """
+        response = self.lookup(ip_address).city
+        return City(response) if response else None
+
+    def location_str(self, ip_address) -> str:
+        """
+        Location as "<ISO code>/<country>[/<subdivision>][/<city>]", empty if unknown.
+        """
+        response = self.lookup(ip_address).city
+        if not response:
+            return ""
+
+        return f"{response.country.iso_code}/{response.country.name}" \
+               f"{('/' + response.subdivisions.most_specific.name) if response.subdivisions.most_specific.name else ''}" \
+               f"{('/' + response.city.name) if response.city.name else ''}"
+
+    def asn_str(self, ip_address) -> str:
+        """
+        Autonomous system as "<number>/<organization>", empty if unknown.
+        """
+        response = self.lookup(ip_address).asn
+        if not response:
+            return ""
+
+        return f"{response.autonomous_system_number}/{response.autonomous_system_organization}"
+
+
+geoip_resolver = GeoIPResolver(settings.GEOIP_PATH, settings.GEOIP_CACHE_SIZE)
@@ -0,0 +1,239 @@
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from control_server.models import Experiment
+
+FORMATS = ("jsonl", "csv", "parquet")
+
+# columns of Experiment.analyze()["evaluation"], in order
+EVALUATION_FIELDS = (
+    "experiment_id", "experiment_type", "honeypage_accessed", "crawled", "repeated_access", "loaded_js",
+    "executed_js", "num_ssrs", "num_unique_resources_loaded", "ips", "asns", "ip_infos", "locations",
+    "ssr_seconds_since_experiment"
+)
+
+
+def _init_worker():
+    # connections inherited from the parent must not be shared, each worker opens its own
+    connections.close_all()
+
+
+def _evaluate(experiment_id, duration_seconds, use_cache=True):
+    """
+    Runs in a worker process.
+    :return: (experiment_id, evaluation or None, error or None)
+    """
+    try:
+        experiment = Experiment.objects.get(id=experiment_id)
+        duration = timedelta(seconds=duration_seconds) if duration_seconds else None
+        return experiment_id, experiment.analyze(duration, use_cache=use_cache)["evaluation"], None
+    except Exception as e:
+        return experiment_id, None, "{}: {}".format(type(e).__name__, e)
+
+
+class FileWriter(object):
+    """
+    Writes to a text file, which it closes unless it is stdout.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def close(self):
+        self.file.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class JSONLinesWriter(FileWriter):
+    def write(self, evaluation):
+        self.file.write(json.dumps(evaluation, default=str) + "\n")
+
+
+class CSVWriter(FileWriter):
+    """
+    One row per experiment, lists are written as JSON.
+    """
+
+    def __init__(self, file):
+        super().__init__(file)
+        self.writer = csv.DictWriter(file, fieldnames=EVALUATION_FIELDS, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, evaluation):
+        self.writer.writerow({
+            key: json.dumps(value, default=str) if isinstance(value, (list, dict)) else value
+            for key, value in evaluation.items()
+        })
+
+
+class ParquetWriter(object):
+    """
+    Writes row groups of `batch_size` experiments, lists are kept as Parquet lists.
+    """
+
+    def __init__(self, path, batch_size=100):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise CommandError("Parquet export requires pyarrow (pip install pyarrow)")
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("experiment_id", pa.int64()),
+            ("experiment_type", pa.string()),
+            ("honeypage_accessed", pa.bool_()),
+            ("crawled", pa.bool_()),
+            ("repeated_access", pa.bool_()),
+            ("loaded_js", pa.bool_()),
+            ("executed_js", pa.bool_()),
+            ("num_ssrs", pa.int64()),
+            ("num_unique_resources_loaded", pa.int64()),
+            ("ips", pa.list_(pa.string())),
+            ("asns", pa.list_(pa.string())),
+            ("ip_infos", pa.list_(pa.struct([
+                ("ip", pa.string()), ("location", pa.string()), ("asn", pa.string())
+            ]))),
+            ("locations", pa.list_(pa.string())),
+            ("ssr_seconds_since_experiment", pa.list_(pa.float64())),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch_size = batch_size
+        self.rows = []
+
+    def write(self, evaluation):
+        self.rows.append({key: evaluation.get(key) for key in EVALUATION_FIELDS})
+        if len(self.rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+class Command(BaseCommand):
+    """Evaluates experiments in parallel and exports the evaluations as JSON Lines, CSV or Parquet"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--messenger", action="append", default=[],
+            help="only experiments with this messenger (name or id), can be repeated"
+        )
+        parser.add_argument("--finished-after", help="only experiments finished at or after this date(time)")
+        parser.add_argument("--finished-before", help="only experiments finished before this date(time)")
+        parser.add_argument(
+            "--experiment-duration", type=float, default=None,
+            help="only consider logs up to this many seconds after the experiment was created"
+        )
+        parser.add_argument(
+            "--no-cache", action="store_true", help="evaluate all logs instead of updating stored evaluations"
+        )
+        parser.add_argument("--format", choices=FORMATS, default=None, help="default: from the output file name")
+        parser.add_argument("--output", "-o", default="-", help="output file, - for stdout (not for parquet)")
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count() or 1, help="worker processes, 1 evaluates in-process"
+        )
+
+    def handle(self, *args, **options):
+        experiment_ids = list(self._experiments(options).values_list("id", flat=True))
+        output_format = options["format"] or self._format_from_path(options["output"])
+        writer = self._writer(output_format, options["output"])
+
+        total = len(experiment_ids)
+        done = failed = 0
+        started = time.monotonic()
+        try:
+            for experiment_id, evaluation, error in self._evaluate_all(
+                    experiment_ids, options["experiment_duration"], not options["no_cache"], options["workers"]):
+                done += 1
+                if error:
+                    failed += 1
+                    self.stderr.write("\nExperiment {} failed: {}".format(experiment_id, error))
+                else:
+                    writer.write(evaluation)
+                self.stderr.write("\r{}/{} experiments evaluated, {} failed ({:.0f}s)".format(
+                    done, total, failed, time.monotonic() - started
+                ), ending="")
+        finally:
+            writer.close()
+            self.stderr.write("")
+
+    @staticmethod
+    def _evaluate_all(experiment_ids, duration_seconds, use_cache, workers):
+        if workers <= 1:
+            for experiment_id in experiment_ids:
+                yield _evaluate(experiment_id, duration_seconds, use_cache)
+            return
+
+        # close the parent's connections before forking, workers open their own
+        connections.close_all()
+        with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("fork"), initializer=_init_worker
+        ) as executor:
+            futures = [
+                executor.submit(_evaluate, experiment_id, duration_seconds, use_cache)
+                for experiment_id in experiment_ids
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _experiments(self, options):
+        experiments = Experiment.objects.order_by("id")
+
+        if options["messenger"]:
+            ids = [messenger for messenger in options["messenger"] if messenger.isdigit()]
+            names = [messenger for messenger in options["messenger"] if not messenger.isdigit()]
+            experiments = experiments.filter(messenger_id__in=ids) | experiments.filter(messenger__name__in=names)
+
+        if options["finished_after"]:
+            experiments = experiments.filter(finished_at__gte=self._parse_datetime(options["finished_after"]))
+        if options["finished_before"]:
+            experiments = experiments.filter(finished_at__lt=self._parse_datetime(options["finished_before"]))
+
+        return experiments
+
+    @staticmethod
+    def _parse_datetime(value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError("Invalid date: {}".format(value))
+            parsed = timezone.datetime(date.year, date.month, date.day)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    @staticmethod
+    def _format_from_path(path):
+        extension = os.path.splitext(path)[1].lstrip(".").lower()
+        if extension == "json":
+            extension = "jsonl"
+        return extension if extension in FORMATS else "jsonl"
+
+    @staticmethod
+    def _writer(output_format, path):
+        if output_format == "parquet":
+            if path == "-":
+                raise CommandError("Parquet can't be written to stdout, use --output")
+            return ParquetWriter(path)
+
+        file = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+        return CSVWriter(file) if output_format == "csv" else JSONLinesWriter(file)
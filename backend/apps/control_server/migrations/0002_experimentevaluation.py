@@ -0,0 +1,34 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('control_server', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperimentEvaluation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('experiment_duration', models.FloatField(blank=True, null=True)),
+                ('parameters_key', models.CharField(max_length=64)),
+                ('parameters', models.JSONField(default=dict)),
+                ('evaluation', models.JSONField(default=dict)),
+                ('analyzer_state', models.JSONField(default=dict)),
+                ('high_water_mark', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='evaluations', to='control_server.experiment')),
+            ],
+            options={
+                'verbose_name': 'Experiment Evaluation',
+                'db_table': 'control_server_experiment_evaluations',
+                'ordering': ['-pk'],
+                'unique_together': {('experiment', 'parameters_key')},
+            },
+        ),
+    ]
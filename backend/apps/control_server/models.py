@@ -1,56 +1,27 @@
-import os
-import re
-from collections import defaultdict
-from datetime import timedelta
+import hashlib
+import json
 
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, models, transaction
+from django.db.models import Max, Q
 
 from honeypot.models import (
     AccessLog,
     Honeypage,
     Honeymail,
-    FingerprintLog, BrowserFingerprintLog
+    FingerprintLog, BrowserFingerprintLog,
+    WITHOUT_CORRELATION_KEYS
 )
 
+from .analysis import (  # known_ips and its filters used to be defined here
+    ExperimentAnalyzer,
+    filters_hash,
+    known_ips,
+    known_ip_q_filter,
+    log_blacklist,
+    matches_any_pattern
+)
+from .geoip import geoip_resolver
 from .time import now
-from geoip2.database import Reader as GeoIP2Reader
-
-_db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../run/geoip/')
-geoip2_city_reader = GeoIP2Reader(os.path.join(_db_path, "GeoLite2-City.mmdb"))
-geoip2_asn_reader = GeoIP2Reader(os.path.join(_db_path, "GeoLite2-ASN.mmdb"))
-
-known_ips = {
-    "senders": [
-        r"127\.0\.0\.1",  # example
-    ],
-    "receivers": [
-        r"127\.0\.0\.1",  # example
-    ]
-}
-
-# Q filters to exclude client-side requests
-# Create Q objects for each regular expression in the lists
-_q_ip_sender_filter = [Q(ip_address__regex=regex) for regex in known_ips["senders"]]
-_q_ip_receiver_filter = [Q(ip_address__regex=regex) for regex in known_ips["receivers"]]
-
-# Combine the Q objects with OR for each list
-_q_combined_sender_filter = Q()
-for q_object in _q_ip_sender_filter:
-    _q_combined_sender_filter |= q_object
-
-_q_combined_receiver_filter = Q()
-for q_object in _q_ip_receiver_filter:
-    _q_combined_receiver_filter |= q_object
-
-# Combine the Q objects with AND for the final query
-# usage: logs.exclude(known_ip_q_filter)  # to exclude all client-side requests
-known_ip_q_filter = _q_combined_sender_filter | _q_combined_receiver_filter
-
-
-def matches_any_pattern(patterns, string):
-    return any(re.search(pattern, string) for pattern in patterns)
-
 
 class Messenger(models.Model):
     name = models.CharField(max_length=64, blank=False, null=False, unique=True)
@@ -144,6 +115,13 @@ class Experiment(models.Model):
     def messenger_str(self):
         return self.messenger.name if self.messenger else None
 
+    @property
+    def reference_timestamp(self):
+        """
+        The most relevant timestamp of the experiment, request times are measured relative to it.
+        """
+        return self.finished_at or self.start_at or self.created_at
+
     def is_valid(self):
         """Returns True if the experiment is fully configured."""
         if not self.messenger:
@@ -188,11 +166,10 @@ class Experiment(models.Model):
         :return: FilterSet or []
         """
         if self.honeypage:
-            logs = self.honeypage.fingerprint_logs
-            for page in list(iter(self.honeypage)):
-                logs |= page.fingerprint_logs  # combine FilterSet
-
-            return logs
+            return FingerprintLog.objects.filter(
+                Q(honeypage__in=self.honeypage.subtree)
+                | (WITHOUT_CORRELATION_KEYS & Q(visited_url__in=self.honeypage.subtree_links))
+            )
 
         return FingerprintLog.objects.none()
 
@@ -204,11 +181,10 @@ class Experiment(models.Model):
         :return: FilterSet or []
         """
         if self.honeypage:
-            logs = self.honeypage.browser_fingerprint_logs
-            for page in list(iter(self.honeypage)):
-                logs |= page.browser_fingerprint_logs  # combine FilterSet
-
-            return logs
+            return BrowserFingerprintLog.objects.filter(
+                Q(honeypage__in=self.honeypage.subtree)
+                | (WITHOUT_CORRELATION_KEYS & Q(visited_url__in=self.honeypage.subtree_links))
+            )
 
         return BrowserFingerprintLog.objects.none()
 
@@ -220,170 +196,48 @@ class Experiment(models.Model):
         :return: FilterSet or []
         """
         if self.honeypage:
-            logs = self.honeypage.access_logs
-            for page in list(iter(self.honeypage)):
-                logs |= page.access_logs  # combine FilterSet
-
-            return logs
+            subtree = self.honeypage.subtree
+            return AccessLog.objects.filter(
+                Q(honeypage__in=subtree) | (WITHOUT_CORRELATION_KEYS & Q(subdomain__in=subtree.values("subdomain"))),
+                user__isnull=True,
+                # the honeypage is published with the experiment, the bound lets PostgreSQL skip older partitions
+                timestamp__gte=self.created_at
+            )
         return AccessLog.objects.none()
 
-    def analyze(self, experiment_duration=None):
+    def evaluated_logs(self, experiment_duration=None):
+        """
+        The AccessLogs that are evaluated, all or only those within experiment_duration after the experiment's creation.
+        """
+        logs = self.access_logs.exclude(id__in=log_blacklist)
+        if experiment_duration:
+            logs = logs.filter(timestamp__lt=self.created_at + experiment_duration)
+        return logs
+
+    def analyze(self, experiment_duration=None, use_cache=True):
         """
         Can be used to evaluate an Experiment. Provide max_log_timestamp to reduce scope to a specific duration after
         the experiment.
         @param experiment_duration: allows passing a cut-off time
+        @param use_cache: reuse (and update) the stored ExperimentEvaluation instead of reading all logs
         @return:
         """
-        log_blacklist = []  # to exclude test logs
-        # all logs or filtered by time
-        _logs = (self.access_logs.exclude(id__in=log_blacklist)
-                 .filter(timestamp__lt=self.created_at + experiment_duration)) \
-            if experiment_duration \
-            else self.access_logs.exclude(id__in=log_blacklist)
-
-        _ssrs = _logs.exclude(known_ip_q_filter)
-
-        _not_our_logs = _logs.exclude(known_ip_q_filter)
-
-        # collects the loaded resources (e.g. "/", "/favicon.ico")
-        _resources_loaded = []
-        for _log in _logs:
-            _resource = _log.absolute_url.rstrip('/') if len(_log.absolute_url) > 1 else _log.absolute_url
-            if _resource:
-                _resources_loaded.append(_resource)
-        _unique_resources_loaded = sorted(list(set(_resources_loaded)))
-
-        _resources_loaded_by = defaultdict(list)
-        for _log in _logs:
-            _resource = _log.absolute_url.rstrip('/') if len(_log.absolute_url) > 1 else _log.absolute_url
-            _requester = _log.ip_address
-            _time = _log.timestamp
-            if _resource:
-                _resources_loaded_by[_resource].append([_requester, _time])
-
-        # some evaluation flags
-        _honeypage_requested = _logs.count() > 0
-        _honeypages_crawled = len(_logs) > len(self.honeypage.access_logs)  # there are logs not belonging to the root
-        _loaded_js = len([x for x in _resources_loaded if re.match(r".*\.js$", x)]) > 0
-
-        # this is the one.gif file which embed.js injects
-        _loaded_injected_gif = len([x for x in _resources_loaded if re.match(r".*\.gif$", x)]) > 0
-        _sent_fingerprint = len([x for x in _resources_loaded if re.match(r".*browser_info$|.*fingerprint$", x)]) > 0
-        _executed_js = _loaded_injected_gif | _sent_fingerprint
-
-        _loaded_css = len([x for x in _resources_loaded if re.match(r".*\.css$", x)]) > 0
-        _applied_css_background = len([x for x in _resources_loaded if re.match(r".*background\.png$", x)]) > 0
-
-        # --- image resources ---
-        _loaded_shortcut_icon = len([
-            x for x in _resources_loaded if re.match(
-                r".favicon\.ico$|.apple-touch-icon(?:-precomposed)?\.png$|.meta_tags\.png$",
-                x
-            )
-        ]) > 0
-
-        # <meta property="twitter:image">
-        _loaded_meta_twitter_image = len([
-            x for x in _resources_loaded if re.match(r".*meta_tags\.png$|.*twitter\.png$", x)
-        ]) > 0
-
-        # <meta property="og:image">
-        _loaded_meta_og_image = len([x for x in _resources_loaded if re.match(r".*opengraph\.png$", x)]) > 0
-
-        # --- pdf ---
-        _loaded_pdf = len([x for x in _resources_loaded if re.match(r".*\.pdf$", x)]) > 0
-
-        _loaded_logo_png = len([x for x in _resources_loaded if re.match(r".*logo\.png$", x)]) > 0
-
-        # --- general stats ---
-        _loaded_any_png = len([x for x in _resources_loaded if re.match(r".*\.png$", x)]) > 0
-
-        ips = list(set(map(lambda x: x.ip_address, _logs)))
-
-        def asn_from_ip(_ip_address):
-            try:
-                res = geoip2_asn_reader.asn(_ip_address)
-                return f"{res.autonomous_system_number}/{res.autonomous_system_organization}"
-            except:
-                return ""
-
-        def city_from_ip(_ip_address):
-            try:
-                _res = geoip2_city_reader.city(_ip_address)
-                return f"{_res.country.iso_code}/{_res.country.name}" \
-                       f"{('/' + _res.subdivisions.most_specific.name) if _res.subdivisions.most_specific.name else ''}"\
-                       f"{('/' + _res.city.name) if _res.city.name else ''}"
-            except:
-                return ""
-
-        ip_infos = [{"ip": ip, "location": city_from_ip(ip), "asn": asn_from_ip(ip)} for ip in ips]
-
-        locations = list(set(
-            filter(
-                lambda x: x is not None,
-                map(
-                    lambda x: city_from_ip(x.ip_address) if (
-                        not matches_any_pattern(known_ips["senders"] + known_ips["receivers"], x.ip_address)
-                    ) else None,
-                    _logs
-                )
-            )
-        ))
-
-        asns = list(set(map(lambda x: asn_from_ip(x.ip_address), _logs)))
-
-        def has_duplicates(lst):
-            return len(lst) != len(set(lst))
-
-        def find_duplicates(lst):
-            seen = set()
-            duplicates = set()
-            for item in lst:
-                if item in seen:
-                    duplicates.add(item)
-                else:
-                    seen.add(item)
-            return list(duplicates)
-
-        ssr_seconds_since_experiment = sorted(
-            list(
-                map(
-                    lambda x: x.seconds_since_experiment,
-                    filter(
-                        lambda x: not matches_any_pattern(known_ips["senders"] + known_ips["receivers"], x.ip_address),
-                        _logs
-                    )
-                )
-            )
-        )
+        if use_cache:
+            evaluation = ExperimentEvaluation.get_current(self, experiment_duration).evaluation
+        else:
+            analyzer = ExperimentAnalyzer(self.reference_timestamp).add_logs(self.evaluated_logs(experiment_duration))
+            evaluation = self.build_evaluation(analyzer)
 
-        def check_time_difference(timestamps_list, threshold_s):
-            for i in range(len(timestamps_list)):
-                for j in range(i + 1, len(timestamps_list)):
-                    time_delta = abs(timestamps_list[i] - timestamps_list[j])
-                    if time_delta > timedelta(seconds=threshold_s):
-                        return True
-            return False
+        return {
+            "experiment_id": self.id,
+            "evaluation": evaluation
+        }
 
-        repeated_access = False
-        multiple_accesses_to_resource = has_duplicates(_resources_loaded)  # same resource was accessed multiple times
-
-        if multiple_accesses_to_resource:
-            _duplicate_res = find_duplicates(_resources_loaded)  # the resources that were accessed multiple times
-            for res in _duplicate_res:
-                accesses = _resources_loaded_by[res]
-                _ips = [sublist[0] for sublist in accesses]
-                if len(set(_ips)) > 1:
-                    # repeated access
-                    repeated_access = True
-                    break
-                else:
-                    threshold = 1
-                    seconds = [sublist[1] for sublist in accesses]
-                    if check_time_difference(seconds, threshold):
-                        # repeated access
-                        repeated_access = True
-                        break
+    def build_evaluation(self, analyzer):
+        """
+        The evaluation dict of this experiment from the analyzed logs.
+        """
+        _root_log_count = self.honeypage.access_logs.count() if self.honeypage else 0
 
         experiment_type = "honeypage" if self.with_honeypage \
             else "suspicious_honeypage" if self.with_suspicious_honeypage \
@@ -392,24 +246,8 @@ class Experiment(models.Model):
 
         return {
             "experiment_id": self.id,
-            "evaluation": {
-                "experiment_id": self.id,
-                "experiment_type": experiment_type,
-                "honeypage_accessed": _honeypage_requested,
-                "crawled": _honeypages_crawled,
-                "repeated_access": repeated_access,
-                "loaded_js": _loaded_js,
-                "executed_js": _executed_js,
-
-                "num_ssrs": _ssrs.count(),
-                "num_unique_resources_loaded": len(_unique_resources_loaded),
-
-                "ips": ips,
-                "asns": asns,
-                "ip_infos": ip_infos,
-                "locations": locations,
-                "ssr_seconds_since_experiment": ssr_seconds_since_experiment,
-            }
+            "experiment_type": experiment_type,
+            **analyzer.evaluation(geoip_resolver, _root_log_count),
         }
 
     class Meta:
@@ -417,3 +255,108 @@ class Experiment(models.Model):
         db_table = "control_server_experiments"
         verbose_name = "Experiments"
         ordering = ["-pk"]
+
+
+class ExperimentEvaluation(models.Model):
+    """
+    Stored result of Experiment.analyze() for one set of parameters.
+
+    `high_water_mark` is the highest id of the experiment's AccessLogs (of all its logs, not only the evaluated ones)
+    inserted more than ACCESS_LOG_COMMIT_LAG before the evaluation (see AccessLogQuerySet.committed): ids are not
+    committed in id order, a log inserted since may have a lower id.
+    As long as no such log with a higher id exists, the evaluation is current.
+    Otherwise, only the newer logs are added to the stored analyzer state.
+    """
+    experiment = models.ForeignKey(
+        Experiment, on_delete=models.CASCADE, related_name="evaluations", blank=False, null=False
+    )
+    experiment_duration = models.FloatField(null=True, blank=True)  # seconds, None for all logs
+    parameters_key = models.CharField(max_length=64, blank=False, null=False)
+    parameters = models.JSONField(default=dict)
+
+    evaluation = models.JSONField(default=dict)
+    analyzer_state = models.JSONField(default=dict)
+    high_water_mark = models.BigIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "Evaluation of {} (up to log #{})".format(self.experiment_id, self.high_water_mark)
+
+    @property
+    def etag(self):
+        return '"{}-{}-{}"'.format(self.experiment_id, self.parameters_key[:16], self.high_water_mark)
+
+    @staticmethod
+    def build_parameters(experiment, experiment_duration=None):
+        """
+        Everything besides the logs that the evaluation depends on.
+        """
+        return {
+            "experiment_duration": experiment_duration.total_seconds() if experiment_duration else None,
+            "reference_timestamp": experiment.reference_timestamp.isoformat(),
+            "filters": filters_hash(),
+            "analyzer_version": ExperimentAnalyzer.VERSION,
+        }
+
+    @staticmethod
+    def get_current(experiment, experiment_duration=None):
+        """
+        Returns the stored evaluation if no newer logs exist, otherwise updates or computes it.
+        :return: ExperimentEvaluation
+        """
+        parameters = ExperimentEvaluation.build_parameters(experiment, experiment_duration)
+        parameters_key = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
+
+        stored = ExperimentEvaluation.objects.filter(experiment=experiment, parameters_key=parameters_key).first()
+        analyzer = ExperimentAnalyzer.from_state(stored.analyzer_state, experiment.reference_timestamp) \
+            if stored else None
+
+        committed_logs = experiment.access_logs.committed()
+        if analyzer is None:
+            high_water_mark = committed_logs.aggregate(Max("id"))["id__max"] or 0
+            analyzer = ExperimentAnalyzer(experiment.reference_timestamp)
+            # logs arriving meanwhile are added with the next update
+            analyzer.add_logs(experiment.evaluated_logs(experiment_duration).filter(id__lte=high_water_mark))
+        else:
+            high_water_mark = committed_logs.filter(
+                id__gt=stored.high_water_mark
+            ).aggregate(Max("id"))["id__max"]
+            if high_water_mark is None:
+                return stored
+
+            analyzer.add_logs(experiment.evaluated_logs(experiment_duration).filter(
+                id__gt=stored.high_water_mark, id__lte=high_water_mark
+            ))
+
+        evaluation = stored or ExperimentEvaluation(
+            experiment=experiment,
+            experiment_duration=parameters["experiment_duration"],
+            parameters_key=parameters_key,
+            parameters=parameters,
+        )
+        evaluation.evaluation = experiment.build_evaluation(analyzer)
+        evaluation.analyzer_state = analyzer.to_state()
+        evaluation.high_water_mark = high_water_mark
+
+        try:
+            with transaction.atomic():
+                evaluation.save()
+        except IntegrityError:
+            # evaluated concurrently by another request, which is just as current
+            pass
+
+        if stored is None:
+            # evaluations with outdated parameters (e.g. the experiment finished since) are not needed anymore
+            ExperimentEvaluation.objects.filter(
+                experiment=experiment, experiment_duration=parameters["experiment_duration"]
+            ).exclude(parameters_key=parameters_key).delete()
+
+        return evaluation
+
+    class Meta:
+        app_label = "control_server"
+        db_table = "control_server_experiment_evaluations"
+        verbose_name = "Experiment Evaluation"
+        ordering = ["-pk"]
+        unique_together = [["experiment", "parameters_key"]]
@@ -3,20 +3,19 @@ from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 
+from control_server.fieldsets import RelationSummaryField, SparseFieldsetSerializerMixin
 from control_server.models import Messenger, Experiment
 from control_server.time import now
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class UserSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     username = serializers.CharField()
     first_name = serializers.CharField()
     last_name = serializers.CharField()
     experiments = serializers.HyperlinkedRelatedField(
         many=True, view_name="experiment-detail", read_only=True
     )
-    fingerprints = serializers.HyperlinkedRelatedField(
-        many=True, view_name="fingerprint-detail", read_only=True
-    )
+    fingerprints = RelationSummaryField(view_name="fingerprint-detail", list_view_name="user-get-fingerprints")
 
     class Meta:
         model = User
@@ -48,7 +47,7 @@ class ChangePasswordSerializer(serializers.Serializer):
         return value
 
 
-class MessengerSerializer(serializers.HyperlinkedModelSerializer):
+class MessengerSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(max_length=64)
     experiments = serializers.HyperlinkedRelatedField(
@@ -58,7 +57,7 @@ class MessengerSerializer(serializers.HyperlinkedModelSerializer):
 
     def to_representation(self, instance):
         response = super().to_representation(instance)
-        if isinstance(self.instance, list):
+        if isinstance(self.instance, list) and "experiments" in response:
             response["experiments"] = "[{}] Experiments".format(
                 len(response["experiments"])
             )
@@ -94,7 +93,7 @@ class PkToHyperlinkRelatedField(serializers.PrimaryKeyRelatedField):
         return reverse(self.view_name, args=(value.pk,), request=self.context['request'])
 
 
-class ExperimentListSerializer(serializers.HyperlinkedModelSerializer):
+class ExperimentListSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(max_length=1024)
     messenger = serializers.HyperlinkedRelatedField(many=False, view_name="messenger-detail", read_only=True)
@@ -121,7 +120,7 @@ class ExperimentListSerializer(serializers.HyperlinkedModelSerializer):
         ]
 
 
-class ExperimentDetailSerializer(serializers.HyperlinkedModelSerializer):
+class ExperimentDetailSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(max_length=1024)
 
@@ -158,16 +157,16 @@ class ExperimentDetailSerializer(serializers.HyperlinkedModelSerializer):
     start_at = serializers.DateTimeField(read_only=True)
     finished_at = serializers.DateTimeField(read_only=True)
 
-    access_logs = serializers.HyperlinkedRelatedField(
-        many=True, view_name="accesslog-detail", read_only=True
+    access_logs = RelationSummaryField(
+        view_name="accesslog-detail", list_view_name="experiment-get-access-logs"
     )
 
-    fingerprint_logs = serializers.HyperlinkedRelatedField(
-        many=True, view_name="fingerprintlog-detail", read_only=True
+    fingerprint_logs = RelationSummaryField(
+        view_name="fingerprintlog-detail", list_view_name="experiment-get-fingerprint-logs"
     )
 
-    browser_fingerprint_logs = serializers.HyperlinkedRelatedField(
-        many=True, view_name="browserfingerprintlog-detail", read_only=True
+    browser_fingerprint_logs = RelationSummaryField(
+        view_name="browserfingerprintlog-detail", list_view_name="experiment-get-browser-fingerprint-logs"
     )
 
     def update(self, instance, validated_data):
@@ -189,20 +188,16 @@ class ExperimentDetailSerializer(serializers.HyperlinkedModelSerializer):
 
         for field in ["messenger", "honeypage", "honeymail"]:
             # iterate all fields of this object and add the id of some related objects
-            if hasattr(instance, field):
+            if self.is_requested(field + "_id") and hasattr(instance, field):
                 value = getattr(instance, field)
                 if value and hasattr(value, "pk"):
                     response.update({field + "_id": value.pk})
 
-        response.update(
-            {
-                "messenger_name": instance.messenger.name,
-                "with_honeymail": instance.with_honeymail,
-                "with_honeypage": instance.with_honeypage,
-                "with_suspicious_honeypage": instance.with_suspicious_honeypage,
-                "with_meta_tags_honeypage": instance.with_meta_tags_honeypage,
-            }
-        )
+        if self.is_requested("messenger_name"):
+            response["messenger_name"] = instance.messenger.name
+        for field in ["with_honeymail", "with_honeypage", "with_suspicious_honeypage", "with_meta_tags_honeypage"]:
+            if self.is_requested(field):
+                response[field] = getattr(instance, field)
 
         return response
 
@@ -226,7 +221,7 @@ class ExperimentDetailSerializer(serializers.HyperlinkedModelSerializer):
         fields = "__all__"
 
 
-class ExperimentCreateSerializer(serializers.HyperlinkedModelSerializer):
+class ExperimentCreateSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(max_length=1024)
 
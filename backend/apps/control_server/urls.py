@@ -7,13 +7,14 @@ from control_server import views
 from control_server.views import AuthTokenViewSet, UpdatePassword
 from honeypot.views import (
     HoneypageViewSet, HoneymailViewSet, AccessLogViewSet, FingerprintLogViewSet,
-    FingerprintViewSet, BrowserFingerprintLogViewSet, resource_view
+    FingerprintViewSet, BrowserFingerprintLogViewSet, LogFeedViewSet, resource_view
 )
 
 router = DefaultRouter()
 
 # logs
 router.register(r"access_logs", AccessLogViewSet)
+router.register(r"feed", LogFeedViewSet, basename="feed")
 
 # fingerprints
 router.register(r"fingerprints", FingerprintViewSet)
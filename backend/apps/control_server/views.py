@@ -1,8 +1,11 @@
+from datetime import timedelta
+
 import django_filters
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.http import JsonResponse, HttpResponse
-from django.shortcuts import redirect
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.http import parse_etags
 from django_filters import rest_framework as filters
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
@@ -10,7 +13,7 @@ from rest_framework.authentication import BasicAuthentication, SessionAuthentica
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import action
-from rest_framework.exceptions import APIException
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
@@ -18,12 +21,24 @@ from rest_framework.views import APIView
 
 from control_server.time import now
 from honeypot.models import Honeypage, Honeymail
-from honeypot.serializers import AccessLogDetailSerializer
-from honeypot.views import LargeResultsSetPagination
+from honeypot.serializers import (
+    AccessLogDetailSerializer,
+    BrowserFingerprintLogSerializer,
+    FingerprintLogSerializer,
+    FingerprintSerializer,
+)
+from honeypot.views import (
+    ACCESS_LOG_LARGE_FIELDS,
+    BROWSER_FINGERPRINT_LOG_LARGE_FIELDS,
+    FINGERPRINT_LOG_LARGE_FIELDS,
+    LargeResultsSetPagination,
+)
 from .core import get_codename
+from .fieldsets import sparse_queryset
 from .models import (
     Messenger,
     Experiment,
+    ExperimentEvaluation,
 )
 from .permissions import IsOwnerOrReadOnly
 from .serializers import (
@@ -101,6 +116,22 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(recent_users, many=True)
         return Response(serializer.data)
 
+    @action(detail=True)
+    def get_fingerprints(self, request, pk=None):
+        """
+        API endpoint to list the Fingerprints of a user.
+        """
+        fingerprints = get_object_or_404(User, pk=pk).fingerprints.all()
+        context = {"request": request}
+
+        page = self.paginate_queryset(fingerprints)
+        if page is not None:
+            serializer = FingerprintSerializer(page, many=True, context=context)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = FingerprintSerializer(fingerprints, many=True, context=context)
+        return Response(serializer.data)
+
 
 class UpdatePassword(APIView):
     """
@@ -277,6 +308,29 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         Experiment.objects.all().update()
         return redirect("experiment-list")
 
+    @action(detail=True)
+    def evaluation(self, request, pk=None):
+        """
+        API endpoint for the evaluation of an experiment, optionally only of the logs within
+        "?experiment_duration=<seconds>" after its creation.
+        Responses carry an ETag that only changes when new logs arrive; send it as If-None-Match to get a 304.
+        """
+        experiment = self.get_object()
+
+        experiment_duration = request.query_params.get("experiment_duration")
+        try:
+            experiment_duration = timedelta(seconds=float(experiment_duration)) if experiment_duration else None
+        except ValueError:
+            raise ValidationError({"experiment_duration": "A number of seconds is required."})
+
+        evaluation = ExperimentEvaluation.get_current(experiment, experiment_duration)
+        headers = {"ETag": evaluation.etag, "Cache-Control": "private, no-cache"}
+
+        if evaluation.etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(evaluation.evaluation, headers=headers)
+
     # *** API Endpoints listing Experiments ***
     @action(detail=False)
     def get_running_experiments(self, request):
@@ -306,6 +360,29 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         access_logs = experiment.access_logs
         return self._craft_paginated_access_log_response(access_logs, request)
 
+    # *** API Endpoints regarding Fingerprints ***
+    @action(detail=True)
+    def get_fingerprint_logs(self, request, pk=None):
+        """
+        API endpoint to list all FingerprintLog instances of the experiment's honeypages.
+        """
+        experiment = get_object_or_404(Experiment, pk=pk)
+        return self._craft_paginated_log_response(
+            experiment.fingerprint_logs.prefetch_related("fingerprint"), request,
+            FingerprintLogSerializer, FINGERPRINT_LOG_LARGE_FIELDS
+        )
+
+    @action(detail=True)
+    def get_browser_fingerprint_logs(self, request, pk=None):
+        """
+        API endpoint to list all BrowserFingerprintLog instances of the experiment's honeypages.
+        """
+        experiment = get_object_or_404(Experiment, pk=pk)
+        return self._craft_paginated_log_response(
+            experiment.browser_fingerprint_logs, request,
+            BrowserFingerprintLogSerializer, BROWSER_FINGERPRINT_LOG_LARGE_FIELDS
+        )
+
     # *** Methods ***
     def _craft_paginated_experiment_response(self, queryset):
         page = self.paginate_queryset(queryset)
@@ -318,6 +395,8 @@ class ExperimentViewSet(viewsets.ModelViewSet):
 
     def _craft_paginated_access_log_response(self, queryset, request):
         context = {"request": request}
+        queryset = queryset.select_related("user")
+        queryset = sparse_queryset(queryset, AccessLogDetailSerializer(context=context), ACCESS_LOG_LARGE_FIELDS)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = AccessLogDetailSerializer(page, many=True, context=context)
@@ -325,3 +404,14 @@ class ExperimentViewSet(viewsets.ModelViewSet):
 
         serializer = AccessLogDetailSerializer(queryset, many=True, context=context)
         return Response(serializer.data)
+
+    def _craft_paginated_log_response(self, queryset, request, serializer_class, large_fields):
+        context = {"request": request}
+        queryset = sparse_queryset(queryset, serializer_class(context=context), large_fields)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = serializer_class(page, many=True, context=context)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = serializer_class(queryset, many=True, context=context)
+        return Response(serializer.data)
@@ -17,6 +17,8 @@ class AccessLogModelAdmin(admin.ModelAdmin):
         ("Meta", {"fields": ["session_key", "meta", "user"]}),
         ("Timestamp", {"fields": ["timestamp"]}),
     ]
+    # properties reading the log's payload, loaded by the change page only
+    readonly_fields = ["get", "post", "cookies", "meta"]
 
     def has_add_permission(self, request):
         return False
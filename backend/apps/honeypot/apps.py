@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class HoneypotConfig(AppConfig):
     name = "honeypot"
+
+    def ready(self):
+        from . import signals  # noqa: F401
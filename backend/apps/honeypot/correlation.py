@@ -0,0 +1,218 @@
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .models import BrowserFingerprintLog, Fingerprint, FingerprintLog, Honeypage, WITHOUT_CORRELATION_KEYS
+from .registry import normalize_host
+
+# time windows around an AccessLog in which fingerprints belong to it, see AccessLog.matching_fingerprint_log
+FINGERPRINT_LOG_WINDOW = (timedelta(seconds=3), timedelta(minutes=1))
+BROWSER_FINGERPRINT_LOG_WINDOW = (timedelta(seconds=10), timedelta(minutes=2))
+
+# bounds of the fingerprint log queries of a page: time windows, and hosts that logs without correlation keys are
+# matched on in the database (with more, they are matched in memory only)
+MAX_QUERY_WINDOWS = 20
+MAX_QUERY_HOSTS = 20
+
+# AccessLog properties that depend on the resolved honeypages, respectively fingerprint logs
+HONEYPAGE_PROPERTIES = (
+    "matching_honeypage", "matching_honeypage_str", "matching_experiment", "matching_experiment_str",
+    "seconds_since_experiment", "human_time_since_experiment",
+)
+FINGERPRINT_PROPERTIES = (
+    "matching_fingerprint_log", "matching_fingerprint", "matching_fingerprint_str",
+    "matching_browser_fingerprint_log", "matching_browser_fingerprint_log_str",
+)
+
+# (start id, root id) of honeypages, resolved in the database
+ROOTS_SQL = """
+    WITH RECURSIVE ancestors(start_id, id, parent_id) AS (
+        SELECT id, id, parent_id FROM {table} WHERE id IN ({ids})
+        UNION
+        SELECT ancestors.start_id, page.id, page.parent_id FROM {table} page
+        INNER JOIN ancestors ON page.id = ancestors.parent_id
+    )
+    SELECT start_id, id FROM ancestors WHERE parent_id IS NULL
+"""
+
+
+def resolve_access_log_correlations(access_logs, honeypages=True, fingerprints=True):
+    """
+    Resolves the matching_* properties of a page of AccessLogs with a constant number of queries
+    and stores the results on the instances, as if the cached properties had been evaluated.
+
+    Results are the same as evaluating the properties one by one. A property stays unresolved
+    (and raises when evaluated, so serializers skip it) where it would raise as well,
+    e.g. matching_fingerprint without a matching FingerprintLog.
+    :param access_logs: list of AccessLogs
+    :param honeypages: resolve matching_honeypage and matching_experiment
+    :param fingerprints: resolve matching_fingerprint_log, matching_fingerprint and matching_browser_fingerprint_log
+    """
+    access_logs = [log for log in access_logs if log.timestamp is not None]
+    if not access_logs:
+        return
+
+    if honeypages:
+        _resolve_honeypages(access_logs)
+    if fingerprints:
+        _resolve_fingerprint_logs(access_logs)
+        _resolve_browser_fingerprint_logs(access_logs)
+
+
+def _resolve_honeypages(access_logs):
+    from control_server.models import Experiment
+
+    # logs with correlation keys reference their honeypage, older ones are matched on their subdomain
+    by_id = Honeypage.objects.in_bulk(set(log.honeypage_id for log in access_logs if log.host_key and log.honeypage_id))
+
+    # the first honeypage per (case-insensitive) subdomain, like Honeypage.objects.filter(subdomain__iexact=...).first()
+    subdomains = set(log.subdomain.lower() for log in access_logs if not log.host_key)
+    by_subdomain = {}
+    if subdomains:
+        for honeypage in Honeypage.objects.annotate(subdomain_lower=Lower("subdomain")).filter(
+                subdomain_lower__in=subdomains
+        ).order_by("pk"):
+            by_subdomain.setdefault(honeypage.subdomain_lower, honeypage)
+
+    matches = [
+        by_id.get(log.honeypage_id) if log.host_key else by_subdomain.get(log.subdomain.lower())
+        for log in access_logs
+    ]
+
+    roots = _root_ids(list(set(honeypage.pk for honeypage in matches if honeypage is not None)))
+    experiments = {
+        experiment.honeypage_id: experiment
+        for experiment in Experiment.objects.filter(honeypage_id__in=set(roots.values()))
+    }
+
+    for log, honeypage in zip(access_logs, matches):
+        log.__dict__["matching_honeypage"] = honeypage
+        if honeypage is None:
+            log.__dict__["matching_experiment"] = None
+        elif roots.get(honeypage.pk) in experiments:
+            log.__dict__["matching_experiment"] = experiments[roots[honeypage.pk]]
+
+
+def _root_ids(honeypage_ids):
+    """
+    :return: {honeypage id: id of its root honeypage}
+    """
+    if not honeypage_ids:
+        return {}
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            ROOTS_SQL.format(
+                table=connection.ops.quote_name(Honeypage._meta.db_table),
+                ids=", ".join(["%s"] * len(honeypage_ids))
+            ),
+            honeypage_ids
+        )
+        return dict(cursor.fetchall())
+
+
+def _first_in_window(candidates, timestamps, log, window):
+    """
+    The earliest candidate within the time window around the log of the log's host
+    (see AccessLog.host_filter, candidates without correlation keys by their visited_url).
+    :param candidates: fingerprint logs ordered by timestamp (and id)
+    :param timestamps: their timestamps
+    """
+    host = log.http_host.lower()
+    host_key = log.host_key or normalize_host(log.http_host)
+    start = log.timestamp - window[0]
+    end = log.timestamp + window[1]
+
+    for i in range(bisect_left(timestamps, start), len(candidates)):
+        candidate = candidates[i]
+        if candidate.timestamp > end:
+            break
+        if candidate.host_key:
+            if candidate.host_key == host_key:
+                return candidate
+        elif host in candidate.visited_url.lower():
+            return candidate
+
+    return None
+
+
+def _windows(access_logs, window, max_windows=MAX_QUERY_WINDOWS):
+    """
+    :return: the time windows around the logs, overlapping ones merged, in order;
+        at most `max_windows`, closing the shortest gaps between them
+    """
+    windows = []
+    for timestamp in sorted(log.timestamp for log in access_logs):
+        start, end = timestamp - window[0], timestamp + window[1]
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+
+    if len(windows) > max_windows:
+        gaps = sorted(range(1, len(windows)), key=lambda i: windows[i][0] - windows[i - 1][1], reverse=True)
+        splits = sorted(gaps[:max_windows - 1])
+        windows = [
+            [windows[first][0], windows[last - 1][1]]
+            for first, last in zip([0] + splits, splits + [len(windows)])
+        ]
+    return windows
+
+
+def _candidates(model, access_logs, window, fields):
+    """
+    The fingerprint logs that can be in the window of one of the access logs: those of the logs' host keys
+    and those without correlation keys whose visited_url contains one of the hosts, within the windows of the logs.
+    The query has a bounded number of conditions, _first_in_window picks each log's candidates.
+    """
+    host_keys = set(log.host_key or normalize_host(log.http_host) for log in access_logs)
+    hosts = set(log.http_host.lower() for log in access_logs)
+
+    legacy = WITHOUT_CORRELATION_KEYS
+    if len(hosts) <= MAX_QUERY_HOSTS:
+        matching_hosts = Q()
+        for host in hosts:
+            matching_hosts |= Q(visited_url__icontains=host)
+        legacy &= matching_hosts
+
+    in_windows = Q()
+    for start, end in _windows(access_logs, window):
+        in_windows |= Q(timestamp__gte=start, timestamp__lte=end)
+
+    candidates = list(
+        model.objects.filter(in_windows, Q(host_key__in=host_keys) | legacy).order_by("timestamp", "pk").only(
+            "host_key", *fields
+        )
+    )
+    return candidates, [candidate.timestamp for candidate in candidates]
+
+
+def _resolve_fingerprint_logs(access_logs):
+    candidates, timestamps = _candidates(
+        FingerprintLog, access_logs, FINGERPRINT_LOG_WINDOW, ("id", "visited_url", "timestamp", "fingerprint")
+    )
+
+    matches = [_first_in_window(candidates, timestamps, log, FINGERPRINT_LOG_WINDOW) for log in access_logs]
+
+    fingerprint_ids = set(match.fingerprint_id for match in matches if match is not None)
+    fingerprints = Fingerprint.objects.in_bulk(fingerprint_ids)
+
+    for log, match in zip(access_logs, matches):
+        log.__dict__["matching_fingerprint_log"] = match
+        if match is not None:
+            log.__dict__["matching_fingerprint"] = fingerprints.get(match.fingerprint_id)
+
+
+def _resolve_browser_fingerprint_logs(access_logs):
+    candidates, timestamps = _candidates(
+        BrowserFingerprintLog, access_logs, BROWSER_FINGERPRINT_LOG_WINDOW,
+        ("id", "visited_url", "timestamp", "feature_ua")
+    )
+
+    for log in access_logs:
+        log.__dict__["matching_browser_fingerprint_log"] = _first_in_window(
+            candidates, timestamps, log, BROWSER_FINGERPRINT_LOG_WINDOW
+        )
@@ -0,0 +1,108 @@
+import csv
+import zlib
+from datetime import date, datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+class _Echo(object):
+    """
+    File-like object for csv.writer that returns the written line instead of buffering it.
+    """
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _ndjson_chunks(fields, rows, chunk_size):
+    encoder = DjangoJSONEncoder()
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(fields, row))) + "\n")
+        if len(lines) >= chunk_size:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def _csv_chunks(fields, rows, chunk_size):
+    writer = csv.writer(_Echo())
+    lines = [writer.writerow(fields)]
+    for row in rows:
+        lines.append(writer.writerow([_csv_value(value) for value in row]))
+        if len(lines) >= chunk_size:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode("utf-8"))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class ExportMixin(object):
+    """
+    Adds an `export/` endpoint to a viewset that streams all rows matching the viewset's filters
+    as newline delimited JSON (`?export_format=ndjson`, default) or CSV (`?export_format=csv`),
+    optionally gzip-compressed (`?gzip=1`).
+
+    Rows are read with a server-side cursor and written chunk by chunk, so memory stays constant
+    regardless of the number of rows. ("format" is taken by DRF's renderer selection, hence "export_format".)
+
+    Besides the model's columns, the `export_related_fields` lookups (e.g. "payload__headers") are exported,
+    named after their last part.
+    """
+    export_chunk_size = 2000
+    export_related_fields = ()
+
+    @action(detail=False)
+    def export(self, request):
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({"export_format": "Supported formats: {}".format(", ".join(EXPORT_FORMATS))})
+        compress = request.query_params.get("gzip", "0").lower() not in ("", "0", "false", "no")
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lookups = [field.attname for field in queryset.model._meta.concrete_fields] + list(self.export_related_fields)
+        fields = [lookup.split("__")[-1] for lookup in lookups]
+        rows = queryset.values_list(*lookups).iterator(chunk_size=self.export_chunk_size)
+
+        if export_format == "csv":
+            chunks = _csv_chunks(fields, rows, self.export_chunk_size)
+        else:
+            chunks = _ndjson_chunks(fields, rows, self.export_chunk_size)
+
+        file_name = "{}.{}".format(queryset.model._meta.model_name, export_format)
+        if compress:
+            response = StreamingHttpResponse(_gzip_chunks(chunks), content_type="application/gzip")
+            file_name += ".gz"
+        else:
+            response = StreamingHttpResponse(
+                (chunk.encode("utf-8") for chunk in chunks),
+                content_type="{}; charset=utf-8".format(EXPORT_FORMATS[export_format])
+            )
+
+        response["Content-Disposition"] = 'attachment; filename="{}"'.format(file_name)
+        return response
@@ -0,0 +1,252 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+
+FEATURE_SCOPE_PATH = os.path.join(settings.DJANGO_ROOT, "run", "fingerprinting", "features-in-scope.txt")
+BROWSER_FEATURE_MAP_PATH = os.path.join(settings.DJANGO_ROOT, "run", "fingerprinting", "feature_map.json")
+COMPILED_FEATURE_MAP_PATH = os.path.join(settings.DJANGO_ROOT, "run", "fingerprinting", "feature_map.bin")
+
+# browser name prefixes that the browser-like flags refer to
+BROWSER_FAMILIES = ("chrome", "edge", "firefox", "ie", "opera", "safari")
+
+# browser_info flags; if none of them is set, the client may be any browser
+BROWSER_LIKE_FLAGS = (
+    "chrome", "chrome_like", "edge_like", "old_ie", "ie_like", "mozilla_like", "netscape", "opera", "opera_like",
+    "safari", "safari_like"
+)
+
+# Layout of the compiled artifact (all integers little endian):
+#   header:  magic, format version, number of features, number of browsers, bytes per browser row
+#   sources: size and mtime (ns) of features-in-scope.txt and feature_map.json it was compiled from
+#   names:   length-prefixed, newline separated UTF-8 feature names, then browser names
+#   rows:    one packed bitset per browser, feature 0 is the most significant bit of the first byte
+MAGIC = b"HMFM"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHIII")
+SOURCES = struct.Struct("<qqqq")
+LENGTH = struct.Struct("<I")
+
+
+def load_sources(scope_path=FEATURE_SCOPE_PATH, map_path=BROWSER_FEATURE_MAP_PATH):
+    """
+    Reads features-in-scope.txt and feature_map.json.
+    :return: (feature_scope, browser_feature_map) with browser_feature_map = {browser: [feature, ...]}
+    """
+    if not os.path.isfile(scope_path):
+        raise IOError('File "features-in-scope.txt" does not exist. Read fingerprinting Readme')
+    with open(scope_path, "r") as file:
+        content = file.readlines()
+    feature_scope = [x.strip() for x in content]
+
+    if not os.path.isfile(map_path):
+        raise IOError('File "feature_map.json" does not exist. Run init_fingerprinting script first.')
+    with open(map_path, "r") as map_file:
+        map_content = map_file.read()
+    try:
+        browser_feature_map = {}
+        json_content = json.loads(map_content)  # [ [ "browser1", [ "feature1", ... ] ], ...]
+        for browser_data in json_content:  # [ "browser1", [ "feature1", ... ] ]
+            browser = browser_data[0]
+            feature_list = browser_data[1]
+            browser_feature_map[browser] = feature_list
+    except Exception:
+        raise IOError('Unable to parse "feature_map.json".')
+
+    return feature_scope, browser_feature_map
+
+
+def _source_stamp(scope_path, map_path):
+    scope_stat = os.stat(scope_path)
+    map_stat = os.stat(map_path)
+    return scope_stat.st_size, scope_stat.st_mtime_ns, map_stat.st_size, map_stat.st_mtime_ns
+
+
+class FeatureMap(object):
+    """
+    The browser feature map compiled to bitmasks.
+
+    Bit (n_features - 1 - i) of a mask stands for feature_scope[i], so a client's features string like "0110..."
+    read as a binary number is its mask. Scoring a fingerprint takes one XNOR and one popcount per candidate browser.
+    """
+
+    def __init__(self, feature_scope, browsers, browser_feature_masks):
+        self.feature_scope = feature_scope
+        self.browsers = browsers
+        self.browser_feature_masks = browser_feature_masks  # one mask per browser, same order as `browsers`
+
+        # browser family -> mask over browser indices (bit i stands for browsers[i])
+        self.browser_family_masks = {family: 0 for family in BROWSER_FAMILIES}
+        for browser_idx, browser in enumerate(browsers):
+            for family in BROWSER_FAMILIES:
+                if browser.startswith(family):
+                    self.browser_family_masks[family] |= 1 << browser_idx
+
+    @staticmethod
+    def from_sources(feature_scope, browser_feature_map):
+        n_features = len(feature_scope)
+        masks = []
+        for browser_features in map(set, browser_feature_map.values()):
+            mask = 0
+            for feature_idx, feature in enumerate(feature_scope):
+                if feature in browser_features:
+                    mask |= 1 << (n_features - 1 - feature_idx)
+            masks.append(mask)
+
+        return FeatureMap(feature_scope, list(browser_feature_map.keys()), masks)
+
+    @staticmethod
+    def from_buffer(buffer):
+        """
+        Reads a compiled feature map from a bytes-like object (e.g. an mmap of the artifact).
+        """
+        magic, version, n_features, n_browsers, row_bytes = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise IOError("Unsupported compiled feature map (version {})".format(version))
+        offset = HEADER.size + SOURCES.size
+
+        names = []
+        for _ in range(2):
+            (length,) = LENGTH.unpack_from(buffer, offset)
+            offset += LENGTH.size
+            blob = bytes(buffer[offset:offset + length]).decode("utf-8")
+            names.append(blob.split("\n") if length else [])
+            offset += length
+        feature_scope, browsers = names
+
+        padding = row_bytes * 8 - n_features
+        masks = [
+            int.from_bytes(buffer[offset + i * row_bytes:offset + (i + 1) * row_bytes], "big") >> padding
+            for i in range(n_browsers)
+        ]
+
+        return FeatureMap(feature_scope, browsers, masks)
+
+    def to_bytes(self, source_stamp=(0, 0, 0, 0)):
+        n_features = len(self.feature_scope)
+        row_bytes = (n_features + 7) // 8
+        padding = row_bytes * 8 - n_features
+
+        content = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, n_features, len(self.browsers), row_bytes))
+        content += SOURCES.pack(*source_stamp)
+        for names in (self.feature_scope, self.browsers):
+            blob = "\n".join(names).encode("utf-8")
+            content += LENGTH.pack(len(blob)) + blob
+        for mask in self.browser_feature_masks:
+            content += (mask << padding).to_bytes(row_bytes, "big")
+
+        return bytes(content)
+
+    def like_browsers_mask(self, data):
+        """
+        Mask of the browser indices that the client's browser-like flags allow, evaluated once per family.
+        """
+        if not any(data[flag] for flag in BROWSER_LIKE_FLAGS):
+            return (1 << len(self.browsers)) - 1
+
+        families = {
+            "chrome": (data["chrome"] or data["chrome_like"] or data["phantom"]) and not data["edge_like"],
+            "edge": data["edge_like"],
+            "firefox": (data["netscape"] or data["mozilla_like"]) and not data["ie_like"],
+            "ie": data["old_ie"] or data["ie_like"],
+            "opera": data["opera"] or data["opera_like"],
+            "safari": data["safari"] or data["safari_like"],
+        }
+
+        mask = 0
+        for family, is_like in families.items():
+            if is_like:
+                mask |= self.browser_family_masks[family]
+        return mask
+
+    def parse_features(self, data):
+        features = data["features"]
+        n_features = len(self.feature_scope)
+        if len(features) != n_features:
+            print("Unexpected browser fingerprint length")
+            return {"max": 0, "result": ["unknown"]}
+
+        client_mask = int("".join("1" if feature == "1" else "0" for feature in features), 2)
+        all_features = (1 << n_features) - 1
+        like_browsers = self.like_browsers_mask(data)
+
+        # check client features with features of browser versions
+        matches = []
+        for browser_idx, browser in enumerate(self.browsers):
+            if not like_browsers >> browser_idx & 1:
+                # For example skip Chrome and Firefox if edge_like
+                continue
+
+            agreeing = ~(client_mask ^ self.browser_feature_masks[browser_idx]) & all_features  # XNOR
+            score = bin(agreeing).count("1")
+            if score > 0:
+                # results are ordered by the first agreeing feature, as they were when counting feature by feature
+                first_agreeing_idx = n_features - agreeing.bit_length()
+                matches.append((first_agreeing_idx, browser_idx, browser, score))
+        matches.sort()
+
+        max_score = max([score for (_, _, _, score) in matches], default=0)
+        result = [browser for (_, _, browser, score) in matches if score == max_score]
+
+        return {"max": max_score, "result": result}
+
+
+def compile_feature_map(scope_path=FEATURE_SCOPE_PATH, map_path=BROWSER_FEATURE_MAP_PATH,
+                        output_path=COMPILED_FEATURE_MAP_PATH):
+    """
+    Compiles features-in-scope.txt and feature_map.json into the binary artifact.
+    :return: the compiled FeatureMap
+    """
+    feature_map = FeatureMap.from_sources(*load_sources(scope_path, map_path))
+
+    # write to a temporary file first, workers may have the old artifact mapped
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(feature_map.to_bytes(_source_stamp(scope_path, map_path)))
+    os.replace(tmp_path, output_path)
+
+    return feature_map
+
+
+def _is_up_to_date(buffer, scope_path, map_path):
+    if not (os.path.isfile(scope_path) and os.path.isfile(map_path)):
+        # only the artifact was deployed
+        return True
+    return SOURCES.unpack_from(buffer, HEADER.size) == _source_stamp(scope_path, map_path)
+
+
+_feature_map = None
+_lock = threading.Lock()
+
+
+def get_feature_map() -> FeatureMap:
+    """
+    Loads the feature map on first use.
+    The compiled artifact is memory-mapped if it exists and matches the source files,
+    otherwise the source files are parsed (run `manage.py compile_feature_map` to avoid that).
+    """
+    global _feature_map
+
+    if _feature_map is None:
+        with _lock:
+            if _feature_map is None:
+                _feature_map = _load()
+
+    return _feature_map
+
+
+def _load():
+    if os.path.isfile(COMPILED_FEATURE_MAP_PATH):
+        with open(COMPILED_FEATURE_MAP_PATH, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if _is_up_to_date(buffer, FEATURE_SCOPE_PATH, BROWSER_FEATURE_MAP_PATH):
+                return FeatureMap.from_buffer(buffer)
+            print('"feature_map.bin" is outdated, run "manage.py compile_feature_map"')
+        finally:
+            buffer.close()
+
+    return FeatureMap.from_sources(*load_sources())
@@ -0,0 +1,262 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+from control_server.broadcast import broadcast
+from .models import AccessLog, BrowserFingerprintLog, FingerprintLog, commit_cutoff
+
+FEED_CHANNEL = "logs"
+
+# kinds of logs in the feed, in cursor order
+KINDS = ("access_logs", "fingerprint_logs", "browser_fingerprint_logs")
+
+# an event stream sends a comment if there were no logs for this many seconds, so proxies keep it open
+HEARTBEAT_INTERVAL = 15
+
+# the columns sent per log, details can be fetched from the log endpoints
+FEED_FIELDS = {
+    "access_logs": (
+        "id", "timestamp", "ip_address", "method", "http_host", "subdomain", "path", "absolute_url", "referrer"
+    ),
+    "fingerprint_logs": ("id", "timestamp", "ip_address", "visited_url", "fingerprint_id"),
+    "browser_fingerprint_logs": ("id", "timestamp", "ip_address", "visited_url", "parsed_ua", "feature_ua"),
+}
+
+# the insert time of a log per kind (None for access logs from before AccessLog.created_at existed),
+# the cursor only moves past logs inserted before commit_cutoff()
+INSERTED_AT_FIELDS = {
+    "access_logs": "created_at",
+    "fingerprint_logs": "timestamp",
+    "browser_fingerprint_logs": "timestamp",
+}
+
+
+def parse_cursor(value):
+    """
+    A cursor holds the last seen id per kind, e.g. "1200.35.17".
+    :return: {kind: id}
+    :raises ValueError: if the cursor is malformed
+    """
+    ids = [int(part) for part in value.split(".")]
+    if len(ids) != len(KINDS) or any(i < 0 for i in ids):
+        raise ValueError("expected {} non-negative ids separated by dots".format(len(KINDS)))
+    return dict(zip(KINDS, ids))
+
+
+def format_cursor(cursor):
+    return ".".join(str(cursor[kind]) for kind in KINDS)
+
+
+def feed_querysets(experiment=None, honeypage=None):
+    """
+    The logs a feed consists of, those of an experiment or a honeypage or all logs of unauthenticated visitors.
+    :return: {kind: QuerySet}
+    """
+    if experiment is not None:
+        source = experiment
+    elif honeypage is not None:
+        source = honeypage
+    else:
+        return {
+            "access_logs": AccessLog.objects.filter(user__isnull=True),
+            "fingerprint_logs": FingerprintLog.objects.all(),
+            "browser_fingerprint_logs": BrowserFingerprintLog.objects.all(),
+        }
+
+    return {
+        "access_logs": source.access_logs,
+        "fingerprint_logs": source.fingerprint_logs,
+        "browser_fingerprint_logs": source.browser_fingerprint_logs,
+    }
+
+
+def latest_cursor(querysets):
+    """
+    The cursor of the newest logs (see fetch about held back logs), a feed started from it only returns logs
+    that arrive afterwards.
+    """
+    cursor = {}
+    cutoff = commit_cutoff()
+    for kind in KINDS:
+        inserted_at = INSERTED_AT_FIELDS[kind]
+        latest = querysets[kind].filter(
+            Q(**{inserted_at + "__lt": cutoff}) | Q(**{inserted_at + "__isnull": True})
+        ).order_by("-id").values_list("id", flat=True).first()
+        cursor[kind] = latest or 0
+    return cursor
+
+
+def fetch(querysets, cursor, kinds=KINDS, limit=100):
+    """
+    Up to `limit` logs per kind with ids after the cursor, oldest first.
+
+    Logs are committed out of id order (e.g. in batches by several processes), so the cursor doesn't move past
+    a log inserted after commit_cutoff(): a log with a lower id may still appear. Such logs are held back.
+    :return: ({kind: [log dict, ...]}, advanced cursor, whether more logs are waiting, kinds with held back logs)
+    """
+    cursor = dict(cursor)
+    logs = dict((kind, []) for kind in KINDS)
+    has_more = False
+    held_back = []
+    cutoff = commit_cutoff()
+
+    for kind in kinds:
+        inserted_at = INSERTED_AT_FIELDS[kind]
+        rows = list(
+            querysets[kind].filter(id__gt=cursor[kind]).order_by("id").values(
+                inserted_at, *FEED_FIELDS[kind]
+            )[:limit + 1]
+        )
+        for i, row in enumerate(rows):
+            if row[inserted_at] is not None and row[inserted_at] >= cutoff:
+                held_back.append(kind)
+                rows = rows[:i]
+                break
+        if inserted_at not in FEED_FIELDS[kind]:
+            for row in rows:
+                del row[inserted_at]
+        if len(rows) > limit:
+            has_more = True
+            rows = rows[:limit]
+        if rows:
+            cursor[kind] = rows[-1]["id"]
+        logs[kind] = rows
+
+    return logs, cursor, has_more, held_back
+
+
+class LogFeed(object):
+    """
+    Wakes up waiting feed requests when new logs were written.
+
+    Processes announce new logs on the "logs" broadcast channel. Every process keeps one counter per kind,
+    waiting requests sleep on a condition until a counter changes, so an idle feed costs no queries at all.
+    Without Redis, other processes' logs are noticed by querying the database every `poll_interval` seconds.
+    """
+
+    def __init__(self, poll_interval=2.0):
+        self.poll_interval = poll_interval
+
+        self._versions = dict((kind, 0) for kind in KINDS)
+        self._condition = threading.Condition()
+        self._subscribed = False
+
+    def notify(self, kind):
+        """
+        Announces new logs of a kind to the feeds of this and all other processes.
+        """
+        self._changed([kind])
+        broadcast.publish(FEED_CHANNEL, {"kinds": [kind]})
+
+    def versions(self):
+        self._subscribe()
+        with self._condition:
+            return dict(self._versions)
+
+    def wait(self, versions, timeout):
+        """
+        Blocks until logs of any kind were announced since `versions` or the timeout passed.
+        :param versions: result of versions(), updated in place
+        :return: the kinds to query for new logs, empty if nothing changed
+        """
+        listening = broadcast.is_listening()
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                changed = [kind for kind in KINDS if self._versions[kind] != versions[kind]]
+                if changed:
+                    versions.update(self._versions)
+                    return changed
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+
+                if listening:
+                    self._condition.wait(remaining)
+                elif not self._condition.wait(min(remaining, self.poll_interval)):
+                    # logs of other processes are not announced, look for them
+                    return list(KINDS)
+
+    def _subscribe(self):
+        if not self._subscribed:
+            self._subscribed = True
+            broadcast.subscribe(FEED_CHANNEL, self._on_message)
+
+    def _on_message(self, message):
+        if message is None:
+            # (re)connected, announcements may have been missed
+            self._changed(KINDS)
+        else:
+            self._changed([kind for kind in message.get("kinds", []) if kind in self._versions])
+
+    def _changed(self, kinds):
+        with self._condition:
+            for kind in kinds:
+                self._versions[kind] += 1
+            self._condition.notify_all()
+
+
+log_feed = LogFeed(settings.LOG_FEED_POLL_INTERVAL)
+
+
+def poll(querysets, cursor, timeout, limit=100):
+    """
+    Long-polls for logs after the cursor: returns at once if there are any, otherwise as soon as new logs arrive
+    or after `timeout` seconds.
+    :return: same as fetch()
+    """
+    # take the versions before looking, so logs written in between wake us up
+    versions = log_feed.versions()
+    logs, cursor, has_more, held_back = fetch(querysets, cursor, limit=limit)
+    deadline = time.monotonic() + timeout
+
+    while not any(logs.values()):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # held back logs are announced already, look again once they are committed
+        changed = log_feed.wait(versions, min(remaining, settings.ACCESS_LOG_COMMIT_LAG) if held_back else remaining)
+        kinds = [kind for kind in KINDS if kind in changed or kind in held_back]
+        if kinds:
+            logs, cursor, has_more, held_back = fetch(querysets, cursor, kinds, limit)
+
+    return logs, cursor, has_more
+
+
+def event_stream(querysets, cursor, duration, limit=100):
+    """
+    Server-sent events with the logs after the cursor, until `duration` seconds passed.
+    Each event's id is the cursor after its logs, which the EventSource sends back as Last-Event-ID when it reconnects.
+    """
+    encoder = DjangoJSONEncoder()
+    deadline = time.monotonic() + duration
+
+    yield "retry: 1000\n\n"
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+
+        logs, cursor, has_more = poll(querysets, cursor, min(HEARTBEAT_INTERVAL, remaining), limit)
+        if any(logs.values()):
+            yield "id: {}\nevent: logs\ndata: {}\n\n".format(format_cursor(cursor), encoder.encode(logs))
+        else:
+            yield ": keep-alive\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF accept "Accept: text/event-stream". Only errors are rendered by it, events are streamed by the view.
+    """
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return "event: error\ndata: {}\n\n".format(DjangoJSONEncoder().encode(data))
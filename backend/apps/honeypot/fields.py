@@ -0,0 +1,193 @@
+import re
+import struct
+import threading
+import zlib
+from collections import Counter
+
+from django.apps import apps
+from django.db import connection, models, transaction
+
+# the first byte of a stored value tells how the rest is encoded
+RAW = b"\x00"  # utf-8, for values that don't get smaller
+DEFLATE = b"\x01"  # raw deflate stream
+DEFLATE_WITH_DICTIONARY = b"\x02"  # 4 byte dictionary id (adler32 of the dictionary), raw deflate stream
+
+COMPRESSION_LEVEL = 6
+# zlib only uses the last 32 KiB of a dictionary
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# JSON strings, keys with their colon, e.g. '"HTTP_USER_AGENT": '
+_JSON_FRAGMENT_PATTERN = re.compile(r'"(?:[^"\\]|\\.){0,256}"(?:\s*:\s*)?')
+
+
+class CompressionDictionaries(object):
+    """
+    Preset dictionaries of CompressedTextFields, trained with `manage.py train_compression_dictionary`.
+
+    Dictionaries are stored in the database (see CompressionDictionary), values compressed with one reference it
+    by id; the newest dictionary of a column is the one new values are compressed with.
+    Dictionaries are read once per process, a newly trained one is used after a restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dictionaries = {}  # (name, id) -> bytes
+        self._current = {}  # name -> (id, bytes) or None
+
+    def current(self, name):
+        """
+        :return: (id, dictionary) new values of the column are compressed with, None if it has none
+        """
+        if name not in self._current:
+            with self._lock:
+                self._current[name] = self._read_current(name)
+        return self._current[name]
+
+    def get(self, name, dictionary_id):
+        key = (name, dictionary_id)
+        if key not in self._dictionaries:
+            data = self._model().objects.filter(
+                name=name, dictionary_id=dictionary_id
+            ).values_list("data", flat=True).first()
+            if data is None:
+                raise ValueError("Compression dictionary {} {:08x} is missing".format(name, dictionary_id))
+            self._dictionaries[key] = bytes(data)
+        return self._dictionaries[key]
+
+    def add(self, name, dictionary):
+        """
+        Stores a dictionary and makes it the current one of the column (in this process right away).
+        :return: the dictionary's id
+        """
+        dictionary_id = zlib.adler32(dictionary)
+        model = self._model()
+        with transaction.atomic():
+            existing = model.objects.filter(name=name, dictionary_id=dictionary_id)
+            data = existing.values_list("data", flat=True).first()
+            if data is not None and bytes(data) != dictionary:
+                # values compressed with the stored one could not be read anymore
+                raise ValueError("Compression dictionary {} {:08x} exists with other content".format(
+                    name, dictionary_id
+                ))
+            # the newest dictionary is the current one
+            existing.delete()
+            model.objects.create(name=name, dictionary_id=dictionary_id, data=dictionary)
+
+        with self._lock:
+            self._dictionaries[(name, dictionary_id)] = dictionary
+            self._current[name] = (dictionary_id, dictionary)
+        return dictionary_id
+
+    @staticmethod
+    def _model():
+        # the model is defined in models.py, which uses the fields of this module
+        return apps.get_model("honeypot", "CompressionDictionary")
+
+    def _read_current(self, name):
+        model = self._model()
+        # the migrations compressing the existing values run before the one creating the table
+        if model._meta.db_table not in connection.introspection.table_names():
+            return None
+        row = model.objects.filter(name=name).order_by("-pk").values_list("dictionary_id", "data").first()
+        if row is None:
+            return None
+        dictionary_id, data = row
+        self._dictionaries[(name, dictionary_id)] = bytes(data)
+        return dictionary_id, bytes(data)
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE, min_share=0.05):
+    """
+    Builds a preset dictionary from sample values: the JSON strings and keys that appear in at least `min_share`
+    of the samples, the most common ones last (closest to the data, i.e. the cheapest to reference).
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(_JSON_FRAGMENT_PATTERN.findall(sample)))
+
+    min_count = max(2, int(len(samples) * min_share))
+    fragments = [fragment for fragment, count in counts.most_common() if count >= min_count]
+
+    dictionary = bytearray()
+    for fragment in fragments:
+        encoded = fragment.encode("utf-8")
+        if len(dictionary) + len(encoded) > size:
+            break
+        dictionary[:0] = encoded
+    return bytes(dictionary)
+
+
+class CompressedTextField(models.TextField):
+    """
+    A TextField stored compressed (zlib) in a binary column. Python code, forms and serializers see the text.
+
+    With a `dictionary` name, values are compressed with the column's current preset dictionary, if one was trained
+    (see CompressionDictionaries), which pays off for short values repeating the same keys, e.g. request headers.
+    The column can't be searched with text lookups.
+    """
+
+    def __init__(self, *args, dictionary=None, **kwargs):
+        self.dictionary = dictionary
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dictionary is not None:
+            kwargs["dictionary"] = self.dictionary
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        # the column type, bytea on PostgreSQL and BLOB on SQLite
+        return "BinaryField"
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return self.decompress(bytes(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is None:
+            return value
+        return connection.Database.Binary(self.compress(value))
+
+    def compress(self, text):
+        if not text:
+            return b""
+        data = text.encode("utf-8")
+
+        current = self.dictionary and compression_dictionaries.current(self.dictionary)
+        if current:
+            dictionary_id, dictionary = current
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+            header = DEFLATE_WITH_DICTIONARY + struct.pack(">I", dictionary_id)
+        else:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+            header = DEFLATE
+        compressed = compressor.compress(data) + compressor.flush()
+
+        if len(header) + len(compressed) >= 1 + len(data):
+            return RAW + data
+        return header + compressed
+
+    def decompress(self, value):
+        if not value:
+            return ""
+
+        header = value[:1]
+        if header == RAW:
+            data = value[1:]
+        elif header == DEFLATE:
+            data = zlib.decompress(value[1:], -zlib.MAX_WBITS)
+        elif header == DEFLATE_WITH_DICTIONARY:
+            dictionary_id, = struct.unpack(">I", value[1:5])
+            decompressor = zlib.decompressobj(
+                -zlib.MAX_WBITS, zdict=compression_dictionaries.get(self.dictionary, dictionary_id)
+            )
+            data = decompressor.decompress(value[5:]) + decompressor.flush()
+        else:
+            raise ValueError("{}: unknown compression header {!r}".format(self, header))
+        return data.decode("utf-8")
+
+
+compression_dictionaries = CompressionDictionaries()
@@ -0,0 +1,89 @@
+import os
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from honeypot import partitions
+
+
+class Command(BaseCommand):
+    """Manages the monthly partitions of the AccessLog table on PostgreSQL (see honeypot/partitions.py)"""
+
+    def add_arguments(self, parser):
+        actions = parser.add_subparsers(dest="action", required=True)
+        actions.add_parser("list", help="show the partitions")
+        actions.add_parser(
+            "convert", help="partition the AccessLog table, the existing rows become its legacy partition"
+        )
+
+        ensure = actions.add_parser("ensure", help="create the partitions of this month and the coming months")
+        ensure.add_argument("--months", type=int, default=settings.ACCESS_LOG_PARTITIONS_AHEAD)
+
+        retain = actions.add_parser(
+            "retain", help="archive partitions older than the retention period to compressed CSV files and drop them"
+        )
+        retain.add_argument("--months", type=int, default=settings.ACCESS_LOG_RETENTION_MONTHS,
+                            help="full months to keep besides the current one, 0 keeps everything")
+        retain.add_argument("--archive-dir", default=settings.ACCESS_LOG_ARCHIVE_DIR)
+        retain.add_argument("--dry-run", action="store_true", help="only show which partitions would be archived")
+
+        restore = actions.add_parser("restore", help="import archived partitions again")
+        restore.add_argument("files", nargs="+")
+
+    def handle(self, *args, **options):
+        action = options["action"]
+        if action == "ensure" and not partitions.is_partitioned():
+            # run on every start (see entrypoint.sh), so unpartitioned and non-PostgreSQL databases are fine
+            self.stdout.write("{} is not partitioned, nothing to do".format(partitions.TABLE))
+            return
+
+        try:
+            getattr(self, "_" + action)(**options)
+        except partitions.PartitionError as e:
+            raise CommandError(e)
+
+    def _list(self, **options):
+        partitions.check_database()
+        for partition in partitions.partitions():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [partition.name])
+                rows = cursor.fetchone()[0]
+            self.stdout.write("{}: {} - {}, ~{} rows".format(
+                partition.name, partition.start or "MINVALUE", partition.end or "MAXVALUE", max(rows, 0)
+            ))
+
+    def _convert(self, **options):
+        boundary = partitions.convert()
+        self.stdout.write("Existing rows are in {} (up to {})".format(partitions.LEGACY_PARTITION, boundary))
+        self._ensure(months=settings.ACCESS_LOG_PARTITIONS_AHEAD, start=boundary)
+
+    def _ensure(self, months, start=None, **options):
+        for name in partitions.ensure(months, start):
+            self.stdout.write("Created {}".format(name))
+        self.stdout.write(self.style.SUCCESS("Partitions are up to date"))
+
+    def _retain(self, months, archive_dir, dry_run, **options):
+        partitions.check_database()
+        if months <= 0:
+            self.stdout.write("The retention period is unlimited, nothing to do")
+            return
+
+        for partition in partitions.expired(months):
+            if dry_run:
+                self.stdout.write("Would archive {} to {}".format(
+                    partition.name, partitions.archive_path(archive_dir, partition.name)
+                ))
+                continue
+            path, rows = partitions.archive(partition, archive_dir)
+            self.stdout.write("Archived {} rows of {} to {}".format(rows, partition.name, path))
+        self.stdout.write(self.style.SUCCESS("Partitions older than {} months are archived".format(months)))
+
+    def _restore(self, files, **options):
+        partitions.check_database()
+        for path in files:
+            if not os.path.isfile(path):
+                raise CommandError("{} does not exist".format(path))
+            rows = partitions.restore(path)
+            self.stdout.write("Imported {} rows from {}".format(rows, path))
+        self.stdout.write(self.style.SUCCESS("Archives are restored"))
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from honeypot.models import AccessLog, BrowserFingerprintLog, FingerprintLog, WITHOUT_CORRELATION_KEYS
+
+# models with correlation keys and the fields they are derived from
+MODELS = (
+    (AccessLog, ("http_host",)),
+    (FingerprintLog, ("visited_url",)),
+    (BrowserFingerprintLog, ("visited_url",)),
+)
+
+
+class Command(BaseCommand):
+    """Sets the correlation keys (host_key and honeypage) of logs written before they existed"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="logs per query and transaction")
+        parser.add_argument(
+            "--all", action="store_true",
+            help="resolve the keys of all logs again, e.g. for honeypages created after their first logs"
+        )
+
+    def handle(self, *args, **options):
+        for model, source_fields in MODELS:
+            start = time.perf_counter()
+            checked, updated = self._backfill(model, source_fields, options["chunk_size"], options["all"])
+            self.stdout.write("{}: {} logs checked, {} updated in {:.1f} s".format(
+                model._meta.verbose_name, checked, updated, time.perf_counter() - start
+            ))
+
+        self.stdout.write(self.style.SUCCESS("Correlation keys are up to date"))
+
+    def _backfill(self, model, source_fields, chunk_size, all_logs):
+        """
+        Walks the logs in id order, one chunk per transaction, so the tables are never locked for long
+        and an interrupted run can simply be started again.
+        :return: (checked logs, updated logs)
+        """
+        queryset = model.objects.all() if all_logs else model.objects.filter(WITHOUT_CORRELATION_KEYS)
+        queryset = queryset.order_by("id").only("id", "host_key", "honeypage", *source_fields)
+
+        checked = updated = 0
+        last_id = 0
+        while True:
+            logs = list(queryset.filter(id__gt=last_id)[:chunk_size])
+            if not logs:
+                break
+            last_id = logs[-1].id
+
+            changed = []
+            for log in logs:
+                keys = (log.host_key, log.honeypage_id)
+                log.set_correlation_keys()
+                if (log.host_key, log.honeypage_id) != keys:
+                    changed.append(log)
+
+            with transaction.atomic():
+                model.objects.bulk_update(changed, ["host_key", "honeypage"], batch_size=1000)
+
+            checked += len(logs)
+            updated += len(changed)
+            self.stdout.write("  {}: {} logs checked, up to #{}".format(model._meta.verbose_name, checked, last_id))
+
+        return checked, updated
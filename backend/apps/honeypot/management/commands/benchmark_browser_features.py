@@ -0,0 +1,115 @@
+import random
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from honeypot.feature_map import BROWSER_LIKE_FLAGS, get_feature_map, load_sources
+
+
+def _is_like_browser(data, browser):
+    return (
+        (
+            not data["chrome"] and not data["chrome_like"] and not data["edge_like"] and not data["old_ie"]
+            and not data["ie_like"] and not data["mozilla_like"] and not data["netscape"] and not data["opera"]
+            and not data["opera_like"] and not data["safari"] and not data["safari_like"]
+        )
+        or (
+            browser.startswith("chrome") and (data["chrome"] or data["chrome_like"] or data["phantom"])
+            and not data["edge_like"]
+        )
+        or (browser.startswith("edge") and data["edge_like"])
+        or (browser.startswith("firefox") and (data["netscape"] or data["mozilla_like"]) and not data["ie_like"])
+        or (browser.startswith("ie") and (data["old_ie"] or data["ie_like"]))
+        or (browser.startswith("opera") and (data["opera"] or data["opera_like"]))
+        or (browser.startswith("safari") and (data["safari"] or data["safari_like"]))
+    )
+
+
+def parse_features_reference(data, feature_scope, browser_feature_map):
+    """
+    The original feature-by-feature matcher, used as reference for the compiled bitmasks.
+    """
+    features = data["features"]
+    if len(features) != len(feature_scope):
+        return {"max": 0, "result": ["unknown"]}
+
+    matches = {}
+    for feature_idx, feature in enumerate(features):
+        for browser in browser_feature_map.keys():
+            if not _is_like_browser(data, browser):
+                continue
+
+            client_has_feature = feature == "1"
+            browser_has_feature = feature_scope[feature_idx] in browser_feature_map[browser]
+
+            if not (client_has_feature ^ browser_has_feature):  # XNOR
+                matches[browser] = matches[browser] + 1 if browser in matches else 1
+
+    max_score = 0
+    result = []
+    for browser in matches.keys():
+        score = matches[browser]
+        if score > max_score:
+            max_score = score
+            result = [browser]
+        elif score == max_score:
+            result.append(browser)
+
+    return {"max": max_score, "result": result}
+
+
+class Command(BaseCommand):
+    """Compares the compiled browser feature matcher with the reference implementation"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=20, help="number of random fingerprints")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        feature_scope, browser_feature_map = load_sources()
+
+        start = time.perf_counter()
+        feature_map = get_feature_map()
+        load_time = time.perf_counter() - start
+
+        rng = random.Random(options["seed"])
+        samples = [
+            self._random_fingerprint(rng, feature_scope, browser_feature_map) for _ in range(options["samples"])
+        ]
+
+        start = time.perf_counter()
+        reference = [parse_features_reference(data, feature_scope, browser_feature_map) for data in samples]
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compiled = [feature_map.parse_features(data) for data in samples]
+        compiled_time = time.perf_counter() - start
+
+        mismatches = [i for i in range(len(samples)) if reference[i] != compiled[i]]
+        if mismatches:
+            raise CommandError("Results differ for samples {}".format(mismatches))
+
+        self.stdout.write("{} features x {} browsers, {} fingerprints".format(
+            len(feature_scope), len(browser_feature_map), len(samples)
+        ))
+        self.stdout.write("loading the feature map: {:.2f} ms".format(1000 * load_time))
+        self.stdout.write("reference: {:.2f} ms per fingerprint".format(1000 * reference_time / len(samples)))
+        self.stdout.write("compiled:  {:.3f} ms per fingerprint".format(1000 * compiled_time / len(samples)))
+        self.stdout.write(self.style.SUCCESS("Identical results, {:.0f}x faster".format(
+            reference_time / max(compiled_time, 1e-9)
+        )))
+
+    @staticmethod
+    def _random_fingerprint(rng, feature_scope, browser_feature_map):
+        """
+        A real browser's feature vector with a few flipped features and random browser-like flags.
+        """
+        browser = rng.choice(list(browser_feature_map.keys()))
+        browser_features = set(browser_feature_map[browser])
+        features = ["1" if feature in browser_features else "0" for feature in feature_scope]
+        for idx in rng.sample(range(len(features)), 10):
+            features[idx] = "0" if features[idx] == "1" else "1"
+
+        data = {flag: rng.random() < 0.2 for flag in BROWSER_LIKE_FLAGS + ("phantom",)}
+        data["features"] = "".join(features)
+        return data
@@ -0,0 +1,148 @@
+import os
+import re
+import tempfile
+import time
+import zlib
+
+from django.core.management import BaseCommand, CommandError
+
+from honeypot.pdf import make_pdf, make_pdf_phone_home
+
+
+def check_xref_stream(pdf):
+    """
+    Resolves every object of a PDF with an xref stream the way a reader does.
+    :param pdf: bytes
+    :return: list of problems, empty if the document is fine
+    """
+    startxrefs = re.findall(rb"startxref\s+(\d+)\s+%%EOF\s*$", pdf)
+    if not startxrefs:
+        return ["no startxref"]
+    position = int(startxrefs[-1])
+
+    match = re.compile(rb"(\d+) 0 obj\s*<<(.*?)>>\s*stream\n").match(pdf, position)
+    if match is None or b"/Type /XRef" not in match.group(2):
+        return ["startxref {} does not point to an xref stream".format(position)]
+    dictionary = match.group(2)
+    widths = [int(w) for w in re.search(rb"/W \[(\d+) (\d+) (\d+)\]", dictionary).groups()]
+    size = int(re.search(rb"/Size (\d+)", dictionary).group(1))
+    length = int(re.search(rb"/Length (\d+)", dictionary).group(1))
+    data = pdf[match.end():match.end() + length]
+    if b"/FlateDecode" in dictionary:
+        data = zlib.decompress(data)
+    if len(data) != size * sum(widths):
+        return ["xref stream has {} bytes for {} entries".format(len(data), size)]
+
+    problems = []
+    object_streams = {}
+    entry_size = sum(widths)
+    for index in range(size):
+        entry = data[index * entry_size:(index + 1) * entry_size]
+        fields = []
+        for width in widths:
+            fields.append(int.from_bytes(entry[:width], "big"))
+            entry = entry[width:]
+        kind, field2, field3 = fields
+
+        if kind == 1:
+            if not pdf.startswith(b"%d %d obj" % (index, field3), field2):
+                problems.append("object {} is not at offset {}".format(index, field2))
+        elif kind == 2:
+            if field2 not in object_streams:
+                object_streams[field2] = _read_object_stream(pdf, data, widths, field2)
+            offsets = object_streams[field2]
+            if offsets is None or field3 >= len(offsets) or offsets[field3] != index:
+                problems.append("object {} is not number {} of object stream {}".format(index, field3, field2))
+    return problems
+
+
+def _read_object_stream(pdf, xref_data, widths, index):
+    """
+    :return: the object numbers in an object stream, in order
+    """
+    entry_size = sum(widths)
+    entry = xref_data[index * entry_size:(index + 1) * entry_size]
+    offset = int.from_bytes(entry[widths[0]:widths[0] + widths[1]], "big")
+
+    match = re.compile(rb"\d+ 0 obj\s*<<(.*?)>>\s*stream\n", re.S).match(pdf, offset)
+    if match is None or b"/Type /ObjStm" not in match.group(1):
+        return None
+    dictionary = match.group(1)
+    length = int(re.search(rb"/Length (\d+)", dictionary).group(1))
+    count = int(re.search(rb"/N (\d+)", dictionary).group(1))
+    first = int(re.search(rb"/First (\d+)", dictionary).group(1))
+    data = zlib.decompress(pdf[match.end():match.end() + length])
+
+    numbers = [int(n) for n in data[:first].split()]
+    if len(numbers) != 2 * count:
+        return None
+    return numbers[0::2]
+
+
+class Command(BaseCommand):
+    """Generates canary PDFs with the buffered writer and checks their xref streams"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=10000, help="number of PDFs per variant")
+
+    def handle(self, *args, **options):
+        count = options["count"]
+        urls = ["https://{:08x}.example.com/".format(i) for i in range(count)]
+
+        start = time.perf_counter()
+        classic = [make_pdf_phone_home.generate_pdf(url, url) for url in urls]
+        classic_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compact = [make_pdf_phone_home.generate_pdf(url, url, object_streams=True) for url in urls]
+        compact_time = time.perf_counter() - start
+
+        # the file variant opens its file once, in flush(), however many objects the document has
+        opened = []
+
+        def counting_open(*args, **kwargs):
+            opened.append(args[0])
+            return open(*args, **kwargs)
+
+        with tempfile.TemporaryDirectory() as directory:
+            make_pdf.open = counting_open
+            try:
+                start = time.perf_counter()
+                for i, url in enumerate(urls):
+                    pdf = make_pdf.cPDF(os.path.join(directory, "{}.pdf".format(i)))
+                    pdf.header("1.5")
+                    pdf.indirectobject(2, 0, "<<\n /Type /Pages\n /Kids []\n /Count 0\n>>")
+                    object_stream = make_pdf.cObjectStream(3, 0, "f")
+                    object_stream.indirectobject(
+                        1, "<<\n /Type /Catalog\n /Pages 2 0 R\n /OpenAction << /S /URI /URI ({}) >>\n>>".format(url)
+                    )
+                    pdf.objstm(object_stream)
+                    pdf.xrefobjAndTrailer(4, 0, "1 0 R", compress=True)
+                    pdf.flush()
+                file_time = time.perf_counter() - start
+            finally:
+                del make_pdf.open
+
+            with open(os.path.join(directory, "0.pdf"), "rb") as f:
+                file_problems = check_xref_stream(f.read())
+
+        for i, pdf in enumerate(compact):
+            problems = check_xref_stream(pdf)
+            if problems:
+                raise CommandError("PDF {} with object streams: {}".format(i, "; ".join(problems)))
+        if file_problems:
+            raise CommandError("PDF file: {}".format("; ".join(file_problems)))
+        if len(opened) != count:
+            raise CommandError("{} files opened for {} PDFs".format(len(opened), count))
+
+        self.stdout.write("{} canary PDFs per variant".format(count))
+        self.stdout.write("xref table:                    {:.1f} µs per PDF, {} bytes".format(
+            1e6 * classic_time / count, len(classic[0])
+        ))
+        self.stdout.write("object streams + xref stream:  {:.1f} µs per PDF, {} bytes".format(
+            1e6 * compact_time / count, len(compact[0])
+        ))
+        self.stdout.write("written to files:              {:.1f} µs per PDF, {} open() calls".format(
+            1e6 * file_time / count, len(opened)
+        ))
+        self.stdout.write(self.style.SUCCESS("All xref streams resolve every object"))
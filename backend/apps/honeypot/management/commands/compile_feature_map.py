@@ -0,0 +1,18 @@
+import os
+
+from django.core.management import BaseCommand
+
+from honeypot.feature_map import COMPILED_FEATURE_MAP_PATH, compile_feature_map
+
+
+class Command(BaseCommand):
+    """Compiles features-in-scope.txt and feature_map.json into the binary feature map used by browser_info"""
+
+    def handle(self, *args, **options):
+        feature_map = compile_feature_map()
+        self.stdout.write(self.style.SUCCESS("Compiled {} features x {} browsers into {} ({} bytes)".format(
+            len(feature_map.feature_scope),
+            len(feature_map.browsers),
+            COMPILED_FEATURE_MAP_PATH,
+            os.path.getsize(COMPILED_FEATURE_MAP_PATH),
+        )))
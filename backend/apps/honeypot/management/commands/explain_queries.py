@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from control_server.models import Experiment
+from honeypot.correlation import BROWSER_FINGERPRINT_LOG_WINDOW, FINGERPRINT_LOG_WINDOW
+from honeypot.models import AccessLog, BrowserFingerprintLog, FingerprintLog, Honeypage
+
+# rows per page of the log viewsets
+PAGE_SIZE = 100
+
+
+def log_queries():
+    """
+    The queries behind the log endpoints, for the newest AccessLog, honeypage and experiment.
+    :return: [(name, QuerySet), ...]
+    """
+    access_log = AccessLog.objects.order_by("-id").first() or AccessLog(
+        id=0, ip_address="127.0.0.1", http_host="", subdomain=""
+    )
+    honeypage = Honeypage.objects.order_by("-id").first() or Honeypage(id=0)
+    experiment = Experiment.objects.exclude(honeypage=None).order_by("-id").first()
+
+    queries = [
+        ("AccessLogViewSet.list", AccessLog.objects.select_related("user")),
+        ("AccessLogViewSet.similar", AccessLog.objects.filter(ip_address=access_log.ip_address)),
+        ("AccessLogViewSet.unauthenticated", AccessLog.objects.filter(user__isnull=True)),
+        ("AccessLogViewSet.authenticated", AccessLog.objects.filter(user__isnull=False)),
+        ("FingerprintLogViewSet.list", FingerprintLog.objects.all()),
+        ("BrowserFingerprintLogViewSet.list", BrowserFingerprintLog.objects.all()),
+        ("HoneypageViewSet.get_access_logs", honeypage.access_logs),
+        ("HoneypageViewSet.get_fingerprint_logs", honeypage.fingerprint_logs),
+        ("HoneypageViewSet.get_browser_fingerprint_logs", honeypage.browser_fingerprint_logs),
+    ]
+    if experiment is not None:
+        queries += [
+            ("ExperimentViewSet.get_access_logs", experiment.access_logs),
+            ("ExperimentViewSet.get_fingerprint_logs", experiment.fingerprint_logs),
+            ("ExperimentViewSet.get_browser_fingerprint_logs", experiment.browser_fingerprint_logs),
+            ("Experiment.evaluated_logs (1 day)", experiment.evaluated_logs(timedelta(days=1))),
+        ]
+
+    queries = [(name, queryset[:PAGE_SIZE]) for name, queryset in queries]
+
+    if access_log.timestamp is not None:
+        # AccessLog.matching_fingerprint_log and matching_browser_fingerprint_log
+        queries += [
+            ("AccessLog.matching_fingerprint_log", FingerprintLog.objects.filter(
+                access_log.host_filter(),
+                timestamp__gte=access_log.timestamp - FINGERPRINT_LOG_WINDOW[0],
+                timestamp__lte=access_log.timestamp + FINGERPRINT_LOG_WINDOW[1],
+            ).order_by("timestamp")[:1]),
+            ("AccessLog.matching_browser_fingerprint_log", BrowserFingerprintLog.objects.filter(
+                access_log.host_filter(),
+                timestamp__gte=access_log.timestamp - BROWSER_FINGERPRINT_LOG_WINDOW[0],
+                timestamp__lte=access_log.timestamp + BROWSER_FINGERPRINT_LOG_WINDOW[1],
+            ).order_by("timestamp")[:1]),
+        ]
+
+    return queries
+
+
+class Command(BaseCommand):
+    """Prints the query plans of the log endpoints, so a missing or unused index is easy to spot"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help="only queries whose name contains one of these")
+        parser.add_argument(
+            "--analyze", action="store_true", help="run the queries and show actual timings (PostgreSQL only)"
+        )
+
+    def handle(self, *args, **options):
+        explain_options = {}
+        if options["analyze"]:
+            if connection.vendor != "postgresql":
+                raise CommandError("--analyze is only supported on PostgreSQL")
+            explain_options = {"analyze": True, "buffers": True}
+
+        queries = [
+            (name, queryset) for name, queryset in log_queries()
+            if not options["names"] or any(part.lower() in name.lower() for part in options["names"])
+        ]
+        if not queries:
+            raise CommandError("No query matches {}".format(", ".join(options["names"])))
+
+        for name, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            if options["verbosity"] > 1:
+                self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write("")
@@ -0,0 +1,91 @@
+import time
+
+from django.apps import apps
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from honeypot.fields import CompressedTextField, compression_dictionaries, train_dictionary
+
+
+def dictionary_fields():
+    """
+    :return: {"<model>.<field>": (model, field)} of the CompressedTextFields that use a dictionary
+    """
+    return dict(
+        ("{}.{}".format(model.__name__, field.name), (model, field))
+        for model in apps.get_app_config("honeypot").get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, CompressedTextField) and field.dictionary
+    )
+
+
+class Command(BaseCommand):
+    """Trains the preset dictionaries of compressed columns on their newest values"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "columns", nargs="*", help="<model>.<field>, e.g. AccessLogPayload.headers (default: all columns)"
+        )
+        parser.add_argument("--samples", type=int, default=2000, help="number of (newest) values to train on")
+        parser.add_argument(
+            "--recompress", action="store_true", help="compress the existing values with the new dictionary"
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000, help="rows per query and transaction")
+
+    def handle(self, *args, **options):
+        fields = dictionary_fields()
+        unknown = set(options["columns"]) - set(fields)
+        if unknown:
+            raise CommandError("Unknown column(s) {}, choose from {}".format(
+                ", ".join(sorted(unknown)), ", ".join(sorted(fields))
+            ))
+
+        for column in options["columns"] or sorted(fields):
+            model, field = fields[column]
+            samples = list(
+                model.objects.exclude(**{field.name: None}).order_by("-pk")
+                .values_list(field.name, flat=True)[:options["samples"]]
+            )
+            samples = [sample for sample in samples if sample]
+            dictionary = train_dictionary(samples)
+            if not dictionary:
+                self.stdout.write("{}: not enough values to train on".format(column))
+                continue
+
+            dictionary_id = compression_dictionaries.add(field.dictionary, dictionary)
+            self.stdout.write("{}: dictionary {:08x} ({} bytes) from {} values".format(
+                column, dictionary_id, len(dictionary), len(samples)
+            ))
+
+            if options["recompress"]:
+                start = time.perf_counter()
+                rows = self._recompress(model, field, options["chunk_size"])
+                self.stdout.write("{}: {} values recompressed in {:.1f} s".format(
+                    column, rows, time.perf_counter() - start
+                ))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Running servers use the new dictionaries after a restart, older values can always be read"
+        ))
+
+    @staticmethod
+    def _recompress(model, field, chunk_size):
+        """
+        Rewrites the values in pk order, one chunk per transaction: they are read with whatever they were
+        compressed with and written with the current dictionary.
+        """
+        queryset = model.objects.exclude(**{field.name: None}).order_by("pk")
+        rows = 0
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            values = list(chunk.values_list("pk", field.name)[:chunk_size])
+            if not values:
+                return rows
+            last_pk = values[-1][0]
+
+            with transaction.atomic():
+                model.objects.bulk_update(
+                    [model(pk=pk, **{field.name: value}) for pk, value in values], [field.name], batch_size=500
+                )
+            rows += len(values)
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """
+    AddIndex that uses CREATE INDEX CONCURRENTLY on PostgreSQL, so the log tables stay writable while the index
+    is built, and a plain CREATE INDEX on other databases.
+    Like django.contrib.postgres' operation (which needs psycopg2 to be imported), the migration must be non-atomic.
+    Partitioned tables (see honeypot.partitions) don't support CONCURRENTLY and get a plain CREATE INDEX as well.
+    """
+    atomic = False
+
+    def describe(self):
+        return "Concurrently create index {} on field(s) {} of model {}".format(
+            self.index.name, ", ".join(self.index.fields or [str(expression) for expression in self.index.expressions]),
+            self.model_name
+        )
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self._concurrently(schema_editor, model):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self._concurrently(schema_editor, model):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+    @staticmethod
+    def _concurrently(schema_editor, model):
+        if schema_editor.connection.vendor != "postgresql":
+            return False
+
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [model._meta.db_table])
+            row = cursor.fetchone()
+        return row is None or row[0] != "p"
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honeypot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesslog',
+            name='honeypage',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='honeypot.honeypage'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='host_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='browserfingerprintlog',
+            name='honeypage',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='honeypot.honeypage'),
+        ),
+        migrations.AddField(
+            model_name='browserfingerprintlog',
+            name='host_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='fingerprintlog',
+            name='honeypage',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='honeypot.honeypage'),
+        ),
+        migrations.AddField(
+            model_name='fingerprintlog',
+            name='host_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+    ]
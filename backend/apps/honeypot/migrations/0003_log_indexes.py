@@ -0,0 +1,93 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from honeypot.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('honeypot', '0002_correlation_keys'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='accesslog',
+            index=models.Index(fields=['honeypage', 'id'], name='access_log_honeypage_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='accesslog',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['subdomain', 'id'], name='access_log_anon_subdomain_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='accesslog',
+            index=models.Index(fields=['ip_address', 'id'], name='access_log_ip_address_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='accesslog',
+            index=models.Index(fields=['timestamp'], name='access_log_timestamp_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='accesslog',
+            index=models.Index(condition=models.Q(('host_key', '')), fields=['id'], name='access_log_without_keys_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='browserfingerprintlog',
+            index=models.Index(fields=['honeypage', 'id'], name='browser_fp_log_honeypage_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='browserfingerprintlog',
+            index=models.Index(fields=['host_key', 'timestamp'], name='browser_fp_log_host_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='browserfingerprintlog',
+            index=models.Index(condition=models.Q(('host_key', '')), fields=['visited_url'], name='browser_fp_log_legacy_url_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fingerprintlog',
+            index=models.Index(fields=['honeypage', 'id'], name='fp_log_honeypage_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fingerprintlog',
+            index=models.Index(fields=['host_key', 'timestamp'], name='fp_log_host_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fingerprintlog',
+            index=models.Index(condition=models.Q(('host_key', '')), fields=['visited_url'], name='fp_log_legacy_url_idx'),
+        ),
+        # replaced by the composite indexes above
+        migrations.AlterField(
+            model_name='accesslog',
+            name='honeypage',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='honeypot.honeypage'),
+        ),
+        migrations.AlterField(
+            model_name='accesslog',
+            name='host_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='browserfingerprintlog',
+            name='honeypage',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='honeypot.honeypage'),
+        ),
+        migrations.AlterField(
+            model_name='browserfingerprintlog',
+            name='host_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='fingerprintlog',
+            name='honeypage',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='honeypot.honeypage'),
+        ),
+        migrations.AlterField(
+            model_name='fingerprintlog',
+            name='host_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honeypot', '0003_log_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessLogPayload',
+            fields=[
+                ('access_log', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='honeypot.accesslog')),
+                ('content_params', models.TextField(blank=True, null=True)),
+                ('headers', models.TextField(blank=True, null=True)),
+                ('get', models.TextField(blank=True, null=True)),
+                ('post', models.TextField(blank=True, null=True)),
+                ('cookies', models.TextField(blank=True, null=True)),
+                ('body', models.TextField(blank=True, null=True)),
+                ('meta', models.TextField(blank=True, null=True)),
+                ('files', models.TextField(blank=True, null=True)),
+                ('location', models.TextField(blank=True, verbose_name='GeoIP 2 Location')),
+                ('request', models.TextField(blank=True, verbose_name='Request')),
+                ('response', models.TextField(blank=True, verbose_name='Response')),
+            ],
+            options={
+                'verbose_name': 'Access Log Payload',
+                'db_table': 'honeypot_access_log_payloads',
+                'default_permissions': ['view'],
+            },
+        ),
+    ]
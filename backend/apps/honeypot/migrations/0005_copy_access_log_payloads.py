@@ -0,0 +1,86 @@
+from django.db import migrations, transaction
+
+PAYLOAD_FIELDS = (
+    "content_params", "headers", "get", "post", "cookies", "body", "meta", "files", "location", "request", "response"
+)
+
+# access logs per statement and transaction
+CHUNK_SIZE = 5000
+
+
+def _id_range(cursor, table, column):
+    cursor.execute("SELECT MIN({column}), MAX({column}) FROM {table}".format(table=table, column=column))
+    return cursor.fetchone()
+
+
+def copy_payloads(apps, schema_editor):
+    """
+    Copies the payload columns into the new table in id ranges, one transaction each. An interrupted
+    migration continues after the last copied log.
+    """
+    quote = schema_editor.quote_name
+    access_logs = quote(apps.get_model("honeypot", "AccessLog")._meta.db_table)
+    payloads = quote(apps.get_model("honeypot", "AccessLogPayload")._meta.db_table)
+    columns = ", ".join(quote(name) for name in PAYLOAD_FIELDS)
+
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        first_id, last_id = _id_range(cursor, access_logs, "id")
+        if first_id is None:
+            return
+        copied_id = _id_range(cursor, payloads, "access_log_id")[1]
+        if copied_id is not None:
+            first_id = max(first_id, copied_id + 1)
+
+        for start in range(first_id, last_id + 1, CHUNK_SIZE):
+            with transaction.atomic(using=connection.alias):
+                cursor.execute(
+                    "INSERT INTO {payloads} (access_log_id, {columns}) "
+                    "SELECT id, {columns} FROM {access_logs} WHERE id >= %s AND id < %s".format(
+                        payloads=payloads, access_logs=access_logs, columns=columns
+                    ),
+                    [start, start + CHUNK_SIZE]
+                )
+
+
+def restore_payloads(apps, schema_editor):
+    quote = schema_editor.quote_name
+    access_logs = quote(apps.get_model("honeypot", "AccessLog")._meta.db_table)
+    payloads = quote(apps.get_model("honeypot", "AccessLogPayload")._meta.db_table)
+    columns = ", ".join(quote(name) for name in PAYLOAD_FIELDS)
+
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        first_id, last_id = _id_range(cursor, payloads, "access_log_id")
+        if first_id is None:
+            return
+
+        for start in range(first_id, last_id + 1, CHUNK_SIZE):
+            with transaction.atomic(using=connection.alias):
+                cursor.execute(
+                    "UPDATE {access_logs} SET ({columns}) = ("
+                    "SELECT {columns} FROM {payloads} WHERE {payloads}.access_log_id = {access_logs}.id"
+                    ") WHERE id >= %s AND id < %s AND EXISTS ("
+                    "SELECT 1 FROM {payloads} WHERE {payloads}.access_log_id = {access_logs}.id"
+                    ")".format(payloads=payloads, access_logs=access_logs, columns=columns),
+                    [start, start + CHUNK_SIZE]
+                )
+                cursor.execute(
+                    "DELETE FROM {payloads} WHERE access_log_id >= %s AND access_log_id < %s".format(
+                        payloads=payloads
+                    ),
+                    [start, start + CHUNK_SIZE]
+                )
+
+
+class Migration(migrations.Migration):
+    # every chunk is committed on its own, the access log table is never locked for long
+    atomic = False
+
+    dependencies = [
+        ('honeypot', '0004_access_log_payloads'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_payloads, restore_payloads, elidable=True),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:43
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honeypot', '0005_copy_access_log_payloads'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='body',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='content_params',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='cookies',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='files',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='get',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='headers',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='location',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='meta',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='post',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='request',
+        ),
+        migrations.RemoveField(
+            model_name='accesslog',
+            name='response',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.8 on 2026-10-18 18:46
+
+from django.db import migrations
+import honeypot.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honeypot', '0006_remove_access_log_payload_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesslogpayload',
+            name='headers_compressed',
+            field=honeypot.fields.CompressedTextField(blank=True, dictionary='access_log_headers', null=True),
+        ),
+        migrations.AddField(
+            model_name='accesslogpayload',
+            name='meta_compressed',
+            field=honeypot.fields.CompressedTextField(blank=True, dictionary='access_log_meta', null=True),
+        ),
+        migrations.AddField(
+            model_name='accesslogpayload',
+            name='response_compressed',
+            field=honeypot.fields.CompressedTextField(blank=True, dictionary='access_log_response', null=True, verbose_name='Response'),
+        ),
+        migrations.AddField(
+            model_name='fingerprintlog',
+            name='components_compressed',
+            field=honeypot.fields.CompressedTextField(blank=True, dictionary='fingerprint_log_components', max_length=60000, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations, transaction
+from django.db.models import Max, Min
+
+# (model, text column, compressed column)
+COLUMNS = (
+    ("AccessLogPayload", "headers", "headers_compressed"),
+    ("AccessLogPayload", "meta", "meta_compressed"),
+    ("AccessLogPayload", "response", "response_compressed"),
+    ("FingerprintLog", "components", "components_compressed"),
+)
+
+# rows per query and transaction
+CHUNK_SIZE = 2000
+
+
+def _copy(apps, schema_editor, source_index, target_index):
+    """
+    Copies the columns in pk ranges, one transaction each. Compressed columns that are set already are skipped,
+    so an interrupted migration continues where it stopped.
+    """
+    alias = schema_editor.connection.alias
+    for model_name, *columns in COLUMNS:
+        model = apps.get_model("honeypot", model_name)
+        source, target = columns[source_index], columns[target_index]
+        queryset = model.objects.using(alias).filter(**{source + "__isnull": False})
+        if target_index == 1:
+            queryset = queryset.filter(**{target + "__isnull": True})
+
+        bounds = model.objects.using(alias).aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["first"] is None:
+            continue
+        for start in range(bounds["first"], bounds["last"] + 1, CHUNK_SIZE):
+            rows = queryset.filter(pk__gte=start, pk__lt=start + CHUNK_SIZE).values_list("pk", source)
+            with transaction.atomic(using=alias):
+                model.objects.using(alias).bulk_update(
+                    [model(pk=pk, **{target: value}) for pk, value in rows], [target], batch_size=500
+                )
+
+
+def compress_columns(apps, schema_editor):
+    _copy(apps, schema_editor, 0, 1)
+
+
+def decompress_columns(apps, schema_editor):
+    _copy(apps, schema_editor, 1, 0)
+
+
+class Migration(migrations.Migration):
+    # every chunk is committed on its own, the tables are never locked for long
+    atomic = False
+
+    dependencies = [
+        ('honeypot', '0007_compressed_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(compress_columns, decompress_columns, elidable=True),
+    ]
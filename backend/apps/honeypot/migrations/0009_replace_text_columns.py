@@ -0,0 +1,60 @@
+# Generated by Django 3.2.8 on 2026-10-18 18:46
+
+from django.db import migrations
+import honeypot.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honeypot', '0008_compress_columns'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='accesslogpayload',
+            name='headers',
+        ),
+        migrations.RemoveField(
+            model_name='accesslogpayload',
+            name='meta',
+        ),
+        migrations.RemoveField(
+            model_name='accesslogpayload',
+            name='response',
+        ),
+        migrations.RemoveField(
+            model_name='fingerprintlog',
+            name='components',
+        ),
+        migrations.RenameField(
+            model_name='accesslogpayload',
+            old_name='headers_compressed',
+            new_name='headers',
+        ),
+        migrations.RenameField(
+            model_name='accesslogpayload',
+            old_name='meta_compressed',
+            new_name='meta',
+        ),
+        migrations.RenameField(
+            model_name='accesslogpayload',
+            old_name='response_compressed',
+            new_name='response',
+        ),
+        migrations.RenameField(
+            model_name='fingerprintlog',
+            old_name='components_compressed',
+            new_name='components',
+        ),
+        migrations.AlterField(
+            model_name='accesslogpayload',
+            name='response',
+            field=honeypot.fields.CompressedTextField(blank=True, dictionary='access_log_response', verbose_name='Response'),
+        ),
+        migrations.AlterField(
+            model_name='fingerprintlog',
+            name='components',
+            field=honeypot.fields.CompressedTextField(blank=True, dictionary='fingerprint_log_components', max_length=60000),
+        ),
+    ]
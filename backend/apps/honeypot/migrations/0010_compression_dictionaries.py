@@ -0,0 +1,64 @@
+# Generated by Django 3.2.8 on 2026-10-18 17:01
+
+import glob
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+# where the dictionaries used to be stored, `<directory>/<name>/<id>.zdict` and `<directory>/<name>/current`
+DICTIONARY_DIR = os.environ.get("COMPRESSION_DICTIONARY_DIR", os.path.join(settings.DJANGO_ROOT, "run", "zdict"))
+
+
+def import_dictionaries(apps, schema_editor):
+    """
+    Stores the dictionaries of the directory in the table, the current one of each column last (i.e. newest).
+    """
+    model = apps.get_model("honeypot", "CompressionDictionary")
+    alias = schema_editor.connection.alias
+
+    for directory in sorted(glob.glob(os.path.join(DICTIONARY_DIR, "*", ""))):
+        name = os.path.basename(os.path.dirname(directory))
+        try:
+            with open(os.path.join(directory, "current"), "r") as current_file:
+                current_id = int(current_file.read().strip(), 16)
+        except (OSError, ValueError):
+            current_id = None
+
+        dictionaries = {}
+        for path in glob.glob(os.path.join(directory, "*.zdict")):
+            with open(path, "rb") as dictionary_file:
+                dictionaries[int(os.path.basename(path)[:-len(".zdict")], 16)] = dictionary_file.read()
+
+        for dictionary_id in sorted(dictionaries, key=lambda i: (i == current_id, os.path.getmtime(
+            os.path.join(directory, "{:08x}.zdict".format(i))
+        ))):
+            model.objects.using(alias).get_or_create(
+                name=name, dictionary_id=dictionary_id, defaults={"data": dictionaries[dictionary_id]}
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honeypot', '0009_replace_text_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('dictionary_id', models.BigIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Compression Dictionary',
+                'db_table': 'honeypot_compression_dictionaries',
+                'unique_together': {('name', 'dictionary_id')},
+            },
+        ),
+        migrations.RunPython(import_dictionaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honeypot', '0010_compression_dictionaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesslog',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+    ]
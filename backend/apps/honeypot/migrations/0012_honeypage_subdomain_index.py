@@ -0,0 +1,22 @@
+# Generated by Django 3.2.8 on 2026-10-18 17:14
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+from honeypot.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('honeypot', '0011_access_log_created_at'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='honeypage',
+            index=models.Index(django.db.models.functions.text.Lower('subdomain'), name='honeypage_subdomain_lower_idx'),
+        ),
+    ]
@@ -4,11 +4,103 @@ from datetime import timedelta
 from itertools import chain
 
 from codename import codename
-from django.db import models
+from django.conf import settings
+from django.db import connection, connections, models, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Lower
 from django.utils.functional import cached_property
 from django.utils.timesince import timesince
 
 from control_server.core import SERVER_ADDRESS, PROTOCOL
+from control_server.time import now
+from .fields import CompressedTextField
+from .registry import honeypage_registry, normalize_host, split_url
+
+# logs written before the correlation keys existed, until `manage.py backfill_correlation_keys` ran
+WITHOUT_CORRELATION_KEYS = Q(host_key="")
+
+
+def resolve_correlation_keys(host_key, path=None):
+    """
+    The correlation keys of a log of the host (see normalize_host) and path. The registry looks up honeypages it
+    doesn't know in the database, so those created by other processes are found as well.
+    :return: (host key, honeypage id or None)
+    """
+    entry = honeypage_registry.resolve(host_key, path)
+    return host_key, entry.id if entry else None
+
+
+# the large columns of an AccessLog, stored in AccessLogPayload
+ACCESS_LOG_PAYLOAD_FIELDS = (
+    "content_params", "headers", "get", "post", "cookies", "body", "meta", "files", "location", "request", "response"
+)
+
+
+def _payload_property(name):
+    """
+    An AccessLog attribute that reads and writes the field of the log's payload, so AccessLog(headers=...),
+    log.headers and friends work as before the payload had its own table.
+    """
+
+    def getter(self):
+        return getattr(self.get_payload(), name)
+
+    def setter(self, value):
+        setattr(self.get_payload(), name, value)
+
+    return property(getter, setter, doc="AccessLogPayload.{}".format(name))
+
+
+def commit_cutoff():
+    """
+    Logs written before this time are committed: logs are written in batches by several processes,
+    so their ids don't become visible in id order (see ACCESS_LOG_COMMIT_LAG).
+    """
+    return now() - timedelta(seconds=settings.ACCESS_LOG_COMMIT_LAG)
+
+
+class AccessLogQuerySet(models.QuerySet):
+    def committed(self):
+        """
+        The logs written before commit_cutoff() (and those from before AccessLog.created_at existed).
+        """
+        return self.filter(Q(created_at__lt=commit_cutoff()) | Q(created_at__isnull=True))
+
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False):
+        """
+        Creates the logs and their payloads. The payloads need the ids of the logs: PostgreSQL returns them,
+        on SQLite they are the newest ids after the insert (writers are serialized, so they are contiguous).
+        Otherwise (other databases, logs with ids), the logs are saved one by one.
+        """
+        if ignore_conflicts:
+            raise ValueError("AccessLogs can't be bulk created with ignore_conflicts, their payloads need the ids")
+
+        objs = list(objs)
+        if not objs:
+            return objs
+
+        database = connections[self.db]
+        with transaction.atomic(using=self.db, savepoint=False):
+            if database.features.can_return_rows_from_bulk_insert:
+                objs = super().bulk_create(objs, batch_size=batch_size)
+            elif database.vendor == "sqlite" and all(obj.pk is None for obj in objs):
+                objs = super().bulk_create(objs, batch_size=batch_size)
+                ids = list(self.model._base_manager.using(self.db).order_by("-pk").values_list(
+                    "pk", flat=True
+                )[:len(objs)])
+                for obj, pk in zip(objs, reversed(ids)):
+                    obj.pk = pk
+                    obj._state.adding = False
+                    obj._state.db = self.db
+            else:
+                for obj in objs:
+                    obj.save(using=self.db)
+                return objs
+
+            payloads = [obj.payload for obj in objs if AccessLog.payload.is_cached(obj)]
+            AccessLogPayload.objects.using(self.db).bulk_create(payloads, batch_size=batch_size)
+        return objs
 
 
 class AccessLog(models.Model):
@@ -27,24 +119,57 @@ class AccessLog(models.Model):
 
     method = models.CharField(max_length=8, null=False, blank=True)
     content_type = models.CharField(max_length=100, null=True, blank=True)
-    content_params = models.TextField(null=True, blank=True)
     scheme = models.CharField(max_length=24, null=True, blank=True)
 
-    headers = models.TextField(null=True, blank=True)
-    get = models.TextField(null=True, blank=True)
-    post = models.TextField(null=True, blank=True)
-    cookies = models.TextField(null=True, blank=True)
-    body = models.TextField(null=True, blank=True)
-    meta = models.TextField(null=True, blank=True)
-    files = models.TextField(null=True, blank=True)
-
     session_key = models.CharField(max_length=4096, null=False, blank=True)
 
     timestamp = models.DateTimeField(null=False, blank=True)
-    location = models.TextField(verbose_name="GeoIP 2 Location", blank=True)
+    # when the log was inserted, which can be long after the request (see backend/log_sink.py);
+    # None for logs written before the column existed
+    created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+
+    # large columns, stored in the log's payload (a separate table) and only read when they are accessed
+    content_params = _payload_property("content_params")
+    headers = _payload_property("headers")
+    get = _payload_property("get")
+    post = _payload_property("post")
+    cookies = _payload_property("cookies")
+    body = _payload_property("body")
+    meta = _payload_property("meta")
+    files = _payload_property("files")
+    location = _payload_property("location")
+    request = _payload_property("request")
+    response = _payload_property("response")
+
+    # correlation keys, set when the log is written: normalized http_host and the honeypage of its subdomain
+    host_key = models.CharField(max_length=255, null=False, blank=True, default="")
+    honeypage = models.ForeignKey(
+        "honeypot.Honeypage", on_delete=models.SET_NULL, null=True, blank=True, db_index=False  # see Meta.indexes
+    )
 
-    request = models.TextField(verbose_name="Request", blank=True)
-    response = models.TextField(verbose_name="Response", blank=True)
+    objects = AccessLogQuerySet.as_manager()
+
+    def set_correlation_keys(self):
+        self.host_key, self.honeypage_id = resolve_correlation_keys(normalize_host(self.http_host))
+
+    def get_payload(self):
+        """
+        The payload of the log, a new one if it has none yet, which is saved with the log.
+        Use select_related("payload") to read the payloads of many logs.
+        """
+        try:
+            return self.payload
+        except AccessLogPayload.DoesNotExist:
+            self.payload = AccessLogPayload(access_log=self)
+            return self.payload
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get("using")
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            if AccessLog.payload.is_cached(self) and kwargs.get("update_fields") is None:
+                # the payload was set or read, e.g. by the constructor
+                self.get_payload().save(using=using)
 
     @property
     def user_agent(self):
@@ -64,6 +189,8 @@ class AccessLog(models.Model):
         """
         Matching Honeypage (matched on subdomain).
         """
+        if self.host_key:
+            return self.honeypage
         return Honeypage.objects.filter(subdomain__iexact=self.subdomain).first()
 
     @cached_property
@@ -106,6 +233,13 @@ class AccessLog(models.Model):
 
         return ""
 
+    def host_filter(self):
+        """
+        Filter for (Browser)FingerprintLogs of the same host, those without correlation keys by their visited_url.
+        """
+        host_key = self.host_key or normalize_host(self.http_host)
+        return Q(host_key=host_key) | (WITHOUT_CORRELATION_KEYS & Q(visited_url__icontains=self.http_host))
+
     @cached_property
     def matching_fingerprint_log(self):
         """
@@ -114,7 +248,7 @@ class AccessLog(models.Model):
         """
 
         return FingerprintLog.objects.filter(
-            visited_url__icontains=self.http_host,
+            self.host_filter(),
             timestamp__gte=self.timestamp - timedelta(seconds=3),
             timestamp__lte=self.timestamp + timedelta(minutes=1),
         ).order_by('timestamp').first()
@@ -141,7 +275,7 @@ class AccessLog(models.Model):
         Only includes fingerprints received in under 3 minutes after logging the request.
         """
         return BrowserFingerprintLog.objects.filter(
-            visited_url__icontains=self.http_host,
+            self.host_filter(),
             timestamp__gte=self.timestamp - timedelta(seconds=10),
             timestamp__lte=self.timestamp + timedelta(minutes=2),
         ).order_by('timestamp').first()
@@ -161,6 +295,73 @@ class AccessLog(models.Model):
         ordering = [
             "-pk",
         ]
+        # lists are ordered by -pk, so filters come with the id to read a page straight from the index
+        indexes = [
+            # logs of honeypages and experiments
+            models.Index(fields=["honeypage", "id"], name="access_log_honeypage_idx"),
+            # the same for logs without correlation keys, and the unauthenticated logs of a subdomain
+            models.Index(
+                fields=["subdomain", "id"], condition=Q(user__isnull=True), name="access_log_anon_subdomain_idx"
+            ),
+            # AccessLogViewSet.similar
+            models.Index(fields=["ip_address", "id"], name="access_log_ip_address_idx"),
+            # time ranges, e.g. evaluations limited to a duration
+            models.Index(fields=["timestamp"], name="access_log_timestamp_idx"),
+            # backfill_correlation_keys, empty once it ran
+            models.Index(fields=["id"], condition=Q(host_key=""), name="access_log_without_keys_idx"),
+        ]
+
+
+class AccessLogPayload(models.Model):
+    """
+    The large columns of an AccessLog, which lists, evaluations and correlations don't need.
+    Without them the access log table stays small enough for scans over many logs to run from memory.
+    """
+    # no database constraint, a partitioned access log table has no unique id to reference (see partitions.py)
+    access_log = models.OneToOneField(
+        "honeypot.AccessLog", on_delete=models.CASCADE, primary_key=True, related_name="payload", db_constraint=False
+    )
+
+    content_params = models.TextField(null=True, blank=True)
+
+    # JSON repeating the same keys in every log, stored compressed
+    headers = CompressedTextField(null=True, blank=True, dictionary="access_log_headers")
+    get = models.TextField(null=True, blank=True)
+    post = models.TextField(null=True, blank=True)
+    cookies = models.TextField(null=True, blank=True)
+    body = models.TextField(null=True, blank=True)
+    meta = CompressedTextField(null=True, blank=True, dictionary="access_log_meta")
+    files = models.TextField(null=True, blank=True)
+
+    location = models.TextField(verbose_name="GeoIP 2 Location", blank=True)
+
+    request = models.TextField(verbose_name="Request", blank=True)
+    response = CompressedTextField(verbose_name="Response", blank=True, dictionary="access_log_response")
+
+    class Meta:
+        app_label = "honeypot"
+        db_table = "honeypot_access_log_payloads"
+        default_permissions = ["view"]
+        verbose_name = "Access Log Payload"
+
+
+class CompressionDictionary(models.Model):
+    """
+    A preset dictionary of a CompressedTextField (see fields.py), values compressed with it can't be read without it.
+    """
+    name = models.CharField(max_length=64)  # the field's dictionary name
+    dictionary_id = models.BigIntegerField()  # adler32 of the dictionary, which the compressed values carry
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "{} {:08x}".format(self.name, self.dictionary_id)
+
+    class Meta:
+        app_label = "honeypot"
+        db_table = "honeypot_compression_dictionaries"
+        verbose_name = "Compression Dictionary"
+        unique_together = [["name", "dictionary_id"]]
 
 
 class Fingerprint(models.Model):
@@ -193,9 +394,18 @@ class FingerprintLog(models.Model):
         blank=True,
         null=True,
     )
-    components = models.CharField(max_length=60000, null=False, blank=True)
+    components = CompressedTextField(max_length=60000, null=False, blank=True, dictionary="fingerprint_log_components")
     timestamp = models.DateTimeField(auto_now_add=True, null=False, blank=True)
 
+    # correlation keys, set when the log is written: normalized host of visited_url and the honeypage it belongs to
+    host_key = models.CharField(max_length=255, null=False, blank=True, default="")
+    honeypage = models.ForeignKey(
+        "honeypot.Honeypage", on_delete=models.SET_NULL, null=True, blank=True, db_index=False  # see Meta.indexes
+    )
+
+    def set_correlation_keys(self):
+        self.host_key, self.honeypage_id = resolve_correlation_keys(*split_url(self.visited_url))
+
     class Meta:
         app_label = "honeypot"
         db_table = "honeypot_fingerprint_logs"
@@ -204,6 +414,14 @@ class FingerprintLog(models.Model):
         ordering = [
             "-pk",
         ]
+        indexes = [
+            # logs of honeypages and experiments, ordered by -pk
+            models.Index(fields=["honeypage", "id"], name="fp_log_honeypage_idx"),
+            # the logs of an AccessLog's host around its timestamp (see AccessLog.host_filter)
+            models.Index(fields=["host_key", "timestamp"], name="fp_log_host_time_idx"),
+            # logs without correlation keys are matched on their visited_url
+            models.Index(fields=["visited_url"], condition=Q(host_key=""), name="fp_log_legacy_url_idx"),
+        ]
 
 
 class BrowserFingerprintLog(models.Model):
@@ -238,6 +456,15 @@ class BrowserFingerprintLog(models.Model):
 
     timestamp = models.DateTimeField(auto_now_add=True, null=False, blank=True)
 
+    # correlation keys, set when the log is written: normalized host of visited_url and the honeypage it belongs to
+    host_key = models.CharField(max_length=255, null=False, blank=True, default="")
+    honeypage = models.ForeignKey(
+        "honeypot.Honeypage", on_delete=models.SET_NULL, null=True, blank=True, db_index=False  # see Meta.indexes
+    )
+
+    def set_correlation_keys(self):
+        self.host_key, self.honeypage_id = resolve_correlation_keys(*split_url(self.visited_url))
+
     def __str__(self):
         return f"({self.id}) {self.ip_address} Parsed UA: {self.parsed_ua} / Feature UA: {self.feature_ua}"
 
@@ -249,6 +476,14 @@ class BrowserFingerprintLog(models.Model):
         ordering = [
             "-pk",
         ]
+        indexes = [
+            # logs of honeypages and experiments, ordered by -pk
+            models.Index(fields=["honeypage", "id"], name="browser_fp_log_honeypage_idx"),
+            # the logs of an AccessLog's host around its timestamp (see AccessLog.host_filter)
+            models.Index(fields=["host_key", "timestamp"], name="browser_fp_log_host_time_idx"),
+            # logs without correlation keys are matched on their visited_url
+            models.Index(fields=["visited_url"], condition=Q(host_key=""), name="browser_fp_log_legacy_url_idx"),
+        ]
 
 
 class HoneydataType(models.Model):
@@ -294,31 +529,71 @@ class Honeypage(models.Model):
             yield child
         yield self
 
+    # ids of a honeypage and all its descendants, resolved in the database
+    SUBTREE_SQL = """
+        WITH RECURSIVE subtree(id) AS (
+            SELECT id FROM {table} WHERE id = %s
+            UNION
+            SELECT child.id FROM {table} child INNER JOIN subtree ON child.parent_id = subtree.id
+        )
+        SELECT id FROM subtree
+    """
+
+    # ids of a honeypage and all its ancestors
+    ANCESTORS_SQL = """
+        WITH RECURSIVE ancestors(id, parent_id) AS (
+            SELECT id, parent_id FROM {table} WHERE id = %s
+            UNION
+            SELECT page.id, page.parent_id FROM {table} page INNER JOIN ancestors ON page.id = ancestors.parent_id
+        )
+        SELECT id FROM ancestors
+    """
+
+    @classmethod
+    def _tree_sql(cls, sql, honeypage_id):
+        return RawSQL(sql.format(table=connection.ops.quote_name(cls._meta.db_table)), (honeypage_id,))
+
     @property
-    def all_children_subdomains(self):
-        paths = [self.subdomain]
+    def subtree(self):
+        """
+        This honeypage and all its descendants, as a single query.
+        :return: QuerySet
+        """
+        return Honeypage.objects.filter(id__in=self._tree_sql(Honeypage.SUBTREE_SQL, self.pk))
 
-        for child in self.children.all():
-            paths += child.all_child_subdomains
+    @property
+    def subtree_links(self):
+        """
+        Links of this honeypage and all its descendants, as they are stored in the visited_url of fingerprint logs.
+        """
+        pages = self.subtree.values_list("protocol", "subdomain", "path")
+        return [Honeypage.build_link(*page).replace(":80", "") for page in pages]
 
-        return paths
+    @property
+    def all_children_subdomains(self):
+        return list(self.subtree.values_list("subdomain", flat=True))
 
     @property
     def root(self):
-        if not self.parent:
+        if self.parent_id is None:
             return self
-        else:
-            return self.parent.root
+
+        root = Honeypage.objects.filter(
+            id__in=self._tree_sql(Honeypage.ANCESTORS_SQL, self.pk), parent__isnull=True
+        ).first()
+        return root or self
 
     @property
     def experiment(self):
         return self.root.experiment
 
+    @staticmethod
+    def build_link(protocol, subdomain, path):
+        return "{}://{}.{}/{}".format(protocol, subdomain, SERVER_ADDRESS, path + "/" if path != "" else "")
+
     @property
     def link(self):
-        return "{}://{}.{}/{}".format(
-            self.protocol, self.subdomain, SERVER_ADDRESS, self.path + "/" if self.path != "" else ""
-        )
+        return Honeypage.build_link(self.protocol, self.subdomain, self.path)
 
     @property
     def fingerprint_logs(self):
@@ -326,7 +601,9 @@ class Honeypage(models.Model):
         Returns all FingerprintLogs that match this HoneyPage's url.
         :return:
         """
-        return FingerprintLog.objects.filter(visited_url=self.link.replace(":80", ""))
+        return FingerprintLog.objects.filter(
+            Q(honeypage=self) | (WITHOUT_CORRELATION_KEYS & Q(visited_url=self.link.replace(":80", "")))
+        )
 
     @property
     def browser_fingerprint_logs(self):
@@ -334,7 +611,9 @@ class Honeypage(models.Model):
         Returns all FingerprintLogs that match this HoneyPage's url.
         :return:
         """
-        return BrowserFingerprintLog.objects.filter(visited_url=self.link.replace(":80", ""))
+        return BrowserFingerprintLog.objects.filter(
+            Q(honeypage=self) | (WITHOUT_CORRELATION_KEYS & Q(visited_url=self.link.replace(":80", "")))
+        )
 
     @property
     def access_logs(self):
@@ -342,7 +621,9 @@ class Honeypage(models.Model):
         Returns AccessLogs that match this HoneyPage's path and subdomain.
         :return:
         """
-        return AccessLog.objects.filter(user__isnull=True, subdomain=self.subdomain)
+        return AccessLog.objects.filter(
+            Q(honeypage=self) | (WITHOUT_CORRELATION_KEYS & Q(subdomain=self.subdomain)), user__isnull=True
+        )
 
     @staticmethod
     def generate_unique_pdf_payload():
@@ -437,6 +718,10 @@ class Honeypage(models.Model):
         ordering = [
             "-pk",
         ]
+        indexes = [
+            # the registry's lookups of subdomains it doesn't know (see registry.py)
+            models.Index(Lower("subdomain"), name="honeypage_subdomain_lower_idx"),
+        ]
 
 class Honeymail(models.Model):
     email_address = models.CharField(max_length=128, unique=True)
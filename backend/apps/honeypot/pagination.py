@@ -0,0 +1,70 @@
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class LargeResultsSetPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Pagination on "-id" with opaque cursors.
+    Every page is a `WHERE id < <last id of the previous page> LIMIT n` query, no COUNT and no OFFSET,
+    so deep pages are as fast as the first one and new rows don't shift the following pages.
+    """
+    ordering = "-id"
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+    def get_ordering(self, request, queryset, view):
+        # the log views' OrderingFilter has no default, so use "-id" unless a valid ?ordering= is given
+        for backend in getattr(view, "filter_backends", []):
+            if hasattr(backend, "get_ordering"):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    return tuple(ordering)
+
+        return (self.ordering,)
+
+
+class LogPagination(BasePagination):
+    """
+    Page numbers by default, keyset pagination if the request has a "cursor" parameter
+    (empty for the first page, e.g. `/api/access_logs/?cursor=`). The "next" links keep the chosen pagination.
+    """
+
+    def __init__(self):
+        self.page_number_pagination = LargeResultsSetPagination()
+        self.keyset_pagination = KeysetPagination()
+        self.paginator = self.page_number_pagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_pagination.cursor_query_param in request.query_params:
+            self.paginator = self.keyset_pagination
+        else:
+            self.paginator = self.page_number_pagination
+
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        return self.paginator.display_page_controls
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_schema_operation_parameters(self, view):
+        parameters = self.page_number_pagination.get_schema_operation_parameters(view)
+        names = set(parameter["name"] for parameter in parameters)
+        return parameters + [
+            parameter for parameter in self.keyset_pagination.get_schema_operation_parameters(view)
+            if parameter["name"] not in names
+        ]
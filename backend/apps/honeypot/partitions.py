@@ -0,0 +1,308 @@
+"""
+Monthly range partitions of the AccessLog table on PostgreSQL (see `manage.py access_log_partitions`).
+
+    honeypot_access_logs                partitioned by range on "timestamp", primary key (id, timestamp)
+    ├── honeypot_access_logs_legacy     the rows of the table before it was partitioned, up to the conversion month
+    ├── honeypot_access_logs_y2024m03   one partition per month (UTC)
+    ├── ...
+    └── honeypot_access_logs_default    rows outside all partitions, normally empty
+
+Queries with a timestamp range (e.g. Experiment.access_logs) only scan the partitions of that range.
+"""
+import gzip
+import os
+import re
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from pytz import utc
+
+from control_server.time import now
+from .models import AccessLog, AccessLogPayload
+
+TABLE = AccessLog._meta.db_table
+PAYLOAD_TABLE = AccessLogPayload._meta.db_table
+PAYLOAD_ARCHIVE_SUFFIX = ".payloads.csv.gz"
+LEGACY_PARTITION = TABLE + "_legacy"
+DEFAULT_PARTITION = TABLE + "_default"
+MONTH_PARTITION_PATTERN = re.compile(r"^" + TABLE + r"_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+_BOUND_PATTERN = re.compile(r"FROM \((?P<start>[^)]*)\) TO \((?P<end>[^)]*)\)")
+
+
+class PartitionError(Exception):
+    pass
+
+
+class Partition(object):
+    __slots__ = ("name", "start", "end")
+
+    def __init__(self, name, start, end):
+        self.name = name
+        self.start = start  # None for MINVALUE
+        self.end = end  # None for MAXVALUE
+
+    def overlaps(self, start, end):
+        return (self.start is None or self.start < end) and (self.end is None or start < self.end)
+
+    def __repr__(self):
+        return "<Partition {}: {} - {}>".format(self.name, self.start, self.end)
+
+
+def month_start(moment, months=0):
+    """
+    The first moment (UTC) of the month of `moment`, `months` months later (or earlier if negative).
+    """
+    index = moment.astimezone(utc).year * 12 + moment.astimezone(utc).month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=utc)
+
+
+def month_partition_name(start):
+    return "{}_y{:04d}m{:02d}".format(TABLE, start.year, start.month)
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _literal(moment):
+    return "'{}'".format(moment.astimezone(utc).isoformat())
+
+
+def _parse_bound(value):
+    value = value.strip()
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def check_database():
+    if connection.vendor != "postgresql":
+        raise PartitionError("Partitioning needs PostgreSQL, the database is {}".format(connection.vendor))
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def partitions():
+    """
+    :return: the range partitions ordered by their start, the default partition is not included
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+        """, [TABLE])
+        rows = cursor.fetchall()
+
+    result = []
+    for name, bound in rows:
+        match = _BOUND_PATTERN.search(bound)
+        if match is not None:
+            result.append(Partition(name, _parse_bound(match.group("start")), _parse_bound(match.group("end"))))
+    return sorted(result, key=lambda partition: (partition.start is not None, partition.start))
+
+
+def convert():
+    """
+    Turns the AccessLog table into a partitioned table. The existing table becomes its legacy partition
+    (up to the start of next month), so no rows are copied; attaching it validates them and builds the index
+    for the new primary key (id, timestamp), the table is locked meanwhile.
+    """
+    check_database()
+    if is_partitioned():
+        raise PartitionError("{} is already partitioned".format(TABLE))
+
+    boundary = month_start(now(), 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE".format(_quote(TABLE)))
+        cursor.execute('SELECT max("timestamp") FROM {}'.format(_quote(TABLE)))
+        newest = cursor.fetchone()[0]
+        if newest is not None and newest >= boundary:
+            boundary = month_start(newest, 1)
+
+        cursor.execute("""
+            SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'f')
+        """, [TABLE])
+        constraints = cursor.fetchall()
+        cursor.execute("""
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename = %s AND schemaname = current_schema()
+        """, [TABLE])
+        primary_keys = set(name for name, kind, _ in constraints if kind == "p")
+        indexes = [(name, definition) for name, definition in cursor.fetchall() if name not in primary_keys]
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cursor.fetchone()[0]
+
+        # the old table and its indexes make way for the partitioned table
+        cursor.execute("ALTER TABLE {} RENAME TO {}".format(_quote(TABLE), _quote(LEGACY_PARTITION)))
+        for name in primary_keys:
+            cursor.execute("ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+                _quote(LEGACY_PARTITION), _quote(name), _quote((name + "_legacy")[:63])
+            ))
+        for name, _ in indexes:
+            cursor.execute("ALTER INDEX {} RENAME TO {}".format(_quote(name), _quote((name + "_legacy")[:63])))
+
+        cursor.execute(
+            'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) '
+            'PARTITION BY RANGE ("timestamp")'.format(_quote(TABLE), _quote(LEGACY_PARTITION))
+        )
+        # a partitioned table's unique constraints must contain the partition key
+        cursor.execute('ALTER TABLE {} ADD PRIMARY KEY ("id", "timestamp")'.format(_quote(TABLE)))
+        for name, kind, definition in constraints:
+            if kind == "f":
+                cursor.execute("ALTER TABLE {} ADD CONSTRAINT {} {}".format(_quote(TABLE), _quote(name), definition))
+        for _, definition in indexes:
+            # the definitions name the table as it was, i.e. the partitioned table now; attaching the legacy
+            # partition below adopts its equivalent indexes instead of building them again
+            cursor.execute(definition)
+        if sequence:
+            cursor.execute("ALTER SEQUENCE {} OWNED BY {}.id".format(sequence, _quote(TABLE)))
+
+        cursor.execute("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (MINVALUE) TO ({})".format(
+            _quote(TABLE), _quote(LEGACY_PARTITION), _literal(boundary)
+        ))
+        cursor.execute("CREATE TABLE {} PARTITION OF {} DEFAULT".format(_quote(DEFAULT_PARTITION), _quote(TABLE)))
+
+    return boundary
+
+
+def ensure(months_ahead=3, start=None):
+    """
+    Creates the monthly partitions from the month of `start` (default: now) up to `months_ahead` months later,
+    except where an existing partition covers the month. Rows of a new month that went to the default partition
+    are moved into it.
+    :return: names of the created partitions
+    """
+    check_database()
+    if not is_partitioned():
+        raise PartitionError("{} is not partitioned, see `access_log_partitions convert`".format(TABLE))
+
+    created = []
+    first = month_start(start or now())
+    for i in range(months_ahead + 1):
+        month, next_month = month_start(first, i), month_start(first, i + 1)
+        if any(partition.overlaps(month, next_month) for partition in partitions()):
+            continue
+        _create_month_partition(month, next_month)
+        created.append(month_partition_name(month))
+    return created
+
+
+def _create_month_partition(month, next_month):
+    name = month_partition_name(month)
+    bounds = "FROM ({}) TO ({})".format(_literal(month), _literal(next_month))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM {} WHERE "timestamp" >= %s AND "timestamp" < %s)'.format(
+                _quote(DEFAULT_PARTITION)
+            ),
+            [month, next_month]
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute("CREATE TABLE {} PARTITION OF {} FOR VALUES {}".format(_quote(name), _quote(TABLE), bounds))
+            return
+
+        # the new partition must not overlap rows in the default partition, move them over
+        cursor.execute("ALTER TABLE {} DETACH PARTITION {}".format(_quote(TABLE), _quote(DEFAULT_PARTITION)))
+        cursor.execute("CREATE TABLE {} PARTITION OF {} FOR VALUES {}".format(_quote(name), _quote(TABLE), bounds))
+        cursor.execute(
+            'WITH moved AS (DELETE FROM {} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+            'INSERT INTO {} SELECT * FROM moved'.format(_quote(DEFAULT_PARTITION), _quote(name)),
+            [month, next_month]
+        )
+        cursor.execute("ALTER TABLE {} ATTACH PARTITION {} DEFAULT".format(_quote(TABLE), _quote(DEFAULT_PARTITION)))
+
+
+def expired(retention_months):
+    """
+    :return: the partitions that only hold rows older than `retention_months` full months
+    """
+    cutoff = month_start(now(), -retention_months)
+    return [partition for partition in partitions() if partition.end is not None and partition.end <= cutoff]
+
+
+def archive_path(directory, partition_name):
+    return os.path.join(directory, partition_name + ".csv.gz")
+
+
+def payload_archive_path(directory, partition_name):
+    return os.path.join(directory, partition_name + PAYLOAD_ARCHIVE_SUFFIX)
+
+
+def _export(cursor, query, path):
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with gzip.open(tmp_path, "wb") as archive_file:
+        cursor.copy_expert("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)".format(query), archive_file)
+    os.replace(tmp_path, path)
+    return cursor.rowcount
+
+
+def archive(partition, directory):
+    """
+    Exports a partition and the payloads of its logs to gzipped CSV files in `directory`, then deletes
+    the payloads and detaches and drops the partition, in one transaction: nothing is dropped before the files
+    are complete.
+    :return: (path of the archive, number of rows)
+    """
+    check_database()
+    os.makedirs(directory, exist_ok=True)
+    path = archive_path(directory, partition.name)
+    partition_table = _quote(partition.name)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE".format(partition_table))
+        rows = _export(cursor, partition_table, path)
+
+        # the payloads aren't partitioned, they are matched by the ids of the partition's logs
+        payloads_of_partition = "{payloads} WHERE access_log_id IN (SELECT id FROM {partition})".format(
+            payloads=_quote(PAYLOAD_TABLE), partition=partition_table
+        )
+        _export(
+            cursor, "(SELECT * FROM {})".format(payloads_of_partition),
+            payload_archive_path(directory, partition.name)
+        )
+        cursor.execute("DELETE FROM {}".format(payloads_of_partition))
+
+        cursor.execute("ALTER TABLE {} DETACH PARTITION {}".format(_quote(TABLE), partition_table))
+        cursor.execute("DROP TABLE {}".format(partition_table))
+
+    return path, rows
+
+
+def restore(path):
+    """
+    Imports an archive written by archive(), logs or payloads. The rows of a monthly archive get their partition
+    back, other rows go to whichever partition covers them (the default partition if none does).
+    A restored month is archived again by the next retention run if it is still expired.
+    :return: number of imported rows
+    """
+    check_database()
+    name = os.path.basename(path).split(".")[0]
+    table = PAYLOAD_TABLE if path.endswith(PAYLOAD_ARCHIVE_SUFFIX) else TABLE
+    match = MONTH_PARTITION_PATTERN.match(name)
+    if match is not None and table == TABLE:
+        month = datetime(int(match.group("year")), int(match.group("month")), 1, tzinfo=utc)
+        if not any(partition.overlaps(month, month_start(month, 1)) for partition in partitions()):
+            _create_month_partition(month, month_start(month, 1))
+
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as archive_file:
+        columns = archive_file.readline().strip()
+        if not re.match(r'^[\w",]+$', columns):
+            raise PartitionError("{} has no CSV header".format(path))
+        column_list = ", ".join(_quote(column.strip('"')) for column in columns.split(","))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(_quote(table), column_list), archive_file
+            )
+            return cursor.rowcount
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from honeypot.pdf import make_pdf_phone_home
+
+# part of the cache key, increment whenever generate_pdf() output changes so cached files are regenerated
+PDF_VERSION = 3
+
+# served for generate.pdf requests without a honeypage (or without a payload)
+EMPTY_PDF = make_pdf_phone_home.generate_pdf(content="Seems quite empty here...")
+
+
+def render_pdf(payload) -> bytes:
+    # the document pings the payload url when opened and shows it as text
+    return make_pdf_phone_home.generate_pdf(payload, payload)
+
+
+class PDFCache(object):
+    """
+    Phone-home PDFs by payload. A honeypage's payload never changes, so each document is generated once
+    and then served from an in-process LRU of `max_entries` documents, backed by one file per payload
+    in `directory` (shared by all workers and kept across restarts).
+    """
+
+    def __init__(self, directory=None, max_entries=1024):
+        self.directory = directory
+        self.max_entries = max_entries
+
+        self._pdfs = OrderedDict()  # key -> bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(payload) -> str:
+        return hashlib.sha256("{}:{}".format(PDF_VERSION, payload).encode("utf-8")).hexdigest()
+
+    def get(self, payload) -> bytes:
+        key = PDFCache.key(payload)
+        with self._lock:
+            pdf = self._pdfs.get(key)
+            if pdf is not None:
+                self._pdfs.move_to_end(key)
+                return pdf
+
+        pdf = self._read(key)
+        if pdf is None:
+            pdf = render_pdf(payload)
+            self._write(key, pdf)
+
+        with self._lock:
+            self._pdfs[key] = pdf
+            while len(self._pdfs) > self.max_entries:
+                self._pdfs.popitem(last=False)
+        return pdf
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pdf")
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, key, pdf):
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(pdf)
+            # other workers never read a partially written file
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("PDF cache: could not write {} ({})".format(path, e))
+
+
+pdf_cache = PDFCache(settings.PDF_CACHE_DIR, settings.PDF_CACHE_SIZE)
@@ -15,9 +15,7 @@ import platform
 import random
 import re
 import struct
-import sys
 import zlib
-from io import StringIO
 
 
 def ReadBinaryFile(name):
@@ -37,6 +35,15 @@ def ReadBinaryFile(name):
     return content
 
 
+def ToBytes(data):
+    """Encode a string as latin-1 (one byte per character), bytes are returned unchanged
+    """
+
+    if isinstance(data, str):
+        return data.encode('latin-1', 'replace')
+    return bytes(data)
+
+
 def ParseFilters(definition):
     filters = []
     number = ''
@@ -73,15 +80,19 @@ def IsLastFilterI(filters):
 class cPDF:
     """
     Class to create a PDF file
+
+    The document is built in a bytearray, so file positions are simply its length, and written
+    to the file in one go by flush(). Strings are encoded as latin-1 (PDF bytes map 1:1 to it).
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename=None):
         """
         class instantiation arguments:
 
-        filename is the name of the PDF file to be created
+        filename is the name of the PDF file to be created, written by flush()
         """
         self.filename = filename
+        self.buffer = bytearray()
         self.indirectObjects = {}
         self.objstms = []
 
@@ -89,30 +100,39 @@ class cPDF:
         """
         Internal helper function
         """
-        fPDF = open(self.filename, 'a')
-        fPDF.write(str)
-        fPDF.close()
+        self.buffer += ToBytes(str)
 
     def appendBinary(self, str):
         """
         Internal helper function
         """
-        fPDF = open(self.filename, 'ab')
-        if sys.version_info[0] == 2:
-            fPDF.write(str)
-        else:
-            fPDF.write(bytes(str, 'ascii'))
-        fPDF.close()
+        self.buffer += ToBytes(str)
 
     def filesize(self):
         """
         Internal helper function
         """
-        fPDF = open(self.filename, 'rb')
-        fPDF.seek(0, 2)
-        size = fPDF.tell()
-        fPDF.close()
-        return size
+        return len(self.buffer)
+
+    def getvalue(self):
+        """
+        Returns the PDF document built so far as bytes.
+        """
+        return bytes(self.buffer)
+
+    def flush(self):
+        """
+        Method to write the PDF document to the file (replacing its content).
+        """
+        with open(self.filename, 'wb') as fPDF:
+            fPDF.write(self.buffer)
+
+    def finish(self):
+        """
+        Method to write the PDF file, returns the document as bytes.
+        """
+        self.flush()
+        return self.getvalue()
 
     def IsWindows(self):
         """
@@ -128,9 +148,8 @@ class cPDF:
         By default, the version is 1.1, but can be specified with
         the version argument.
         """
-        fPDF = open(self.filename, 'w')
-        fPDF.write('%%PDF-%s\n' % version)
-        fPDF.close()
+        del self.buffer[:]
+        self.appendString('%%PDF-%s\n' % version)
 
     def binary(self):
         """
@@ -194,13 +213,11 @@ class cPDF:
         """
         Internal helper function
         """
+        if whitespace == 0:
+            return ToBytes(data).hex()
         hex = ''
-        if sys.version_info[0] == 2:
-            for b in data:
-                hex += "%02x%s" % (ord(b), ' ' * random.randint(0, whitespace))
-        else:
-            for b in data:
-                hex += "%02x%s" % (b, ' ' * random.randint(0, whitespace))
+        for b in ToBytes(data):
+            hex += "%02x%s" % (b, ' ' * random.randint(0, whitespace))
         return hex
 
     def stream2(self, index, version, streamdata, entries="", filters="", fuzzer=None):
@@ -262,24 +279,24 @@ class cPDF:
             oFuzzer = cFuzzer()
         else:
             oFuzzer = fuzzer
-        encodeddata = streamdata
+        encodeddata = ToBytes(streamdata)
         filter = []
         filters = ParseFilters(filters)
         for i in filters:
             if i[0].lower() == 'h':
-                encodeddata = self.Data2HexStr(encodeddata) + '>'
+                encodeddata = ToBytes(self.Data2HexStr(encodeddata) + '>')
                 if i[0] == 'h':
                     filter.insert(0, "/ASCIIHexDecode")
                 else:
                     filter.insert(0, "/AHx")
             elif i[0].lower() == "i":
-                encodeddata = ''.join(self.SplitByLength(self.Data2HexStr(encodeddata), i[1]))
+                encodeddata = ToBytes(''.join(self.SplitByLength(self.Data2HexStr(encodeddata), i[1])))
                 if i[0] == "i":
                     filter.insert(0, "/ASCIIHexDecode")
                 else:
                     filter.insert(0, "/AHx")
             elif i[0].lower() == "j":
-                encodeddata = self.Data2HexStr(encodeddata, 2) + '>'
+                encodeddata = ToBytes(self.Data2HexStr(encodeddata, 2) + '>')
                 if i[0] == "j":
                     filter.insert(0, "/ASCIIHexDecode")
                 else:
@@ -291,15 +308,13 @@ class cPDF:
                 else:
                     filter.insert(0, "/Fl")
             elif i[0] == "*":
-                encodeddata = oFuzzer.Fuzz(encodeddata)
+                encodeddata = ToBytes(oFuzzer.Fuzz(encodeddata.decode('latin-1')))
             else:
                 print("Error")
                 return
         self.appendString("\n")
         self.indirectObjects[index] = self.filesize()
         length = len(encodeddata)
-        if IsLastFilterI(filters) and self.IsWindows():
-            length += encodeddata.count('\n')
         self.appendString("%d %d obj\n<<\n /Length %d\n" % (index, version, length))
         if len(filter) == 1:
             self.appendString(" /Filter %s\n" % filter[0])
@@ -308,10 +323,7 @@ class cPDF:
         if entries != "":
             self.appendString(" %s\n" % entries)
         self.appendString(">>\nstream\n")
-        if IsLastFilterI(filters):
-            self.appendString(encodeddata)
-        else:
-            self.appendBinary(encodeddata)
+        self.appendBinary(encodeddata)
         self.appendString("\nendstream\nendobj\n")
 
     def xref(self):
@@ -328,15 +340,14 @@ class cPDF:
             if i > maximumIndexValue:
                 maximumIndexValue = i
         self.appendString("xref\n0 %d\n" % (maximumIndexValue + 1))
-        if self.IsWindows():
-            eol = '\n'
-        else:
-            eol = ' \n'
+        # entries are exactly 20 bytes, the buffer never translates line endings (so no Windows special case)
+        entries = []
         for i in range(0, maximumIndexValue + 1):
             if i in self.indirectObjects:
-                self.appendString("%010d %05d n%s" % (self.indirectObjects[i], 0, eol))
+                entries.append("%010d %05d n \n" % (self.indirectObjects[i], 0))
             else:
-                self.appendString("0000000000 65535 f%s" % eol)
+                entries.append("0000000000 65535 f \n")
+        self.appendString(''.join(entries))
         return (startxref, (maximumIndexValue + 1))
 
     def trailer(self, startxref, size, root, info=None):
@@ -431,12 +442,8 @@ class cPDF:
         Use this method to start an incremental update.
         """
         original = ReadBinaryFile(pdffilename)
-        fPDF = open(self.filename, 'wb')
-        if sys.version_info[0] == 2:
-            fPDF.write(original)
-        else:
-            fPDF.write(bytes(original, 'ascii'))
-        fPDF.close()
+        self.buffer[:] = original
+        original = original.decode('latin-1')
         startxrefs = re.findall(r'startxref\s+(\d+)', original)
         if startxrefs == []:
             return None, None, None
@@ -470,18 +477,13 @@ class cPDF:
 
         Use this method to terminate an incremental update.
         """
-        if self.IsWindows():
-            eol = '\n'
-        else:
-            eol = ' \n'
-
         self.appendString("\n")
         startxref = self.filesize()
         self.appendString("xref\n0 1\n")
-        self.appendString("0000000000 65535 f%s" % eol)
+        self.appendString("0000000000 65535 f \n")
         for i in list(self.indirectObjects.keys()):
             self.appendString("%d 1\n" % i)
-            self.appendString("%010d %05d n%s" % (self.indirectObjects[i], 0, eol))
+            self.appendString("%010d %05d n \n" % (self.indirectObjects[i], 0))
         self.appendString("trailer\n%s\nstartxref\n%d\n%%%%EOF\n" % (dictionaryTrailer, startxref))
         return startxref
 
@@ -506,7 +508,7 @@ class cPDF:
                      oObjectStream.getDictionaryEntries(), oObjectStream.filters)
         self.objstms.append(oObjectStream)
 
-    def xrefobjAndTrailer(self, index, version, root):
+    def xrefobjAndTrailer(self, index, version, root, compress=False):
         """
         Method to create an xref object together with a trailer and
         output it to the PDF file.
@@ -517,30 +519,35 @@ class cPDF:
 
         root is a string with a reference to the root object (/Root).
         Example: "1 0 R"
+
+        compress applies the FlateDecode filter to the xref stream.
         """
-        maximumIndexValue = max(index, max(self.indirectObjects.keys()))
         dObjects = {}
         for objstm in self.objstms:
-            for indexIter in objstm.objects:
-                dObjects[indexIter] = objstm
-        maximumIndexValue = max(maximumIndexValue, max(dObjects.keys()))
+            for position, indexIter in enumerate(objstm.objects):
+                dObjects[indexIter] = (objstm.index, position)
+        maximumIndexValue = max([index] + list(self.indirectObjects.keys()) + list(dObjects.keys()))
 
         self.appendString('\n')
         self.indirectObjects[index] = self.filesize()
 
-        xrefFormat = '>BII'
-        xrefStream = ''
+        xrefFormat = '>BIH'
+        xrefStream = bytearray()
         for iter in range(maximumIndexValue + 1):
-            if iter in list(self.indirectObjects.keys()):
+            if iter in self.indirectObjects:
                 xrefStream += struct.pack(xrefFormat, 1, self.indirectObjects[iter], 0)
-            elif iter in list(dObjects.keys()):
-                xrefStream += struct.pack(xrefFormat, 2, dObjects[iter].index, dObjects[iter].objects.index(iter))
+            elif iter in dObjects:
+                xrefStream += struct.pack(xrefFormat, 2, dObjects[iter][0], dObjects[iter][1])
             else:
-                xrefStream += struct.pack(xrefFormat, 0, 0, 0)
-
-        formatSizes = ' '.join([str(size) for size in map(struct.calcsize, [c for c in xrefFormat]) if size != 0])
-        self.appendString(('%d %d obj\n<< /Type /XRef /Length %d /W [%s] /Root %s /Size %d >>\nstream\n') % (
-        index, version, len(xrefStream), formatSizes, root, maximumIndexValue + 1))
+                xrefStream += struct.pack(xrefFormat, 0, 0, 65535 if iter == 0 else 0)
+        entries = ''
+        if compress:
+            xrefStream = zlib.compress(xrefStream)
+            entries = ' /Filter /FlateDecode'
+
+        formatSizes = ' '.join([str(struct.calcsize('>' + c)) for c in xrefFormat[1:]])
+        self.appendString(('%d %d obj\n<< /Type /XRef /Length %d%s /W [%s] /Root %s /Size %d >>\nstream\n') % (
+        index, version, len(xrefStream), entries, formatSizes, root, maximumIndexValue + 1))
         self.appendBinary(xrefStream)
         self.appendString('\nendstream\nendobj\n')
 
@@ -746,173 +753,19 @@ class cObjectStream:
 
 class PDFStringIO(cPDF):
     """
-    Class to create a PDF file as a StringIO object
+    Class to create a PDF file in memory
     """
 
     def __init__(self):
-        self.string_io = StringIO()
-        self.indirectObjects = {}
-        self.objstms = []
-
-    def finish(self):
-        content = self.string_io.getvalue()
-        self.string_io.close()
-        return content
+        super().__init__()
 
-    def appendString(self, str):
+    def flush(self):
         """
-        Internal helper function
+        There is no file, the document is returned by finish().
         """
-        self.string_io.write(str)
 
-    def appendBinary(self, str):
-        """
-        Internal helper function
-        """
-        self.string_io.write(str)
-
-    def filesize(self):
-        """
-        Internal helper function
-        """
-        self.string_io.seek(0, 2)
-        size = self.string_io.tell()
-        return size
-
-    def header(self, version='1.1'):
-        """
-        Method to create a PDF header (%PDF-1.1) and output it
-        to the PDF file.
-
-        By default, the version is 1.1, but can be specified with
-        the version argument.
-        """
-        self.string_io.write('%%PDF-%s\n' % version)
-
-    def originalIncrementalUpdate(self, pdffilename):
-        """
-        Method to start an incremental update of an existing PDF file.
-
-        pdffilename is the name of the PDF file to be used for the
-        incremental update.
-
-        This methods returns the dictionary of the root object,
-        the dictionary of the trailer and the file position of the
-        xrf table found in the existing PDF file. These 3 values are
-        returned in a list.
-
-        Use this method to start an incremental update.
-        """
-        original = ReadBinaryFile(pdffilename)
-        if sys.version_info[0] == 2:
-            self.string_io.write(original)
-        else:
-            self.string_io.write(bytes(original, 'ascii'))
-        startxrefs = re.findall(r'startxref\s+(\d+)', original)
-        if startxrefs == []:
-            return None, None, None
-        oMatch = re.search(r'trailer\s+', original[int(startxrefs[-1]):])
-        if oMatch == None:
-            return None, None, None
-        positionDictionaryTrailer = oMatch.end() + int(startxrefs[-1])
-        dictionaryTrailer = self.MatchDictionary(original[positionDictionaryTrailer:])
-        if dictionaryTrailer == None:
-            return None, None, None
-        oDictionaryTrailer = cDictionary(dictionaryTrailer)
-        idRoot = oDictionaryTrailer.GetID('Root')
-        if idRoot == None:
-            return None, None, None
-        oMatch = re.search(r'\s+%d\s+0\s+obj\s+' % idRoot, original)
-        if oMatch == None:
-            return None, None, None
-        dictionaryRoot = self.MatchDictionary(original[oMatch.end():])
-        if dictionaryRoot == None:
-            return None, None, None
-        oDictionaryRoot = cDictionary(dictionaryRoot)
-        return oDictionaryTrailer, oDictionaryRoot, int(startxrefs[-1])
-
-    def xrefIncrementalAndTrailer(self, dictionaryTrailer):
-        """
-        Method to create an xref table together with a trailer for
-        an incremental update and output it to the PDF file.
-
-        dictionaryTrailer is a (modified) dictionary returned by method
-        originalIncrementalUpdate.
-
-        Use this method to terminate an incremental update.
-        """
-        if self.IsWindows():
-            eol = '\n'
-        else:
-            eol = ' \n'
-
-        self.appendString("\n")
-        startxref = self.filesize()
-        self.appendString("xref\n0 1\n")
-        self.appendString("0000000000 65535 f%s" % eol)
-        for i in list(self.indirectObjects.keys()):
-            self.appendString("%d 1\n" % i)
-            self.appendString("%010d %05d n%s" % (self.indirectObjects[i], 0, eol))
-        self.appendString("trailer\n%s\nstartxref\n%d\n%%%%EOF\n" % (dictionaryTrailer, startxref))
-        return startxref
-
-    def SplitByLength(self, input, length):
-        """
-        Internal helper function
-        """
-        result = []
-        while len(input) > length:
-            result.append(input[0:length] + '\n')
-            input = input[length:]
-        result.append(input + '>')
-        return result
-
-    def objstm(self, oObjectStream):
-        """
-        Method to add an object stream to the PDF file.
-
-        oObjectStream is an instantiated object of class cObjectStream.
-        """
-        self.stream2(oObjectStream.index, oObjectStream.version, oObjectStream.getStream(),
-                     oObjectStream.getDictionaryEntries(), oObjectStream.filters)
-        self.objstms.append(oObjectStream)
-
-    def xrefobjAndTrailer(self, index, version, root):
+    def finish(self):
         """
-        Method to create an xref object together with a trailer and
-        output it to the PDF file.
-
-        index is the index number of the xref object.
-
-        version is the version number of the xref object. Use 0 by convention.
-
-        root is a string with a reference to the root object (/Root).
-        Example: "1 0 R"
+        Returns the PDF document as bytes.
         """
-        maximumIndexValue = max(index, max(self.indirectObjects.keys()))
-        dObjects = {}
-        for objstm in self.objstms:
-            for indexIter in objstm.objects:
-                dObjects[indexIter] = objstm
-        maximumIndexValue = max(maximumIndexValue, max(dObjects.keys()))
-
-        self.appendString('\n')
-        self.indirectObjects[index] = self.filesize()
-
-        xrefFormat = '>BII'
-        xrefStream = ''
-        for iter in range(maximumIndexValue + 1):
-            if iter in list(self.indirectObjects.keys()):
-                xrefStream += struct.pack(xrefFormat, 1, self.indirectObjects[iter], 0)
-            elif iter in list(dObjects.keys()):
-                xrefStream += struct.pack(xrefFormat, 2, dObjects[iter].index, dObjects[iter].objects.index(iter))
-            else:
-                xrefStream += struct.pack(xrefFormat, 0, 0, 0)
-
-        formatSizes = ' '.join([str(size) for size in map(struct.calcsize, [c for c in xrefFormat]) if size != 0])
-        self.appendString(('%d %d obj\n<< /Type /XRef /Length %d /W [%s] /Root %s /Size %d >>\nstream\n') % (
-        index, version, len(xrefStream), formatSizes, root, maximumIndexValue + 1))
-        self.appendBinary(xrefStream)
-        self.appendString('\nendstream\nendobj\n')
-
-        self.appendString('\nstartxref\n%d\n%%%%EOF\n' % self.indirectObjects[index])
+        return self.getvalue()
@@ -8,42 +8,78 @@
 
 
 import optparse
+import sys
+from urllib.parse import quote
 
 from honeypot.pdf import make_pdf
 
+# characters kept as they are in the /URI of the document, all others (e.g. non-ASCII) are percent-encoded as UTF-8
+URI_SAFE_CHARACTERS = "!#$%&'()*+,/:;=?@[]~"
 
-def generate_pdf(url=None, content=""):
+
+def pdf_uri(url):
+    """
+    The url as a /URI string: PDF URIs are 7-bit ASCII, and parentheses are escaped in literal strings.
     """
-    Generates a PDF and returns it as a string.
+    uri = quote(url, safe=URI_SAFE_CHARACTERS)
+    return uri.replace("(", "\\(").replace(")", "\\)")
+
+
+def generate_pdf(url=None, content="", object_streams=False):
+    """
+    Generates a PDF and returns it as bytes.
     :param content: will be added as text to the PDF
     :param url: the PDF will ping this URL when opened
+    :param object_streams: write a PDF 1.5 document, its dictionaries in a compressed object stream
+        and a compressed xref stream instead of the xref table (smaller, but not for pre-2003 readers)
     :return:
     """
 
     pdf_string_io = make_pdf.PDFStringIO()
     # import mPDF
-    # oPDF = mPDF.cPDF(output_file_name)  # for a real file
-    pdf_string_io.header()
+    # oPDF = mPDF.cPDF(output_file_name)  # for a real file, written by oPDF.flush()
+    pdf_string_io.header("1.5" if object_streams else "1.1")
 
     open_action = ""
     if url:
         # there are two ways here: send GET request or POST a form
-        open_action = "/OpenAction << /S /URI /URI ({url}) >>".format(url=url)
+        open_action = "/OpenAction << /S /URI /URI ({url}) >>".format(url=pdf_uri(url))
         # open_action = "<</S /SubmitForm /F << /FS /URL /F ({url}) >> >>".format(url=url.rstrip("/") + "-form/")
 
-    pdf_string_io.indirectobject(1, 0, '<<\n /Type /Catalog\n /Outlines 2 0 R\n /Pages 3 0 R\n {open_action}\n>>'.format(
+    # streams can't be put into an object stream, so the page content (5) is always an indirect object
+    objects = pdf_string_io
+    if object_streams:
+        objects = ObjectStreamWriter(make_pdf.cObjectStream(7, 0, "f"))
+
+    objects.indirectobject(1, 0, '<<\n /Type /Catalog\n /Outlines 2 0 R\n /Pages 3 0 R\n {open_action}\n>>'.format(
         open_action=open_action))
-    pdf_string_io.indirectobject(2, 0, '<<\n /Type /Outlines\n /Count 0\n>>')
-    pdf_string_io.indirectobject(3, 0, '<<\n /Type /Pages\n /Kids [4 0 R]\n /Count 1\n>>')
-    pdf_string_io.indirectobject(4, 0, '<<\n /Type /Page\n /Parent 3 0 R\n /MediaBox [0 0 612 792]\n /Contents 5 0 R\n /Resources <<\n             /ProcSet [/PDF /Text]\n             /Font << /F1 6 0 R >>\n            >>\n>>')
+    objects.indirectobject(2, 0, '<<\n /Type /Outlines\n /Count 0\n>>')
+    objects.indirectobject(3, 0, '<<\n /Type /Pages\n /Kids [4 0 R]\n /Count 1\n>>')
+    objects.indirectobject(4, 0, '<<\n /Type /Page\n /Parent 3 0 R\n /MediaBox [0 0 612 792]\n /Contents 5 0 R\n /Resources <<\n             /ProcSet [/PDF /Text]\n             /Font << /F1 6 0 R >>\n            >>\n>>')
     pdf_string_io.stream(5, 0, 'BT /F1 12 Tf 100 700 Td 15 TL ({content}) Tj ET'.format(content=content))
-    pdf_string_io.indirectobject(6, 0, '<<\n /Type /Font\n /Subtype /Type1\n /Name /F1\n /BaseFont /Helvetica\n /Encoding /MacRomanEncoding\n>>')
+    objects.indirectobject(6, 0, '<<\n /Type /Font\n /Subtype /Type1\n /Name /F1\n /BaseFont /Helvetica\n /Encoding /MacRomanEncoding\n>>')
 
-    pdf_string_io.xrefAndTrailer('1 0 R')
+    if object_streams:
+        pdf_string_io.objstm(objects.object_stream)
+        pdf_string_io.xrefobjAndTrailer(8, 0, '1 0 R', compress=True)
+    else:
+        pdf_string_io.xrefAndTrailer('1 0 R')
 
     return pdf_string_io.finish()
 
 
+class ObjectStreamWriter(object):
+    """
+    Puts indirect objects into an object stream, with cPDF.indirectobject()'s signature.
+    """
+
+    def __init__(self, object_stream):
+        self.object_stream = object_stream
+
+    def indirectobject(self, index, version, io):
+        self.object_stream.indirectobject(index, io)
+
+
 def Main():
     """
     make-pdf-phone-home, use it to create a PDF document that automatically sends requests to a url when the document
@@ -61,8 +97,8 @@ def Main():
         print('  Based on make-pdf by https://DidierStevens.com')
 
     else:
-        url = args[1]
-        print(generate_pdf(url))
+        url = args[0]
+        sys.stdout.buffer.write(generate_pdf(url))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,264 @@
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db.models.functions import Lower
+
+from control_server.broadcast import broadcast
+from control_server.core import SERVER_ADDRESS, SERVER_ADDRESS_REGEX
+
+BROADCAST_CHANNEL = "honeypages"
+
+# the Honeypage columns of a HoneypageEntry, and the parent's id
+HONEYPAGE_COLUMNS = (
+    "id", "subdomain", "path", "protocol", "pdf_payload", "suspicious", "with_meta_tags", "parent_id"
+)
+
+
+def normalize_subdomain(subdomain):
+    return (subdomain or "").lower()
+
+
+def normalize_path(path):
+    return (path or "").strip("/").lower()
+
+
+def normalize_host(host):
+    """
+    The host key of logs: lowercased, without port and trailing dot,
+    e.g. "Foo-Bar.localtest.me:8000" -> "foo-bar.localtest.me".
+    """
+    host = (host or "").strip().lower()
+    if host.startswith("["):
+        # IPv6 literal
+        return host.split("]")[0] + "]"
+    return host.split(":")[0].rstrip(".")
+
+
+def split_url(url):
+    """
+    :return: (host key, path) of a visited url, ("", "") if it has no host
+    """
+    try:
+        parts = urlsplit((url or "").strip())
+    except ValueError:
+        return "", ""
+    host = normalize_host(parts.netloc.rsplit("@", 1)[-1])
+    return (host, parts.path) if host else ("", "")
+
+
+SERVER_HOST_PATTERN = re.compile(r"^(?P<subdomain>[\w-]+)\.{}$".format(SERVER_ADDRESS_REGEX), re.IGNORECASE)
+
+
+class HoneypageEntry(object):
+    """
+    The parts of a Honeypage needed to serve it, with direct links to its parent and children.
+    """
+    __slots__ = ("id", "subdomain", "path", "protocol", "pdf_payload", "suspicious", "with_meta_tags", "parent",
+                 "children")
+
+    def __init__(self, id, subdomain, path, protocol, pdf_payload, suspicious, with_meta_tags):
+        self.id = id
+        self.subdomain = subdomain
+        self.path = path
+        self.protocol = protocol
+        self.pdf_payload = pdf_payload
+        self.suspicious = suspicious
+        self.with_meta_tags = with_meta_tags
+        self.parent = None
+        self.children = []
+
+    @property
+    def link(self):
+        # same as Honeypage.link
+        return "{}://{}.{}/{}".format(
+            self.protocol, self.subdomain, SERVER_ADDRESS, self.path + "/" if self.path != "" else ""
+        )
+
+    def __repr__(self):
+        return "<HoneypageEntry {}: {}>".format(self.id, self.link)
+
+
+class HoneypageRegistry(object):
+    """
+    Process-local index of all Honeypages, so serving a honeypage doesn't read the database.
+
+    All honeypages are loaded with a single query on first use and looked up by
+    (lowercased subdomain, normalized path). Saving or deleting a Honeypage (see honeypot/signals.py)
+    invalidates the registry in this process and, over Redis pub/sub, in all other processes;
+    it is reloaded lazily on the next lookup. If Redis is unavailable, the registry expires after `ttl` seconds.
+    Until then a honeypage created by another process is unknown here, so a miss looks up the honeypages of
+    the subdomain in the database and adds them. Misses are remembered for `miss_ttl` seconds, as requests to
+    unknown subdomains (e.g. of scanners) are common.
+    Changes that bypass model signals (`QuerySet.update()`, `bulk_create()`, raw SQL)
+    need an explicit `honeypage_registry.invalidate()`.
+    """
+
+    # remembered misses, all are forgotten when there are more
+    MAX_MISSES = 10000
+
+    def __init__(self, ttl=60, miss_ttl=2):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+
+        self._by_key = {}  # (subdomain, path) -> entry
+        self._by_subdomain = {}  # subdomain -> entry with the lowest id, for requests without a path
+        self._by_id = {}
+        self._misses = {}  # (subdomain, path) -> time until which the lookup isn't repeated in the database
+
+        self._generation = 0  # incremented by every invalidation
+        self._loaded_generation = None
+        self._loaded_at = 0
+        self._subscribed = False
+        self._lock = threading.Lock()
+
+    def get(self, subdomain, path=None):
+        """
+        Returns the honeypage served at subdomain/path, or the first honeypage of the subdomain if there is no path.
+        :return: HoneypageEntry or None
+        """
+        if not subdomain:
+            return None
+
+        self._ensure_loaded()
+        entry = self._lookup(subdomain, path)
+        if entry is None and self._load_after_miss(subdomain, path):
+            entry = self._lookup(subdomain, path)
+        return entry
+
+    def resolve(self, host_key, path=None):
+        """
+        Returns the honeypage a log of the host (see normalize_host) belongs to.
+        :return: HoneypageEntry or None
+        """
+        match = SERVER_HOST_PATTERN.match(host_key)
+        if match is None:
+            return None
+        return self.get(match.group("subdomain"), path)
+
+    def _lookup(self, subdomain, path):
+        subdomain = normalize_subdomain(subdomain)
+        if not path:
+            return self._by_subdomain.get(subdomain)
+        return self._by_key.get((subdomain, normalize_path(path)))
+
+    def _load_after_miss(self, subdomain, path):
+        """
+        Adds the honeypages of the subdomain from the database, unless the lookup missed within `miss_ttl` seconds.
+        :return: True if honeypages were added
+        """
+        from .models import Honeypage
+
+        key = (normalize_subdomain(subdomain), normalize_path(path))
+        if self._misses.get(key, 0) > time.monotonic():
+            return False
+
+        rows = list(Honeypage.objects.annotate(subdomain_lower=Lower("subdomain")).filter(
+            subdomain_lower=key[0]
+        ).order_by("id").values_list(*HONEYPAGE_COLUMNS))
+
+        with self._lock:
+            if len(self._misses) >= self.MAX_MISSES:
+                self._misses = {}
+            self._misses[key] = time.monotonic() + self.miss_ttl
+
+            added = [self._add(row) for row in rows if row[0] not in self._by_id]
+            for entry, parent_id in added:
+                self._link(entry, parent_id)
+        return bool(added)
+
+    def get_by_id(self, honeypage_id):
+        self._ensure_loaded()
+        return self._by_id.get(honeypage_id)
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._by_id)
+
+    def invalidate(self, broadcast_change=True):
+        """
+        Marks the registry as stale; the next lookup reloads it.
+        :param broadcast_change: also invalidate the registries of all other processes
+        """
+        self._generation += 1
+        if broadcast_change:
+            broadcast.publish(BROADCAST_CHANNEL, {"generation": self._generation})
+
+    def _on_broadcast(self, message):
+        # another process changed honeypages, or the listener reconnected and may have missed changes
+        self._generation += 1
+
+    def _is_fresh(self):
+        if self._loaded_generation != self._generation:
+            return False
+        if broadcast.is_listening():
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    def _ensure_loaded(self):
+        if not self._subscribed:
+            self._subscribed = True
+            broadcast.subscribe(BROADCAST_CHANNEL, self._on_broadcast)
+
+        if self._is_fresh():
+            return
+
+        with self._lock:
+            if not self._is_fresh():
+                self._load()
+
+    def _load(self):
+        from .models import Honeypage
+
+        generation = self._generation
+        started_at = time.monotonic()
+
+        by_key = {}
+        by_subdomain = {}
+        by_id = {}
+        parent_ids = {}
+        rows = Honeypage.objects.order_by("id").values_list(*HONEYPAGE_COLUMNS)
+        for (honeypage_id, subdomain, path, protocol, pdf_payload, suspicious, with_meta_tags, parent_id) \
+                in rows.iterator(chunk_size=10000):
+            entry = HoneypageEntry(honeypage_id, subdomain, path, protocol, pdf_payload, suspicious, with_meta_tags)
+            by_id[honeypage_id] = entry
+            by_key.setdefault((normalize_subdomain(subdomain), normalize_path(path)), entry)
+            by_subdomain.setdefault(normalize_subdomain(subdomain), entry)
+            if parent_id is not None:
+                parent_ids[honeypage_id] = parent_id
+
+        for honeypage_id, parent_id in parent_ids.items():
+            entry = by_id[honeypage_id]
+            entry.parent = by_id.get(parent_id)
+            if entry.parent is not None:
+                entry.parent.children.append(entry)
+
+        # swap the indexes at once, concurrent lookups see either the old or the new registry
+        self._by_key, self._by_subdomain, self._by_id = by_key, by_subdomain, by_id
+        self._misses = {}
+        self._loaded_generation = generation
+        self._loaded_at = started_at
+
+    def _add(self, row):
+        """
+        Adds a honeypage loaded after the registry, a subdomain's first page stays the one with the lowest id.
+        :return: (entry, parent id)
+        """
+        honeypage_id, subdomain, path, protocol, pdf_payload, suspicious, with_meta_tags, parent_id = row
+        entry = HoneypageEntry(honeypage_id, subdomain, path, protocol, pdf_payload, suspicious, with_meta_tags)
+        self._by_id[honeypage_id] = entry
+        self._by_key.setdefault((normalize_subdomain(subdomain), normalize_path(path)), entry)
+        first = self._by_subdomain.get(normalize_subdomain(subdomain))
+        if first is None or first.id > honeypage_id:
+            self._by_subdomain[normalize_subdomain(subdomain)] = entry
+        return entry, parent_id
+
+    def _link(self, entry, parent_id):
+        entry.parent = self._by_id.get(parent_id)
+        if entry.parent is not None:
+            entry.parent.children.append(entry)
+
+
+honeypage_registry = HoneypageRegistry(settings.HONEYPAGE_REGISTRY_TTL, settings.HONEYPAGE_REGISTRY_MISS_TTL)
@@ -0,0 +1,131 @@
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+class Resource(object):
+    """
+    A static file as of its last stat(): validators for conditional requests and, if it is small, its content.
+    """
+    __slots__ = ("path", "mtime", "size", "etag", "content")
+
+    def __init__(self, path, mtime, size, content=None):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.etag = '"{:x}-{:x}"'.format(int(mtime), size)  # like nginx
+        self.content = content
+
+
+class ResourceCache(object):
+    """
+    LRU cache of the files served by resource_view.
+
+    Every hit costs one stat(), a changed mtime or size reloads the file. Files up to `max_file_size` bytes
+    are kept in memory (at most `max_bytes` in total), larger ones only by their metadata and are streamed.
+    """
+
+    def __init__(self, max_file_size=256 * 1024, max_bytes=32 * 1024 * 1024):
+        self.max_file_size = max_file_size
+        self.max_bytes = max_bytes
+
+        self._resources = OrderedDict()  # path -> Resource
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        :return: Resource, or None if the file does not exist
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._remove(path)
+            return None
+
+        with self._lock:
+            resource = self._resources.get(path)
+            if resource is not None and resource.mtime == stat.st_mtime and resource.size == stat.st_size:
+                self._resources.move_to_end(path)
+                return resource
+
+        return self._load(path, stat)
+
+    def _load(self, path, stat):
+        content = None
+        if stat.st_size <= self.max_file_size:
+            try:
+                with open(path, "rb") as f:
+                    content = f.read()
+            except OSError:
+                return None
+            if len(content) != stat.st_size:
+                # changed while reading, cache it with the next hit
+                return Resource(path, stat.st_mtime, len(content), content)
+
+        resource = Resource(path, stat.st_mtime, stat.st_size, content)
+        with self._lock:
+            self._remove_locked(path)
+            self._resources[path] = resource
+            self._bytes += len(content or b"")
+            while self._bytes > self.max_bytes and self._resources:
+                _, evicted = self._resources.popitem(last=False)
+                self._bytes -= len(evicted.content or b"")
+        return resource
+
+    def _remove(self, path):
+        with self._lock:
+            self._remove_locked(path)
+
+    def _remove_locked(self, path):
+        resource = self._resources.pop(path, None)
+        if resource is not None:
+            self._bytes -= len(resource.content or b"")
+
+    def clear(self):
+        with self._lock:
+            self._resources.clear()
+            self._bytes = 0
+
+
+resource_cache = ResourceCache(settings.RESOURCE_CACHE_MAX_FILE_SIZE, settings.RESOURCE_CACHE_MAX_BYTES)
+
+
+def serve_resource(request, path, content_type):
+    """
+    Serves a static file with ETag and Last-Modified, answering conditional requests with 304
+    and HEAD requests without reading the file.
+    Small files come from memory, large ones are streamed by the WSGI server's file wrapper (sendfile)
+    or, if RESOURCE_X_ACCEL_REDIRECT is set, handed over to nginx.
+    :return: HttpResponse, or None if the file does not exist
+    """
+    resource = resource_cache.get(path)
+    if resource is None:
+        return None
+
+    response = get_conditional_response(request, etag=resource.etag, last_modified=int(resource.mtime))
+    if response is None:
+        if request.method == "HEAD":
+            response = HttpResponse(content_type=content_type)
+            response["Content-Length"] = resource.size
+        elif resource.content is not None:
+            response = HttpResponse(resource.content, content_type=content_type)
+        elif settings.RESOURCE_X_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            response["X-Accel-Redirect"] = settings.RESOURCE_X_ACCEL_REDIRECT.rstrip("/") + "/" + os.path.relpath(
+                resource.path, settings.STATIC_ROOT
+            ).replace(os.sep, "/")
+        else:
+            try:
+                response = FileResponse(open(resource.path, "rb"), content_type=content_type)
+            except OSError:
+                return None
+
+    response["ETag"] = resource.etag
+    response["Last-Modified"] = http_date(resource.mtime)
+    return response
@@ -1,10 +1,30 @@
+from django.db import models
 from rest_framework import serializers
 
+from control_server.fieldsets import RelationSummaryField, SparseFieldsetSerializerMixin
+from .correlation import FINGERPRINT_PROPERTIES, HONEYPAGE_PROPERTIES, resolve_access_log_correlations
 from .models import AccessLog, Honeypage, Honeymail, HoneydataType, FingerprintLog, Fingerprint, \
     BrowserFingerprintLog
 
 
-class AccessLogListSerializer(serializers.HyperlinkedModelSerializer):
+class AccessLogCorrelationListSerializer(serializers.ListSerializer):
+    """
+    Resolves the matching_* fields of all AccessLogs of a page at once instead of running queries per row,
+    but only those that are serialized.
+    """
+
+    def to_representation(self, data):
+        access_logs = list(data.all() if isinstance(data, models.Manager) else data)
+        fields = self.child.fields
+        resolve_access_log_correlations(
+            access_logs,
+            honeypages=any(name in fields for name in HONEYPAGE_PROPERTIES),
+            fingerprints=any(name in fields for name in FINGERPRINT_PROPERTIES),
+        )
+        return super().to_representation(access_logs)
+
+
+class AccessLogListSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     ip_address = serializers.ReadOnlyField()
     timestamp = serializers.DateTimeField()
@@ -32,12 +52,25 @@ class AccessLogListSerializer(serializers.HyperlinkedModelSerializer):
             "matching_experiment", "matching_honeypage",
             "matching_browser_fingerprint_log", "matching_fingerprint",
         ]
+        list_serializer_class = AccessLogCorrelationListSerializer
 
 
-class AccessLogDetailSerializer(serializers.HyperlinkedModelSerializer):
+class AccessLogDetailSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     ip_address = serializers.ReadOnlyField()
-    location = serializers.ReadOnlyField()
+
+    # read from the payload, which the views join only if one of these is serialized
+    content_params = serializers.ReadOnlyField(source="payload.content_params")
+    headers = serializers.ReadOnlyField(source="payload.headers")
+    get = serializers.ReadOnlyField(source="payload.get")
+    post = serializers.ReadOnlyField(source="payload.post")
+    cookies = serializers.ReadOnlyField(source="payload.cookies")
+    body = serializers.ReadOnlyField(source="payload.body")
+    meta = serializers.ReadOnlyField(source="payload.meta")
+    files = serializers.ReadOnlyField(source="payload.files")
+    location = serializers.ReadOnlyField(source="payload.location")
+    request = serializers.ReadOnlyField(source="payload.request")
+    response = serializers.ReadOnlyField(source="payload.response")
 
     username = serializers.ReadOnlyField()
 
@@ -74,9 +107,10 @@ class AccessLogDetailSerializer(serializers.HyperlinkedModelSerializer):
             "-id",
         ]
         fields = "__all__"
+        list_serializer_class = AccessLogCorrelationListSerializer
 
 
-class FingerprintSerializer(serializers.HyperlinkedModelSerializer):
+class FingerprintSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     fingerprint = serializers.ReadOnlyField()
 
@@ -91,7 +125,8 @@ class FingerprintSerializer(serializers.HyperlinkedModelSerializer):
 
     def to_representation(self, instance):
         response = super(FingerprintSerializer, self).to_representation(instance)
-        response["users_str"] = [user.username for user in instance.users.all()]
+        if self.is_requested("users_str"):
+            response["users_str"] = [user.username for user in instance.users.all()]
 
         return response
 
@@ -104,7 +139,7 @@ class FingerprintSerializer(serializers.HyperlinkedModelSerializer):
         fields = "__all__"
 
 
-class FingerprintLogSerializer(serializers.HyperlinkedModelSerializer):
+class FingerprintLogSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     # visited_url = serializers.ReadOnlyField()
 
@@ -114,7 +149,8 @@ class FingerprintLogSerializer(serializers.HyperlinkedModelSerializer):
     def to_representation(self, instance):
         response = super(FingerprintLogSerializer, self).to_representation(instance)
 
-        response["fingerprint_str"] = instance.fingerprint.fingerprint
+        if self.is_requested("fingerprint_str"):
+            response["fingerprint_str"] = instance.fingerprint.fingerprint
         return response
 
     class Meta:
@@ -126,7 +162,7 @@ class FingerprintLogSerializer(serializers.HyperlinkedModelSerializer):
         fields = "__all__"
 
 
-class BrowserFingerprintLogSerializer(serializers.HyperlinkedModelSerializer):
+class BrowserFingerprintLogSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
 
     class Meta:
@@ -141,7 +177,7 @@ class BrowserFingerprintLogSerializer(serializers.HyperlinkedModelSerializer):
         fields = "__all__"
 
 
-class HoneydataTypeSerializer(serializers.HyperlinkedModelSerializer):
+class HoneydataTypeSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     honeydata_type = serializers.CharField()
     experiments = serializers.HyperlinkedRelatedField(
@@ -156,7 +192,7 @@ class HoneydataTypeSerializer(serializers.HyperlinkedModelSerializer):
         fields = "__all__"
 
 
-class HoneypageDetailSerializer(serializers.HyperlinkedModelSerializer):
+class HoneypageDetailSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     children = serializers.HyperlinkedRelatedField(
         many=True, view_name="honeypage-detail", read_only=True
     )
@@ -179,16 +215,16 @@ class HoneypageDetailSerializer(serializers.HyperlinkedModelSerializer):
         view_name="honeypage-detail", many=False, read_only=True
     )
 
-    fingerprint_logs = serializers.HyperlinkedRelatedField(
-        view_name="fingerprintlog-detail", many=True, read_only=True
+    fingerprint_logs = RelationSummaryField(
+        view_name="fingerprintlog-detail", list_view_name="honeypage-get-fingerprint-logs"
     )
 
-    browser_fingerprint_logs = serializers.HyperlinkedRelatedField(
-        view_name="browserfingerprintlog-detail", many=True, read_only=True
+    browser_fingerprint_logs = RelationSummaryField(
+        view_name="browserfingerprintlog-detail", list_view_name="honeypage-get-browser-fingerprint-logs"
     )
 
-    access_logs = serializers.HyperlinkedRelatedField(
-        view_name="accesslog-detail", many=True, read_only=True
+    access_logs = RelationSummaryField(
+        view_name="accesslog-detail", list_view_name="honeypage-get-access-logs"
     )
 
     class Meta:
@@ -204,7 +240,7 @@ class HoneypageDetailSerializer(serializers.HyperlinkedModelSerializer):
         ]
 
 
-class HoneypageListSerializer(serializers.HyperlinkedModelSerializer):
+class HoneypageListSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     children = serializers.HyperlinkedRelatedField(
         many=True, view_name="honeypage-detail", read_only=True
     )
@@ -227,7 +263,7 @@ class HoneypageListSerializer(serializers.HyperlinkedModelSerializer):
         ]
 
 
-class HoneymailSerializer(serializers.HyperlinkedModelSerializer):
+class HoneymailSerializer(SparseFieldsetSerializerMixin, serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     experiment = serializers.HyperlinkedRelatedField(
         view_name="experiment-detail", many=False, read_only=True
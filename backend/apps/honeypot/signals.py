@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .feed import log_feed
+from .models import AccessLog, BrowserFingerprintLog, FingerprintLog, Honeypage
+from .pdf.cache import pdf_cache
+from .registry import honeypage_registry
+
+
+@receiver(post_save, sender=Honeypage)
+@receiver(post_delete, sender=Honeypage)
+def invalidate_honeypage_registry(sender, **kwargs):
+    # other processes must not reload before the change is visible to them
+    transaction.on_commit(honeypage_registry.invalidate)
+
+
+@receiver(post_save, sender=Honeypage)
+def generate_honeypage_pdf(sender, instance, **kwargs):
+    # the first generate.pdf request is served from the cache as well
+    if instance.pdf_payload:
+        pdf_cache.get(instance.pdf_payload)
+
+
+FEED_KINDS = {
+    AccessLog: "access_logs",
+    FingerprintLog: "fingerprint_logs",
+    BrowserFingerprintLog: "browser_fingerprint_logs",
+}
+
+
+@receiver(pre_save, sender=AccessLog)
+@receiver(pre_save, sender=FingerprintLog)
+@receiver(pre_save, sender=BrowserFingerprintLog)
+def set_correlation_keys(sender, instance, raw=False, **kwargs):
+    # resolved once when the log is written, bulk_create (the AccessLog sink) sets them itself
+    if not raw and instance._state.adding and not instance.host_key:
+        instance.set_correlation_keys()
+
+
+@receiver(post_save, sender=AccessLog)
+@receiver(post_save, sender=FingerprintLog)
+@receiver(post_save, sender=BrowserFingerprintLog)
+def notify_log_feed(sender, created=False, **kwargs):
+    # bulk_create (e.g. the AccessLog sink) sends no signals, it notifies the feed itself
+    if created:
+        kind = FEED_KINDS[sender]
+        transaction.on_commit(lambda: log_feed.notify(kind))
@@ -7,9 +7,8 @@ from collections import defaultdict
 
 import django_filters
 from django.conf import settings
-from django.contrib.gis.geoip2 import GeoIP2
-from django.http import HttpResponse
-from django.shortcuts import render
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
@@ -20,15 +19,20 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from ua_parser import user_agent_parser
 
-import honeypot.pdf.make_pdf_phone_home as make_pdf_phone_home
 from control_server.core import SERVER_ADDRESS_REGEX, extract_ip_address
+from control_server.fieldsets import SparseFieldsetViewSetMixin, sparse_queryset
+from . import feed
+from .export import ExportMixin
+from .feature_map import get_feature_map
 from .models import (
+    ACCESS_LOG_PAYLOAD_FIELDS,
     Honeypage,
     Honeymail,
     HoneydataType,
@@ -48,8 +52,10 @@ from .serializers import (
     AccessLogDetailSerializer,
     HoneypageListSerializer
 )
-
-geo_ip2 = GeoIP2()
+from .pagination import LargeResultsSetPagination, LogPagination
+from .pdf.cache import EMPTY_PDF, pdf_cache
+from .registry import honeypage_registry
+from .resources import serve_resource
 
 MIME_TYPES = {
     "css": "text/css",
@@ -65,55 +71,15 @@ MIME_TYPES = {
     "exe": "application/x-msdownload"
 }
 
-feature_scope_path = os.path.join(
-    settings.DJANGO_ROOT, "run", "fingerprinting", "features-in-scope.txt"
-)
-browser_feature_map_path = os.path.join(
-    settings.DJANGO_ROOT, "run", "fingerprinting", "feature_map.json"
-)
+# large columns that are only loaded if the response contains them (see control_server/fieldsets.py),
+# those of AccessLogs are in their payload
+ACCESS_LOG_LARGE_FIELDS = ("payload",)
+FINGERPRINT_LOG_LARGE_FIELDS = ("components",)
+BROWSER_FINGERPRINT_LOG_LARGE_FIELDS = ("features", "browser_like_data", "plugins", "client_data")
 
 # pattern for the real ip header
 REAL_IP_PATTERN = re.compile(r"'X-Real-Ip': '([.0-9]+)'")
 
-# Required for browser fingerprinting
-browser_feature_map = {}
-feature_scope = []
-browsers = []
-
-
-def init():
-    global feature_scope
-    global browser_feature_map
-    global browsers
-
-    if not len(feature_scope) > 0:
-        # init feature list
-        if not os.path.isfile(feature_scope_path):
-            raise IOError('File "features-in-scope.txt" does not exist. Read fingerprinting Readme')
-        with open(feature_scope_path, "r") as file:
-            content = file.readlines()
-        feature_scope = [x.strip() for x in content]
-
-    if not (isinstance(browser_feature_map, dict) and len(browser_feature_map.keys()) > 0):
-        # init browser_feature_map
-        if not os.path.isfile(browser_feature_map_path):
-            raise IOError('File "feature_map.json" does not exist. Run init_fingerprinting script first.')
-        with open(browser_feature_map_path, "r") as map_file:
-            map_content = map_file.read()
-        try:
-            json_content = json.loads(map_content)  # [ [ "browser1", [ "feature1", ... ] ], ...]
-            for browser_data in json_content:  # [ "browser1", [ "feature1", ... ] ]
-                browser = browser_data[0]
-                feature_list = browser_data[1]
-                browser_feature_map[browser] = feature_list
-            browsers = browser_feature_map.keys()
-        except Exception:
-            raise IOError('Unable to parse "feature_map.json".')
-
-
-# call init
-init()
-
 
 def default_view(request, args=None):
     return render(request, "apps/honeypot/honeypage.html", {"request": request})
@@ -151,24 +117,13 @@ class HoneyPageView(CSRFExemptMixin, TemplateView):
         return "HoneyPage"
 
     def get(self, request, slug=None, *args, **kwargs):
-        honeypage: Honeypage | None = None
         subdomain, path = extract_subdomain_and_path_from_request(request.build_absolute_uri())
-
-        if subdomain or path:
-            if not path:
-                honeypage: Honeypage = Honeypage.objects.filter(
-                    subdomain__iexact=subdomain
-                ).first()
-            else:
-                honeypage: Honeypage = Honeypage.objects.filter(
-                    subdomain__iexact=subdomain,
-                    path__iregex=r"{}/?".format(path)
-                ).first()
+        honeypage = honeypage_registry.get(subdomain, path)
 
         parent = None
         children = []
         if honeypage:
-            children = honeypage.children.all()
+            children = honeypage.children
             parent = honeypage.parent
 
         return render(
@@ -198,43 +153,32 @@ def resource_view(request, resource_name=None, file_ending=None, *args, **kwargs
             # get honeypage by subdomain and path (standard use case)
             url = request.build_absolute_uri().rstrip("/").rstrip(file_name)
             subdomain, path = extract_subdomain_and_path_from_request(url)
-            honeypage = Honeypage.objects.filter(subdomain__iexact=subdomain, path__iregex=r"%s/?" % path).first()
+            honeypage = honeypage_registry.get(subdomain, path)
 
-            # get pdf payload from that honeypage and generate the pdf
+            # the pdf of the honeypage's payload is generated once, see honeypot/pdf/cache.py
             if honeypage and honeypage.pdf_payload and len(honeypage.pdf_payload) > 0:
-                payload_url = honeypage.pdf_payload
-                return HttpResponse(
-                    make_pdf_phone_home.generate_pdf(payload_url, payload_url).encode("utf-8"),
-                    content_type=mime_type,
-                    status=200
-                )
+                pdf = pdf_cache.get(honeypage.pdf_payload)
             else:
                 # no honeypage, so return an empty pdf
-                return HttpResponse(
-                    make_pdf_phone_home.generate_pdf(content="Seems quite empty here...").encode("utf-8"),
-                    content_type=mime_type,
-                    status=200
-                )
-                pass
+                pdf = EMPTY_PDF
+
+            response = HttpResponse(pdf, content_type=mime_type, status=200)
+            response["Content-Length"] = len(pdf)
+            return response
+
+    file_name = "{}.{}".format(resource_name.replace("/", ""), file_ending)
 
     # fetch js scripts
     if mime_type == MIME_TYPES.get("js"):
-        file_path = "run/static/scripts/{}.{}".format(resource_name.replace("/", ""), file_ending)
-        if os.path.isfile(file_path):
-            try:
-                with open(file_path, "rb") as f:
-                    return HttpResponse(f.read(), content_type=mime_type, status=200)
-            except IOError:
-                pass
+        response = serve_resource(request, os.path.join(settings.STATIC_ROOT, "scripts", file_name), mime_type)
+        if response is not None:
+            return response
 
     # try to fetch honeypage files by name
-    file_path = "run/static/honeypage/{}.{}".format(resource_name.replace("/", ""), file_ending)
-    if mime_type and os.path.isfile(file_path):
-        try:
-            with open(file_path, "rb") as f:
-                return HttpResponse(f.read(), content_type=mime_type, status=200)
-        except IOError:
-            pass
+    if mime_type:
+        response = serve_resource(request, os.path.join(settings.STATIC_ROOT, "honeypage", file_name), mime_type)
+        if response is not None:
+            return response
 
     # unsupported type or resource does not exist
     print(
@@ -344,56 +288,9 @@ def browser_info(request):
     return HttpResponse("///Browser info received", 200)
 
 
-def _is_like_browser(data, browser):
-    return (
-        (
-            not data["chrome"] and not data["chrome_like"] and not data["edge_like"] and not data["old_ie"]
-            and not data["ie_like"] and not data["mozilla_like"] and not data["netscape"] and not data["opera"]
-            and not data["opera_like"] and not data["safari"] and not data["safari_like"]
-        )
-        or (
-            browser.startswith("chrome") and (data["chrome"] or data["chrome_like"] or data["phantom"])
-            and not data["edge_like"]
-        )
-        or (browser.startswith("edge") and data["edge_like"])
-        or (browser.startswith("firefox") and (data["netscape"] or data["mozilla_like"]) and not data["ie_like"])
-        or (browser.startswith("ie") and (data["old_ie"] or data["ie_like"]))
-        or (browser.startswith("opera") and (data["opera"] or data["opera_like"]))
-        or (browser.startswith("safari") and (data["safari"] or data["safari_like"]))
-    )
-
-
 def _parse_features(data):
-    features = data["features"]
-    if len(features) != len(feature_scope):
-        print("Unexpected browser fingerprint length")
-        return {"max": 0, "result": ["unknown"]}
-
-    # check client features with features of browser versions
-    matches = {}
-    for feature_idx, feature in enumerate(features):
-        for browser in browsers:
-            if not _is_like_browser(data, browser):
-                # For example skip Chrome and Firefox if edge_like
-                continue
-
-            client_has_feature = feature == "1"
-            browser_has_feature = feature_scope[feature_idx] in browser_feature_map[browser]
-
-            if not (client_has_feature ^ browser_has_feature):  # XNOR
-                matches[browser] = matches[browser] + 1 if browser in matches else 1
-
-    max_score = 0
-    result = []
-    for browser in matches.keys():
-        score = matches[browser]
-        if score > max_score:
-            max_score = score
-            result = [browser]
-        elif score == max_score:
-            result.append(browser)
-
-    return {"max": max_score, "result": result}
+    # the feature map is loaded on the first fingerprint, not when the module is imported
+    return get_feature_map().parse_features(data)
 
 
 def _parse_ua(ua_str):
@@ -475,17 +372,13 @@ class AccessLogFilter(filters.FilterSet):
         fields = []
 
 
-class LargeResultsSetPagination(PageNumberPagination):
-    page_size = 100
-    page_size_query_param = 'page_size'
-    max_page_size = 10000
-
-
-class AccessLogViewSet(viewsets.ReadOnlyModelViewSet):
+class AccessLogViewSet(SparseFieldsetViewSetMixin, ExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = AccessLog.objects.all()
     serializer_class = AccessLogListSerializer
 
-    pagination_class = LargeResultsSetPagination
+    pagination_class = LogPagination
+    deferrable_fields = ACCESS_LOG_LARGE_FIELDS
+    export_related_fields = tuple("payload__" + name for name in ACCESS_LOG_PAYLOAD_FIELDS)
     authentication_classes = (TokenAuthentication, SessionAuthentication,)
 
     permission_classes = (
@@ -508,6 +401,10 @@ class AccessLogViewSet(viewsets.ReadOnlyModelViewSet):
         # default
         return AccessLogListSerializer
 
+    def filter_queryset(self, queryset):
+        # usernames are serialized for every row
+        return super().filter_queryset(queryset).select_related("user")
+
     @action(detail=True)
     def similar(self, request, pk=None):
         """
@@ -628,10 +525,11 @@ class FingerprintLogFilter(filters.FilterSet):
         fields = []
 
 
-class FingerprintLogViewSet(viewsets.ReadOnlyModelViewSet):
+class FingerprintLogViewSet(SparseFieldsetViewSetMixin, ExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = FingerprintLog.objects.all()
     serializer_class = FingerprintLogSerializer
-    pagination_class = LargeResultsSetPagination
+    pagination_class = LogPagination
+    deferrable_fields = FINGERPRINT_LOG_LARGE_FIELDS
     authentication_classes = (TokenAuthentication, SessionAuthentication,)
 
     filter_backends = [DjangoFilterBackend, OrderingFilter]
@@ -644,6 +542,10 @@ class FingerprintLogViewSet(viewsets.ReadOnlyModelViewSet):
         IsAuthenticated,
     )
 
+    def filter_queryset(self, queryset):
+        # fingerprint_str is serialized for every row (select_related ignores the parent_link foreign key)
+        return super().filter_queryset(queryset).prefetch_related("fingerprint")
+
 
 class BrowserFingerprintLogFilter(filters.FilterSet):
     id__gt = django_filters.NumberFilter(field_name="id", lookup_expr="gt")
@@ -654,10 +556,11 @@ class BrowserFingerprintLogFilter(filters.FilterSet):
         fields = []
 
 
-class BrowserFingerprintLogViewSet(viewsets.ReadOnlyModelViewSet):
+class BrowserFingerprintLogViewSet(SparseFieldsetViewSetMixin, ExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = BrowserFingerprintLog.objects.all()
     serializer_class = BrowserFingerprintLogSerializer
-    pagination_class = LargeResultsSetPagination
+    pagination_class = LogPagination
+    deferrable_fields = BROWSER_FINGERPRINT_LOG_LARGE_FIELDS
     authentication_classes = (TokenAuthentication, SessionAuthentication,)
 
     filter_backends = [DjangoFilterBackend, OrderingFilter]
@@ -671,6 +574,84 @@ class BrowserFingerprintLogViewSet(viewsets.ReadOnlyModelViewSet):
     )
 
 
+class LogFeedViewSet(viewsets.ViewSet):
+    """
+    API endpoint for new logs as they arrive, for all logs of unauthenticated visitors
+    or those of one experiment (`?experiment=<id>`) or honeypage (`?honeypage=<id>`).
+
+    `?since=<cursor>` continues after the logs already seen, the first request without it starts at the newest logs
+    (`?since=0.0.0` starts at the beginning). Every response contains the cursor to continue from.
+    Logs are sent once they were inserted ACCESS_LOG_COMMIT_LAG seconds ago, so the cursor doesn't skip logs whose
+    insert is committed after one with a higher id. A log whose insert takes longer than that can still be skipped.
+    """
+    authentication_classes = (TokenAuthentication, SessionAuthentication,)
+
+    permission_classes = (
+        IsAdminUser,
+        IsAuthenticated,
+    )
+
+    default_limit = 100
+    max_limit = 1000
+
+    def list(self, request):
+        """
+        Long-poll: answers at once if there are logs after the cursor, otherwise waits up to `?timeout=` seconds
+        (default and maximum: LOG_FEED_MAX_TIMEOUT) for new ones.
+        """
+        querysets, cursor = self._feed(request, request.query_params.get("since"))
+        timeout = min(self._number(request, "timeout", settings.LOG_FEED_MAX_TIMEOUT), settings.LOG_FEED_MAX_TIMEOUT)
+
+        logs, cursor, has_more = feed.poll(querysets, cursor, timeout, self._limit(request))
+        return Response(dict(cursor=feed.format_cursor(cursor), has_more=has_more, **logs))
+
+    @action(detail=False, renderer_classes=[feed.EventStreamRenderer, JSONRenderer])
+    def stream(self, request):
+        """
+        Server-sent events (for an EventSource), one "logs" event per batch of new logs. The stream ends after
+        LOG_FEED_STREAM_DURATION seconds, the EventSource then reconnects and resumes from its Last-Event-ID.
+        """
+        querysets, cursor = self._feed(
+            request, request.META.get("HTTP_LAST_EVENT_ID") or request.query_params.get("since")
+        )
+
+        response = StreamingHttpResponse(
+            feed.event_stream(querysets, cursor, settings.LOG_FEED_STREAM_DURATION, self._limit(request)),
+            content_type="text/event-stream; charset=utf-8"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx must pass events through immediately
+        return response
+
+    @staticmethod
+    def _feed(request, since):
+        from control_server.models import Experiment
+
+        experiment = honeypage = None
+        if request.query_params.get("experiment"):
+            experiment = get_object_or_404(Experiment, pk=request.query_params["experiment"])
+        elif request.query_params.get("honeypage"):
+            honeypage = get_object_or_404(Honeypage, pk=request.query_params["honeypage"])
+        querysets = feed.feed_querysets(experiment, honeypage)
+
+        if not since:
+            return querysets, feed.latest_cursor(querysets)
+        try:
+            return querysets, feed.parse_cursor(since)
+        except ValueError as e:
+            raise ValidationError({"since": "Invalid cursor: {}".format(e)})
+
+    def _limit(self, request):
+        return max(1, min(int(self._number(request, "limit", self.default_limit)), self.max_limit))
+
+    @staticmethod
+    def _number(request, name, default):
+        try:
+            return max(0.0, float(request.query_params.get(name, default)))
+        except ValueError:
+            raise ValidationError({name: "A number is required."})
+
+
 class HoneydataTypeViewSet(viewsets.ReadOnlyModelViewSet):
     """ API endpoint that allows exchanges to be viewed or edited. """
     permission_classes = (IsAuthenticated,)
@@ -728,6 +709,7 @@ class HoneypageViewSet(viewsets.ReadOnlyModelViewSet):
 
     def _craft_paginated_fingerprint_log_response(self, queryset, request):
         context = {"request": request}
+        queryset = sparse_queryset(queryset, FingerprintLogSerializer(context=context), FINGERPRINT_LOG_LARGE_FIELDS)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = FingerprintLogSerializer(page, many=True, context=context)
@@ -738,6 +720,9 @@ class HoneypageViewSet(viewsets.ReadOnlyModelViewSet):
 
     def _craft_paginated_browser_fingerprint_log_response(self, queryset, request):
         context = {"request": request}
+        queryset = sparse_queryset(
+            queryset, BrowserFingerprintLogSerializer(context=context), BROWSER_FINGERPRINT_LOG_LARGE_FIELDS
+        )
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = BrowserFingerprintLogSerializer(page, many=True, context=context)
@@ -768,6 +753,8 @@ class HoneypageViewSet(viewsets.ReadOnlyModelViewSet):
 
     def _craft_paginated_access_log_response(self, queryset, request):
         context = {"request": request}
+        queryset = queryset.select_related("user")
+        queryset = sparse_queryset(queryset, AccessLogListSerializer(context=context), ACCESS_LOG_LARGE_FIELDS)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = AccessLogListSerializer(page, many=True, context=context)
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class BackendConfig(AppConfig):
+    name = "backend"
+
+    def ready(self):
+        from . import signals  # noqa: F401
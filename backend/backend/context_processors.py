@@ -1,30 +1,53 @@
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
 
 from control_server.models import Experiment
 
+# cache key of the counts shown in the API's navigation bar, deleted by backend/signals.py
+COUNTS_CACHE_KEY = "context_processors:counts"
+
+
+def get_counts():
+    """
+    User and experiment counts, cached for CONTEXT_COUNTS_CACHE_TTL seconds.
+    (Running experiments also change when an experiment's start time passes, the TTL bounds that delay.)
+    """
+    counts = cache.get(COUNTS_CACHE_KEY)
+    if counts is None:
+        counts = {
+            "users": User.objects.count(),
+            "running_experiments": Experiment.get_running_experiments().count(),
+            "finished_experiments": Experiment.objects.filter(finished_at__isnull=False).count(),
+        }
+        cache.set(COUNTS_CACHE_KEY, counts, settings.CONTEXT_COUNTS_CACHE_TTL)
+    return counts
+
 
 def export_vars(request):
     """
     Can be enabled in Django common settings under context_processors in the TEMPLATES section.
     This context processor adds the currently used settings module to each request,
     so it can be used in the templates like this `{{ SETTINGS_MODULE }}`.
+    The counts are lazy, templates that don't use them (e.g. honeypages) don't query or cache anything.
     :param request:
     :return:
     """
     engine = settings.DATABASES.get("default", {}).get("ENGINE", "")
     db_string = "PostgreSQL" if "postgresql" in engine else "SQLite" if "sqlite" in engine else "unknown"
-    user_count = User.objects.count()
-    user_string = str(user_count) + " User" + ("s" if user_count != 1 else "")
+    counts = SimpleLazyObject(get_counts)
+
+    def user_string():
+        user_count = counts["users"]
+        return str(user_count) + " User" + ("s" if user_count != 1 else "")
 
     data = {
         "SETTINGS_MODULE": settings.SETTINGS_MODULE,
         "DATABASE_ENGINE": db_string,
-        "USER_COUNT": user_string,
-        "RUNNING_EXPERIMENT_COUNT": Experiment.get_running_experiments().count(),
-        "FINISHED_EXPERIMENT_COUNT": Experiment.objects.filter(
-            finished_at__isnull=False
-        ).count()
+        "USER_COUNT": SimpleLazyObject(user_string),
+        "RUNNING_EXPERIMENT_COUNT": SimpleLazyObject(lambda: counts["running_experiments"]),
+        "FINISHED_EXPERIMENT_COUNT": SimpleLazyObject(lambda: counts["finished_experiments"]),
     }
 
     return data
@@ -0,0 +1,20 @@
+"""
+URLconf for honeypage hosts (<subdomain>.<domain>), set by the HoneypageHostMiddleware.
+Only the honeypot is reachable there, admin and API routes are not.
+"""
+from django.urls import include, path, re_path
+
+from . import views
+from honeypot.views import fingerprint, browser_info
+
+handler404 = views.handler404
+handler500 = views.handler500
+
+urlpatterns = [
+    # XHR endpoints
+    re_path(r"fingerprint/?$", fingerprint, name="fingerprint"),
+    re_path(r"browser_info/?$", browser_info, name="browser_info"),
+
+    # all other urls lead to the honeypot
+    path("", include("honeypot.urls")),
+]
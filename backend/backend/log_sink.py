@@ -0,0 +1,266 @@
+import atexit
+import base64
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection, transaction
+
+from honeypot.feed import log_feed
+from honeypot.models import AccessLog
+
+# bytes (e.g. an undecodable request body) are journaled as {"__bytes__": "<base64>"}
+BYTES_KEY = "__bytes__"
+
+
+def _encode_journal_value(value):
+    if isinstance(value, bytes):
+        return {BYTES_KEY: base64.b64encode(value).decode("ascii")}
+    return str(value)
+
+
+def _decode_journal_object(obj):
+    if obj.keys() == {BYTES_KEY}:
+        return base64.b64decode(obj[BYTES_KEY])
+    return obj
+
+
+class AccessLogSink(object):
+    """
+    Write-behind sink for AccessLogs.
+
+    The AccessLogMiddleware puts finished log dicts on a bounded in-process queue.
+    A daemon flusher thread writes them with `bulk_create`, either when `batch_size` logs are waiting
+    or when `flush_interval` seconds have passed.
+    If the database is slow or unavailable (or the queue is full), logs are appended to a local journal file
+    (one JSON object per line) and replayed as soon as the database accepts writes again.
+    Lines of the journal that can't be decoded (e.g. torn by a crash) are moved to `<journal>.rejected`.
+    """
+
+    def __init__(self, max_queue_size=10000, batch_size=500, flush_interval=1.0, journal_path=None):
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal_path = journal_path
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def from_settings():
+        return AccessLogSink(
+            max_queue_size=settings.ACCESS_LOG_QUEUE_SIZE,
+            batch_size=settings.ACCESS_LOG_BATCH_SIZE,
+            flush_interval=settings.ACCESS_LOG_FLUSH_INTERVAL,
+            journal_path=settings.ACCESS_LOG_JOURNAL_PATH,
+        )
+
+    def put(self, log: dict):
+        """
+        Enqueues a log dict (keyword arguments for AccessLog). Never blocks the request thread.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(log)
+        except queue.Full:
+            self._spill([log])
+
+    def flush(self):
+        """
+        Synchronously writes everything that is still queued, e.g. when the worker shuts down.
+        """
+        if self._queue is None or self._pid != os.getpid():
+            return
+
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    # *** Flusher thread ***
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._start_lock:
+            # threads do not survive fork(), so each (gunicorn) worker starts its own flusher;
+            # a flusher that died in this process is replaced, its queued logs are kept
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue_size)
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="access-log-sink", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _run(self):
+        try:
+            self._adopt_orphaned_replays()
+        except Exception as e:
+            print("AccessLog sink: adopting orphaned replays failed ({!r})".format(e))
+
+        while True:
+            try:
+                batch = self._collect()
+                if batch and not self._write(batch):
+                    # the database is unavailable, don't hammer it
+                    time.sleep(self.flush_interval)
+                    continue
+
+                self._replay_journal()
+            except Exception as e:
+                # the flusher must keep running, whatever went wrong with one batch
+                print("AccessLog sink: flushing failed ({!r})".format(e))
+                time.sleep(self.flush_interval)
+
+    def _collect(self):
+        """
+        Blocks until the first log arrives (or flush_interval passed), then collects more logs
+        until the batch is full or the interval is over.
+        """
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write(self, batch) -> bool:
+        """
+        Writes a batch of log dicts. Returns False if the batch had to be spilled to the journal.
+        """
+        try:
+            connection.close_if_unusable_or_obsolete()
+            access_logs = [AccessLog(**log) for log in batch]
+            for access_log in access_logs:
+                # bulk_create sends no pre_save signals
+                access_log.set_correlation_keys()
+            AccessLog.objects.bulk_create(access_logs, batch_size=self.batch_size)
+        except (OperationalError, InterfaceError) as e:
+            # database is down or unreachable, keep the logs for later
+            print("AccessLog sink: database unavailable, journaling {} logs ({})".format(len(batch), e))
+            connection.close()
+            self._spill(batch)
+            return False
+        except Exception:
+            # a single malformed log must not poison the whole batch
+            self._write_one_by_one(batch)
+        finally:
+            connection.close_if_unusable_or_obsolete()
+
+        try:
+            log_feed.notify("access_logs")
+        except Exception as e:
+            print("AccessLog sink: notifying the log feed failed ({!r})".format(e))
+        return True
+
+    @staticmethod
+    def _write_one_by_one(batch):
+        for log in batch:
+            try:
+                with transaction.atomic():
+                    AccessLog(**log).save()
+            except Exception as e:
+                print(e)
+
+    # *** Journal ***
+    def _spill(self, logs):
+        if not self.journal_path:
+            print("AccessLog sink: no journal configured, dropping {} logs".format(len(logs)))
+            return
+
+        lines = "".join(json.dumps(log, default=_encode_journal_value) + "\n" for log in logs)
+        with self._journal_lock:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            with open(self.journal_path, "a", encoding="utf-8") as journal:
+                journal.write(lines)
+
+    def _replay_journal(self):
+        if not self.journal_path or not os.path.isfile(self.journal_path):
+            return
+
+        # claim the journal atomically, other workers may share it;
+        # a replay file of this process is left over from a replay that failed, finish that one first
+        replay_path = "{}.replay-{}".format(self.journal_path, os.getpid())
+        if not os.path.isfile(replay_path):
+            try:
+                with self._journal_lock:
+                    os.rename(self.journal_path, replay_path)
+            except OSError:
+                return
+
+        self._replay_file(replay_path)
+
+    def _replay_file(self, replay_path):
+        logs = []
+        rejected = []
+        with open(replay_path, "r", encoding="utf-8", errors="surrogateescape") as replay:
+            for line in replay:
+                if not line.strip():
+                    continue
+                try:
+                    logs.append(json.loads(line, object_hook=_decode_journal_object))
+                except ValueError:
+                    rejected.append(line if line.endswith("\n") else line + "\n")
+        if rejected:
+            print("AccessLog sink: moving {} undecodable journal lines to {}.rejected".format(
+                len(rejected), self.journal_path
+            ))
+            with self._journal_lock:
+                with open(self.journal_path + ".rejected", "a", encoding="utf-8", errors="surrogateescape") as f:
+                    f.write("".join(rejected))
+
+        print("AccessLog sink: replaying {} journaled logs".format(len(logs)))
+        for i in range(0, len(logs), self.batch_size):
+            if not self._write(logs[i:i + self.batch_size]):
+                # _write journaled the failed batch; put back everything after it as well
+                self._spill(logs[i + self.batch_size:])
+                break
+
+        os.remove(replay_path)
+
+    def _adopt_orphaned_replays(self):
+        """
+        Picks up replay files of workers that died while replaying.
+        """
+        if not self.journal_path:
+            return
+
+        for replay_path in glob.glob(self.journal_path + ".replay-*"):
+            try:
+                pid = int(replay_path.rsplit("-", 1)[1])
+                os.kill(pid, 0)
+                continue  # the owner is still alive
+            except ProcessLookupError:
+                pass
+            except (ValueError, PermissionError):
+                continue
+
+            adopted_path = "{}.replay-{}".format(self.journal_path, os.getpid())
+            try:
+                os.rename(replay_path, adopted_path)
+            except OSError:
+                continue
+            self._replay_file(adopted_path)
+
+
+access_log_sink = AccessLogSink.from_settings()
@@ -4,15 +4,37 @@ from json import JSONDecodeError
 from os import environ
 
 import chardet
-from django.contrib.gis.geoip2 import GeoIP2
+from django.conf import settings
 from django.http.request import HttpHeaders
-from geoip2.errors import AddressNotFoundError
 
 from control_server.core import extract_ip_address, SERVER_ADDRESS, SERVER_ADDRESS_REGEX
+from control_server.geoip import geoip_resolver
 from control_server.time import now
 from honeypot.models import AccessLog
+from .log_sink import access_log_sink
 
-geo_ip2 = GeoIP2()
+
+class HoneypageHostMiddleware(object):
+    """
+    Resolves requests to honeypage hosts (<subdomain>.<SERVER_ADDRESS>) with the honeypot-only URLconf,
+    skipping the admin, API and authentication patterns that never match there.
+    Subdomains in RESERVED_SUBDOMAINS (e.g. "api") keep the full URLconf.
+    """
+    urlconf = "backend.honeypot_urls"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.host_pattern = re.compile(
+            r"^(?P<subdomain>[\w-]+)\.{}(?::[0-9]+)?$".format(SERVER_ADDRESS_REGEX), re.IGNORECASE
+        )
+        self.reserved_subdomains = set(subdomain.lower() for subdomain in settings.RESERVED_SUBDOMAINS)
+
+    def __call__(self, request):
+        match = self.host_pattern.match(request.META.get("HTTP_HOST", ""))
+        if match and match.group("subdomain").lower() not in self.reserved_subdomains:
+            request.urlconf = self.urlconf
+
+        return self.get_response(request)
 
 
 class ContextMiddleware(object):
@@ -143,11 +165,9 @@ class AccessLogMiddleware(object):
         subdomain = re.split(SERVER_ADDRESS_REGEX, http_host)[0].strip(".")
         log["subdomain"] = subdomain if subdomain != SERVER_ADDRESS else ""
 
-        try:
-            log["location"] = json.dumps(geo_ip2.city(log["ip_address"]))
-        except AddressNotFoundError as e:
-            # print("No location found for", log["ip_address"], e)
-            pass
+        location = geoip_resolver.city(log["ip_address"])
+        if location is not None:
+            log["location"] = json.dumps(location)
 
         response_dict = {}
         for attr in ["status_code", "reason_phrase", "status_text", "content_type", "charset"]:
@@ -165,6 +185,11 @@ class AccessLogMiddleware(object):
 
         log["response"] = json.dumps(response_dict)
 
+        if settings.ACCESS_LOG_WRITE_BEHIND:
+            # the log is written by the sink's flusher thread, the crawler doesn't wait for the database
+            access_log_sink.put(log)
+            return response
+
         try:
             AccessLog(**log).save()
         except Exception as e:
@@ -126,6 +126,8 @@ MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    # before CommonMiddleware, which resolves the path for APPEND_SLASH
+    "backend.middleware.HoneypageHostMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -217,10 +219,16 @@ CACHES = {
         "LOCATION": "redis://127.0.0.1:6379/1",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # the cache only holds derived values, without Redis they are recomputed
+            "IGNORE_EXCEPTIONS": True,
+            "SOCKET_CONNECT_TIMEOUT": 1,
         }
     }
 }
 
+# invalidation messages between processes (see control_server/broadcast.py) go through the cache's Redis
+BROADCAST_CHANNEL_PREFIX = os.environ.get("BROADCAST_CHANNEL_PREFIX", "honeymessages")
+
 CSRF_COOKIE_SECURE = PROTOCOL == "https"  # if True csrf cookies will only be set if https is used
 CSRF_COOKIE_HTTPONLY = True
 
@@ -229,8 +237,67 @@ SECURE_PROXY_SSL_HEADER = ("HTTP_X_REAL_PROTO", PROTOCOL)
 DOMAIN_NAME = os.environ.get("DOMAIN_NAME", "")
 CSRF_COOKIE_DOMAIN = os.environ.get("CSRF_COOKIE_DOMAIN", "")
 
+# subdomains that serve the API (and admin) instead of honeypages, see backend/middleware.py
+RESERVED_SUBDOMAINS = [
+    subdomain.strip() for subdomain in os.environ.get("RESERVED_SUBDOMAINS", "api,www,admin").split(",")
+    if subdomain.strip()
+]
+
+# seconds the user and experiment counts of the API pages are cached (see backend/context_processors.py)
+CONTEXT_COUNTS_CACHE_TTL = int(os.environ.get("CONTEXT_COUNTS_CACHE_TTL", 30))
+
+# ##### RESOURCE CONFIGURATION ############################
+# honeypage resources up to this size are kept in memory (see honeypot/resources.py), larger ones are streamed
+RESOURCE_CACHE_MAX_FILE_SIZE = int(os.environ.get("RESOURCE_CACHE_MAX_FILE_SIZE", 256 * 1024))
+RESOURCE_CACHE_MAX_BYTES = int(os.environ.get("RESOURCE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# internal nginx location of STATIC_ROOT (e.g. "/protected-static/"); if set, large resources are sent by nginx
+RESOURCE_X_ACCEL_REDIRECT = os.environ.get("RESOURCE_X_ACCEL_REDIRECT", "")
+
+# generated phone-home PDFs (see honeypot/pdf/cache.py), on disk and the number kept in memory per process
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", join(DJANGO_ROOT, "run", "pdf_cache"))
+PDF_CACHE_SIZE = int(os.environ.get("PDF_CACHE_SIZE", 1024))
+
+# ##### HONEYPAGE REGISTRY CONFIGURATION #################
+# seconds after which a process reloads its honeypages if it can't receive invalidations from Redis
+HONEYPAGE_REGISTRY_TTL = float(os.environ.get("HONEYPAGE_REGISTRY_TTL", 60))
+# seconds a lookup that missed, also in the database, isn't repeated (honeypages created by other processes are
+# looked up in the database when they are missing)
+HONEYPAGE_REGISTRY_MISS_TTL = float(os.environ.get("HONEYPAGE_REGISTRY_MISS_TTL", 2))
+
+# ##### LOG FEED CONFIGURATION ############################
+# seconds between database polls of waiting feed requests if new logs can't be announced through Redis
+LOG_FEED_POLL_INTERVAL = float(os.environ.get("LOG_FEED_POLL_INTERVAL", 2.0))
+# longest wait of a long-poll request, keep it below the proxy's read timeout
+LOG_FEED_MAX_TIMEOUT = float(os.environ.get("LOG_FEED_MAX_TIMEOUT", 30))
+# seconds after which an event stream ends, the EventSource reconnects and resumes with Last-Event-ID
+LOG_FEED_STREAM_DURATION = float(os.environ.get("LOG_FEED_STREAM_DURATION", 300))
+
+# ##### ACCESS LOG CONFIGURATION ##########################
+# write AccessLogs behind the request in batches (see backend/log_sink.py)
+ACCESS_LOG_WRITE_BEHIND = os.environ.get("ACCESS_LOG_WRITE_BEHIND", "true").lower() == "true"
+ACCESS_LOG_QUEUE_SIZE = int(os.environ.get("ACCESS_LOG_QUEUE_SIZE", 10000))
+ACCESS_LOG_BATCH_SIZE = int(os.environ.get("ACCESS_LOG_BATCH_SIZE", 500))
+ACCESS_LOG_FLUSH_INTERVAL = float(os.environ.get("ACCESS_LOG_FLUSH_INTERVAL", 1.0))
+
+# seconds after its insert after which a log is assumed to be committed: logs are written in batches by several
+# processes, so their ids don't become visible in id order. Evaluations and the log feed only move past such logs
+ACCESS_LOG_COMMIT_LAG = float(os.environ.get("ACCESS_LOG_COMMIT_LAG", 5))
+
+# logs that can't be written (database down, queue full) are journaled here and replayed later
+ACCESS_LOG_JOURNAL_PATH = os.environ.get(
+    "ACCESS_LOG_JOURNAL_PATH", join(DJANGO_ROOT, "run", "journal", "access_logs.jsonl")
+)
+
+# monthly partitions of the AccessLog table on PostgreSQL (see `manage.py access_log_partitions`):
+# months created in advance, full months kept before partitions are archived (0: keep all) and the archive directory
+ACCESS_LOG_PARTITIONS_AHEAD = int(os.environ.get("ACCESS_LOG_PARTITIONS_AHEAD", 3))
+ACCESS_LOG_RETENTION_MONTHS = int(os.environ.get("ACCESS_LOG_RETENTION_MONTHS", 0))
+ACCESS_LOG_ARCHIVE_DIR = os.environ.get("ACCESS_LOG_ARCHIVE_DIR", join(DJANGO_ROOT, "run", "archive"))
+
 # GeoIP2
 GEOIP_PATH = normpath(join(DJANGO_ROOT, "run", "geoip"))
+# number of IP addresses whose GeoIP results are kept in memory (per process)
+GEOIP_CACHE_SIZE = int(os.environ.get("GEOIP_CACHE_SIZE", 65536))
 
 X_FRAME_OPTIONS = "SAMEORIGIN"
 
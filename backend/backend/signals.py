@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from control_server.models import Experiment
+from .context_processors import COUNTS_CACHE_KEY
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_count(sender, created=True, **kwargs):
+    # only the number of users is shown, other saves (e.g. last_login on every login) don't change it
+    if created:
+        invalidate_counts(sender, **kwargs)
+
+
+@receiver(post_save, sender=Experiment)
+@receiver(post_delete, sender=Experiment)
+def invalidate_counts(sender, **kwargs):
+    # renders in between must not cache the counts from before the change
+    transaction.on_commit(lambda: cache.delete(COUNTS_CACHE_KEY))
@@ -2,5 +2,7 @@
 
 python3 manage.py collectstatic --noinput
 python3 manage.py migrate --noinput
+python3 manage.py compile_feature_map
+python3 manage.py access_log_partitions ensure
 
 exec "$@"